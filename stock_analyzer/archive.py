@@ -0,0 +1,291 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from stock_analyzer import core
+from stock_analyzer.cache import COLUMNS as CANDLE_COLUMNS
+
+
+INDEX_FILENAME = 'index.json'
+
+# Every column is stored as little-endian float64, datetimes as raw epoch milliseconds
+DTYPE = np.dtype('<f8')
+
+
+class PriceArchive:
+    """Columnar on-disk store of candles for many symbols, read through memory maps
+
+    Each OHLCV field is one contiguous file of float64 values, shared by every symbol,
+    and an index maps each symbol to the extents of rows that hold its candles, in date
+    order. Reading a symbol whose candles are in one extent returns views of the mapped
+    files, so nothing is parsed or copied and processes reading the same archive share
+    the operating system's page cache instead of each holding a copy.
+
+    Candles are only ever appended. Rows are written and synced before the index that
+    refers to them replaces the old one, so readers and crashed writers never see a
+    partial append. One process may write at a time; any number may read.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.refresh()
+
+    def __getstate__(self):
+        # Worker processes map the files themselves rather than receiving copies
+        return {'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'])
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.extents
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _column_path(self, column: str, generation: int = None) -> str:
+        if generation is None:
+            generation = self.generation
+        return self._path(f"{column}.{generation}.f8")
+
+    def refresh(self) -> None:
+        """A function to pick up candles appended since the archive was opened."""
+
+        try:
+            with open(self._path(INDEX_FILENAME)) as index_file:
+                index = json.load(index_file)
+        except FileNotFoundError:
+            index = {'generation': 0, 'rows': 0, 'symbols': {}}
+
+        self.generation = index['generation']
+        self.rows = index['rows']
+        self.extents = {symbol: [tuple(extent) for extent in extents]
+                        for symbol, extents in index['symbols'].items()}
+        self._columns = {}
+
+    def _column(self, column: str) -> np.array:
+        if column not in self._columns:
+            if self.rows == 0:
+                return np.empty(0, dtype=DTYPE)
+            # Only map the rows the index refers to, not a partly written tail
+            self._columns[column] = np.memmap(self._column_path(column), dtype=DTYPE,
+                                              mode='r', shape=(self.rows,))
+
+        return self._columns[column]
+
+    def symbols(self) -> [str]:
+        """A function that lists the symbols in the archive."""
+
+        return sorted(self.extents)
+
+    def columns(self, symbol: str) -> dict:
+        """
+        A function to read every candle of a symbol, column by column.
+
+        :param symbol: A stock symbol. Example: 'AAPL'
+        :return: A dictionary of column name -> array, with epoch millisecond datetimes.
+                 The arrays are read-only views of the archive unless the symbol's
+                 candles were appended in several extents, see compact. None if the
+                 symbol isn't archived.
+        """
+
+        extents = self.extents.get(symbol)
+        if extents is None:
+            return None
+
+        if len(extents) == 1:
+            start, length = extents[0]
+            return {column: self._column(column)[start:start + length]
+                    for column in CANDLE_COLUMNS}
+
+        return {column: np.concatenate([self._column(column)[start:start + length]
+                                        for start, length in extents])
+                for column in CANDLE_COLUMNS}
+
+    def candles(self, symbol: str, num_entries_to_analyze: int = None,
+                end_date: str = "") -> core.Candles:
+        """
+        A function to read a symbol's most recent candles up to an end date.
+
+        :param symbol: A stock symbol. Example: 'AAPL'
+        :param num_entries_to_analyze: The number of candles. Every candle if None.
+        :param end_date: A date in the form mm-dd-yyyy. Now if empty.
+        :return: Candles whose price and volume columns are views of the archive. Only
+                 the datetimes are converted to Matplotlib dates in a new array. None if
+                 there are no candles.
+        """
+
+        columns = self.columns(symbol)
+        if columns is None:
+            return None
+
+        stop = int(np.searchsorted(columns['datetime'], core.end_date_millis(end_date),
+                                   side='right'))
+        if stop == 0:
+            return None
+        start = 0 if num_entries_to_analyze is None \
+            else max(stop - num_entries_to_analyze, 0)
+
+        return core.Candles(core.epoch2num(columns['datetime'][start:stop] / 1000),
+                            *(columns[column][start:stop]
+                              for column in CANDLE_COLUMNS[1:]))
+
+    def append(self, symbol: str, candles: np.array) -> int:
+        """
+        A function to add a symbol's new candles to the archive.
+
+        :param symbol: A stock symbol. Example: 'AAPL'
+        :param candles: An (n, 6) array of candles sorted by datetime, with epoch
+                        millisecond datetimes.
+        :return: The number of candles appended.
+        """
+
+        return self.append_many([(symbol, candles)])
+
+    def append_many(self, items) -> int:
+        """
+        A function to add the new candles of many symbols in one write.
+
+        Candles that aren't newer than a symbol's last archived candle are skipped, so
+        overlapping fetches can be appended as they are. A symbol whose candles were the
+        last ones written keeps growing in the same extent.
+
+        :param items: An iterable of (symbol, (n, 6) candle array) tuples, each sorted
+                      by datetime with epoch millisecond datetimes.
+        :return: The number of candles appended.
+        """
+
+        self.refresh()
+        extents = {symbol: list(symbol_extents)
+                   for symbol, symbol_extents in self.extents.items()}
+        last_datetimes = {}
+
+        blocks = []
+        rows = self.rows
+        for symbol, candles in items:
+            if candles is None or len(candles) == 0:
+                continue
+            candles = np.asarray(candles, dtype=DTYPE)
+
+            if symbol not in last_datetimes:
+                last_datetimes[symbol] = -np.inf
+                if symbol in extents:
+                    start, length = extents[symbol][-1]
+                    last_datetimes[symbol] = self._column('datetime')[start + length - 1]
+            candles = candles[candles[:, 0] > last_datetimes[symbol]]
+            if len(candles) == 0:
+                continue
+
+            symbol_extents = extents.setdefault(symbol, [])
+            if symbol_extents and sum(symbol_extents[-1]) == rows:
+                symbol_extents[-1] = (symbol_extents[-1][0],
+                                      symbol_extents[-1][1] + len(candles))
+            else:
+                symbol_extents.append((rows, len(candles)))
+
+            blocks.append(candles)
+            last_datetimes[symbol] = candles[-1, 0]
+            rows += len(candles)
+
+        if not blocks:
+            return 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        appended = np.concatenate(blocks)
+        for position, column in enumerate(CANDLE_COLUMNS):
+            path = self._column_path(column)
+            with open(path, 'ab') as column_file:
+                # Drop anything a crashed writer left past the indexed rows
+                column_file.truncate(self.rows * DTYPE.itemsize)
+                column_file.write(np.ascontiguousarray(appended[:, position]).tobytes())
+                column_file.flush()
+                os.fsync(column_file.fileno())
+
+        self._write_index(self.generation, rows, extents)
+
+        return len(appended)
+
+    def compact(self) -> None:
+        """A function to rewrite the archive so each symbol's candles are contiguous.
+
+        Symbols appended in several extents are read as copies until the archive is
+        compacted. The rewritten columns are new files, so readers that still have the
+        old ones mapped keep working until they refresh.
+        """
+
+        self.refresh()
+        if self.rows == 0:
+            return
+
+        symbols = self.symbols()
+        by_symbol = [self.columns(symbol) for symbol in symbols]
+        generation = self.generation + 1
+        for column in CANDLE_COLUMNS:
+            with open(self._column_path(column, generation), 'wb') as column_file:
+                for columns in by_symbol:
+                    column_file.write(np.ascontiguousarray(columns[column]).tobytes())
+                column_file.flush()
+                os.fsync(column_file.fileno())
+
+        extents = {}
+        start = 0
+        for symbol, columns in zip(symbols, by_symbol):
+            extents[symbol] = [(start, len(columns['datetime']))]
+            start += len(columns['datetime'])
+
+        previous = self.generation
+        self._write_index(generation, self.rows, extents)
+        for column in CANDLE_COLUMNS:
+            try:
+                os.remove(self._column_path(column, previous))
+            except FileNotFoundError:
+                pass
+
+    def update(self, source, symbols: [str], num_entries_to_analyze: int = 100_000,
+               **kwargs) -> int:
+        """
+        A function to fetch symbols from a price source and append their new candles.
+
+        :param source: A sources.PriceSource.
+        :param symbols: A list of stock symbols.
+        :param num_entries_to_analyze: The number of most recent candles fetched per
+                                       symbol. Must cover the candles since the last
+                                       update.
+        :param kwargs: Any other lookup_prices_many parameters, such as period_type,
+                       frequency_type or end_date.
+        :return: The number of candles appended.
+        """
+
+        batch = []
+        for symbol, price_history in source.lookup_prices_many(
+                symbols, num_entries_to_analyze=num_entries_to_analyze, as_frame=False,
+                **kwargs):
+            if price_history is None:
+                continue
+            candles = np.array(price_history, dtype=DTYPE)
+            candles[:, 0] = np.round(candles[:, 0] * 24 * 60 * 60 * 1000)
+            batch.append((symbol, candles))
+
+        return self.append_many(batch)
+
+    def _write_index(self, generation: int, rows: int, extents: dict) -> None:
+        index = {'generation': generation, 'rows': rows,
+                 'symbols': {symbol: [list(extent) for extent in symbol_extents]
+                             for symbol, symbol_extents in sorted(extents.items())}}
+
+        # Write to a temporary file first so readers never see a partial index
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'w') as temp_file:
+                json.dump(index, temp_file)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, self._path(INDEX_FILENAME))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self.refresh()
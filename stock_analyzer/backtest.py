@@ -0,0 +1,192 @@
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+from stock_analyzer import core, stream
+
+
+def backtest(symbol: str, price_history: pd.DataFrame, patterns: [core.Pattern],
+             window: int = 40, n: int = 2, chunk_size: int = 2048,
+             fitter: str = 'pairs', incremental: bool = False):
+    """
+    A generator that replays pattern detection over a long price history.
+
+    A window of candles slides forward one bar at a time, and every position is analyzed
+    as if it were the most recent data. By default windows are processed in chunks: all
+    windows of a chunk are smoothed in a single Savitzky-Golay call, their trendlines
+    are fitted together and they are classified against every pattern in one array
+    operation, instead of rerunning the whole pipeline once per bar. This redoes the
+    work each window shares with the previous one, but keeps it in a few large array
+    operations and works with either fitter.
+
+    With incremental, the walk forward instead updates a stream.SymbolStream one candle
+    at a time, which only recomputes what the new candle changes. Both give the same
+    detections.
+
+    :param symbol: A stock symbol. Example: 'AAPL'
+    :param price_history: A Pandas Dataframe as returned by core.lookup_prices, covering
+                          the whole period to backtest.
+    :param patterns: List of Pattern objects to detect.
+    :param window: The number of candles analyzed at each position.
+    :param n: The number of entries scanned for local minima/maxima.
+    :param chunk_size: The number of windows analyzed together.
+    :param fitter: The trendline fitter, 'pairs' or 'hull'. See core.best_fit_line.
+    :param incremental: Walk forward with a stream.SymbolStream. Only for the pairs
+                        fitter.
+    :return: Yields one dictionary per detected pattern, in date order.
+    """
+
+    if incremental and fitter != 'pairs':
+        raise ValueError(f"Incremental backtests need the pairs fitter, not {fitter}")
+
+    if price_history is None or len(price_history) < window:
+        return
+
+    if incremental:
+        yield from _walk_forward(symbol, price_history, patterns, window, n)
+        return
+
+    matcher = core.compile_patterns(patterns)
+    datetimes = np.asarray(price_history['datetime'], dtype=float)
+    highs = np.lib.stride_tricks.sliding_window_view(
+        np.asarray(price_history['high'], dtype=float), window)
+    lows = np.lib.stride_tricks.sliding_window_view(
+        np.asarray(price_history['low'], dtype=float), window)
+    closes = np.lib.stride_tricks.sliding_window_view(
+        np.asarray(price_history['close'], dtype=float), window)
+
+    for chunk_start in range(0, len(highs), chunk_size):
+        chunk_highs = highs[chunk_start:chunk_start + chunk_size]
+        chunk_lows = lows[chunk_start:chunk_start + chunk_size]
+
+        extrema = core.get_supports_and_resistances_many(chunk_highs, chunk_lows, n)
+        support_points = [support for support, _ in extrema]
+        resistance_points = [resistance for _, resistance in extrema]
+
+        support_lines = core.best_fit_lines(chunk_lows, support_points, fitter=fitter)
+        resistance_lines = core.best_fit_lines(chunk_highs, resistance_points, False,
+                                               fitter)
+
+        found = matcher.match_lines(support_lines, resistance_lines, window,
+                                    support_points, resistance_points,
+                                    closes[chunk_start:chunk_start + chunk_size])
+
+        for row, pattern_index in zip(*np.nonzero(found)):
+            support = support_lines[row]
+            resistance = resistance_lines[row]
+            if support is None or resistance is None:
+                continue
+
+            pattern = matcher.patterns[pattern_index]
+            last_candle = chunk_start + row + window - 1
+            for breakout in pattern.breakouts:
+                trade = core.get_trade_criteria(pattern.pattern_name, support, resistance,
+                                                breakout=breakout)
+                yield _detection(symbol, last_candle, datetimes[last_candle], support,
+                                 resistance, trade)
+
+
+def _walk_forward(symbol: str, price_history, patterns: [core.Pattern], window: int,
+                  n: int):
+    """Backtests by feeding the candles to a stream.SymbolStream one at a time."""
+
+    candles = np.column_stack([np.asarray(price_history[column], dtype=float)
+                               for column in core.Candles.columns])
+    datetimes = candles[:, 0].copy()
+    # Streams take epoch millisecond datetimes, price histories have Matplotlib dates
+    candles[:, 0] = np.round(candles[:, 0] * 24 * 60 * 60 * 1000)
+
+    symbol_stream = stream.SymbolStream(symbol, patterns, window, n)
+    for index, candle in enumerate(candles):
+        symbol_stream.update(candle)
+        chart = symbol_stream.chart
+        if chart is None:
+            continue
+
+        for trade in chart.detected_patterns:
+            yield _detection(symbol, index, datetimes[index], chart.support,
+                             chart.resistance, trade)
+
+
+def _detection(symbol: str, index: int, datetime: float, support: core.TrendLine,
+               resistance: core.TrendLine, trade: core.TradeCriteria) -> dict:
+    return {
+        'symbol': symbol,
+        'index': index,
+        'datetime': datetime,
+        'pattern_name': trade.pattern_name,
+        'breakout': trade.breakout,
+        'support_b': float(support.b),
+        'support_m': float(support.m),
+        'resistance_b': float(resistance.b),
+        'resistance_m': float(resistance.m),
+        'buy_price': float(trade.buy_price),
+        'sell_price': float(trade.sell_price),
+        'stop_price': float(trade.stop_price),
+    }
+
+
+def backtest_many(price_histories, patterns: [core.Pattern], processes: int = None,
+                  **kwargs):
+    """
+    A generator that backtests many symbols on a process pool.
+
+    :param price_histories: An iterable of (symbol, Pandas Dataframe) tuples.
+    :param patterns: List of Pattern objects to detect.
+    :param processes: The number of worker processes. Defaults to the number of CPUs.
+    :param kwargs: Any other backtest parameters.
+    :return: Yields (symbol, list of detection dictionaries) tuples as symbols finish.
+    """
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(_backtest_list, symbol, price_history, patterns,
+                                   **kwargs): symbol
+                   for symbol, price_history in price_histories}
+
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], future.result()
+
+
+def _backtest_list(symbol, price_history, patterns, **kwargs):
+    return list(backtest(symbol, price_history, patterns, **kwargs))
+
+
+def backtest_archive(directory: str, symbols: [str], patterns: [core.Pattern],
+                     processes: int = None, **kwargs):
+    """
+    A generator that backtests symbols of a PriceArchive on a process pool.
+
+    Workers are only sent the symbol and read its candles from the archive themselves,
+    so every process shares the memory-mapped files instead of receiving a copy of each
+    price history.
+
+    :param directory: The directory of the archive.
+    :param symbols: A list of stock symbols. Symbols that aren't archived are skipped.
+    :param patterns: List of Pattern objects to detect.
+    :param processes: The number of worker processes. Defaults to the number of CPUs.
+    :param kwargs: Any other backtest parameters.
+    :return: Yields (symbol, list of detection dictionaries) tuples as symbols finish.
+    """
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(_backtest_archived, directory, symbol, patterns,
+                                   **kwargs): symbol
+                   for symbol in symbols}
+
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], future.result()
+
+
+# Archives opened by this worker process, by directory
+_archives = {}
+
+
+def _backtest_archived(directory, symbol, patterns, **kwargs):
+    from stock_analyzer.archive import PriceArchive
+
+    if directory not in _archives:
+        _archives[directory] = PriceArchive(directory)
+
+    return _backtest_list(symbol, _archives[directory].candles(symbol), patterns,
+                          **kwargs)
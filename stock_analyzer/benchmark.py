@@ -0,0 +1,266 @@
+"""
+Benchmarks for the analysis pipeline, run on synthetic prices
+
+Usage:
+    python -m stock_analyzer.benchmark [--quick] [--only=TEXT] [--save=FILE]
+                                       [--baseline=FILE] [--tolerance=FRACTION]
+
+Options:
+    -q --quick Skip the largest scales
+    --only Only run benchmarks whose name contains TEXT
+    --save Write the results to FILE as JSON, to use as a baseline later
+    --baseline Compare against the results in FILE and exit with status 1 if any
+               benchmark got slower by more than the tolerance
+    --tolerance Allowed slowdown before a benchmark is flagged. Default is 0.25 (25%).
+"""
+
+import getopt
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from stock_analyzer import core, scan, stream, synthetic
+
+
+def _extrema(length):
+    prices = synthetic.synthetic_prices(length, 'noise')
+    return lambda: core.get_supports_and_resistances(prices, 2)
+
+
+def _extrema_many(n_symbols):
+    universe = synthetic.synthetic_universe(n_symbols)
+    highs = np.array([prices['high'] for prices in universe.values()])
+    lows = np.array([prices['low'] for prices in universe.values()])
+    return lambda: core.get_supports_and_resistances_many(highs, lows, 2)
+
+
+def _best_fit_line(length):
+    prices = synthetic.synthetic_prices(length, 'noise')
+    support_points, _ = core.get_supports_and_resistances(prices, 2)
+    return lambda: core.best_fit_line(prices['low'], support_points)
+
+
+def _hull_fit_line(length):
+    prices = synthetic.synthetic_prices(length, 'noise')
+    support_points, _ = core.get_supports_and_resistances(prices, 2)
+    return lambda: core.best_fit_line(prices['low'], support_points, fitter='hull')
+
+
+def _best_fit_lines(n_symbols):
+    universe = synthetic.synthetic_universe(n_symbols)
+    lows = np.array([prices['low'] for prices in universe.values()])
+    support_points = [core.get_supports_and_resistances(prices, 2)[0]
+                      for prices in universe.values()]
+    return lambda: core.best_fit_lines(lows, support_points)
+
+
+def _fitted_lines(n_symbols):
+    charts = [scan.analyze(symbol, prices, [])
+              for symbol, prices in synthetic.synthetic_universe(n_symbols).items()]
+
+    def line(record):
+        return None if record is None else core.TrendLine(
+            record['b'], record['m'], record['touches'], record['first_day'])
+
+    return [line(chart['support']) for chart in charts], \
+           [line(chart['resistance']) for chart in charts]
+
+
+def _detect_pattern(n_symbols):
+    patterns = core.load_patterns()
+    supports, resistances = _fitted_lines(n_symbols)
+
+    def run():
+        for support, resistance in zip(supports, resistances):
+            core.Chart('SYN', range(40), support, resistance, [], [], patterns,
+                       verbose=False)
+
+    return run
+
+
+def _match_patterns(n_symbols):
+    matcher = core.compile_patterns(core.load_patterns())
+    supports, resistances = _fitted_lines(n_symbols)
+    return lambda: matcher.match_lines(supports, resistances, 40)
+
+
+def _match_library(copies):
+    # Matching a library many times the size of the shipped one against the same charts
+    matcher = core.PatternMatcher(core.load_patterns() * copies)
+    features = core.line_features(*_fitted_lines(5_000), 40)
+    return lambda: matcher.match_features(features)
+
+
+def _pipeline(n_symbols):
+    patterns = core.load_patterns()
+    universe = synthetic.synthetic_universe(n_symbols)
+
+    def run():
+        for symbol, prices in universe.items():
+            scan.analyze(symbol, prices, patterns)
+
+    return run
+
+
+def _stream(n_symbols):
+    patterns = core.load_patterns()
+    candles = {}
+    for symbol, prices in synthetic.synthetic_universe(n_symbols, length=200).items():
+        candles[symbol] = prices.to_numpy(dtype=float, copy=True)
+        candles[symbol][:, 0] *= 86_400_000
+
+    return lambda: list(stream.watch(stream.ReplayFeed(candles), patterns))
+
+
+def _startup(arguments):
+    command = [sys.executable, '-W', 'ignore'] + arguments
+    return lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+
+# (name, setup, argument, repeats, included in --quick)
+#
+# There is no best_fit_line_100k. The pairs fitter tests every pair of derivative points
+# against every price, and 100k noise prices have about 23k derivative points: 2.6e8
+# pairs times 1e5 prices, roughly three days at the 1e8 tests a second measured at 3k.
+# best_fit_line_3k is the longest history it runs in seconds, and hull_fit_line_100k
+# covers long histories.
+BENCHMARKS = [
+    ('startup_version', _startup, ['-m', 'stock_analyzer.cli', '--version'], 5, True),
+    ('startup_import_core', _startup, ['-c', 'import stock_analyzer.core'], 5, True),
+    ('extrema_40', _extrema, 40, 20, True),
+    ('extrema_1k', _extrema, 1_000, 10, True),
+    ('extrema_100k', _extrema, 100_000, 3, False),
+    ('extrema_many_5000x40', _extrema_many, 5_000, 3, False),
+    ('best_fit_line_40', _best_fit_line, 40, 20, True),
+    ('best_fit_line_1k', _best_fit_line, 1_000, 3, True),
+    ('best_fit_line_3k', _best_fit_line, 3_000, 1, False),
+    ('hull_fit_line_1k', _hull_fit_line, 1_000, 10, True),
+    ('hull_fit_line_100k', _hull_fit_line, 100_000, 3, False),
+    ('best_fit_lines_5000x40', _best_fit_lines, 5_000, 3, False),
+    ('detect_pattern_1', _detect_pattern, 1, 20, True),
+    ('detect_pattern_5000', _detect_pattern, 5_000, 3, False),
+    ('match_patterns_5000', _match_patterns, 5_000, 10, False),
+    ('match_library_5000x10', _match_library, 10, 10, False),
+    ('pipeline_1', _pipeline, 1, 20, True),
+    ('pipeline_100', _pipeline, 100, 3, True),
+    ('pipeline_5000', _pipeline, 5_000, 1, False),
+    ('stream_100x200', _stream, 100, 3, True),
+]
+
+
+def time_call(function, repeats: int = 3) -> float:
+    """
+    A function that times a callable.
+
+    :param function: A callable taking no arguments.
+    :param repeats: The number of times to call it.
+    :return: The fastest time of all calls, in seconds.
+    """
+
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def run_benchmarks(quick: bool = False, only: str = None) -> dict:
+    """
+    A function that runs the benchmark suite.
+
+    :param quick: Skip the largest scales.
+    :param only: Only run benchmarks whose name contains this text.
+    :return: A dictionary of benchmark name -> fastest time in seconds.
+    """
+
+    results = {}
+    for name, setup, argument, repeats, in_quick in BENCHMARKS:
+        if (quick and not in_quick) or (only and only not in name):
+            continue
+
+        results[name] = time_call(setup(argument), repeats)
+
+    return results
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float = 0.25) -> list:
+    """
+    A function that compares benchmark results against a baseline.
+
+    :param results: A dictionary of benchmark name -> seconds.
+    :param baseline: A dictionary of benchmark name -> seconds from an earlier run.
+    :param tolerance: Allowed slowdown, as a fraction of the baseline time.
+    :return: A list of (name, baseline seconds, seconds) tuples for every benchmark that
+             got slower than allowed.
+    """
+
+    return [(name, baseline[name], seconds) for name, seconds in results.items()
+            if name in baseline and seconds > baseline[name] * (1 + tolerance)]
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "qh", ["quick", "only=", "save=",
+                                                        "baseline=", "tolerance=",
+                                                        "help"])
+    except getopt.GetoptError:
+        sys.exit(2)
+
+    quick = False
+    only = None
+    save_path = None
+    baseline_path = None
+    tolerance = 0.25
+
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif opt in ('-q', '--quick'):
+            quick = True
+        elif opt == '--only':
+            only = arg
+        elif opt == '--save':
+            save_path = arg
+        elif opt == '--baseline':
+            baseline_path = arg
+        elif opt == '--tolerance':
+            tolerance = float(arg)
+
+    baseline = {}
+    if baseline_path:
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    results = run_benchmarks(quick, only)
+
+    print(f"{'benchmark':<28}{'seconds':>12}{'baseline':>12}{'change':>10}")
+    for name, seconds in results.items():
+        if name in baseline:
+            change = f"{(seconds / baseline[name] - 1) * 100:+.1f}%"
+            print(f"{name:<28}{seconds:>12.6f}{baseline[name]:>12.6f}{change:>10}")
+        else:
+            print(f"{name:<28}{seconds:>12.6f}")
+
+    if save_path:
+        with open(save_path, 'w') as save_file:
+            json.dump({'python': platform.python_version(), 'numpy': np.__version__,
+                       'machine': platform.machine(), 'results': results},
+                      save_file, indent=2)
+
+    regressions = find_regressions(results, baseline, tolerance)
+    for name, baseline_seconds, seconds in regressions:
+        print(f"Regression: {name} took {seconds:.6f}s, baseline {baseline_seconds:.6f}s")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
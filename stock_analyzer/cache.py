@@ -0,0 +1,139 @@
+import os
+import tempfile
+
+import numpy as np
+
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'stock_analyzer',
+                                 'candles')
+
+# Column order of the cached candle arrays. Datetimes are raw epoch milliseconds.
+COLUMNS = ['datetime', 'open', 'high', 'low', 'close', 'volume']
+
+
+class CandleCache:
+    """On-disk store of raw candles per symbol and frequency, evicted least recently used
+
+    Each entry holds the candles fetched so far for one (symbol, frequency_type,
+    frequency) and the end date, in epoch milliseconds, that they are complete up to.
+    """
+
+    def __init__(self, directory: str = DEFAULT_DIRECTORY,
+                 max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, symbol: str, frequency_type: str, frequency: int) -> str:
+        return os.path.join(self.directory,
+                            f"{symbol.upper()}_{frequency}_{frequency_type}.npz")
+
+    def load(self, symbol: str, frequency_type: str, frequency: int) -> (np.array, int):
+        """A function to read a symbol's cached candles.
+
+        :param symbol: A stock symbol. Example: 'AAPL'
+        :param frequency_type: The type of frequency, as passed to lookup_prices.
+        :param frequency: The number of frequency types in 1 data point.
+        :return: A tuple of an (n, 6) array of candles sorted by datetime and the epoch
+                 milliseconds they are complete up to. (None, 0) if nothing is cached.
+        """
+
+        path = self._path(symbol, frequency_type, frequency)
+        try:
+            with np.load(path) as entry:
+                candles = entry['candles']
+                fetched_until = int(entry['fetched_until'])
+        except (OSError, KeyError, ValueError):
+            return None, 0
+
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return candles, fetched_until
+
+    def store(self, symbol: str, frequency_type: str, frequency: int,
+              candles: np.array, fetched_until: int) -> None:
+        """A function to write a symbol's candles, replacing any cached entry.
+
+        :param symbol: A stock symbol. Example: 'AAPL'
+        :param frequency_type: The type of frequency, as passed to lookup_prices.
+        :param frequency: The number of frequency types in 1 data point.
+        :param candles: An (n, 6) array of candles sorted by datetime.
+        :param fetched_until: The epoch milliseconds the candles are complete up to.
+        :return: None.
+        """
+
+        path = self._path(symbol, frequency_type, frequency)
+
+        # Write to a temporary file first so readers never see a partial entry
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as temp_file:
+                np.savez(temp_file, candles=candles, fetched_until=fetched_until)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self.evict()
+
+    def invalidate(self, symbol: str = None) -> None:
+        """A function to delete cached entries.
+
+        :param symbol: Only delete this symbol's entries. Deletes everything if None.
+        :return: None.
+        """
+
+        for filename in os.listdir(self.directory):
+            if symbol is None or filename.startswith(f"{symbol.upper()}_"):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass
+
+    def evict(self) -> None:
+        """A function to delete the least recently used entries until under max_bytes."""
+
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+
+def merge_candles(cached: np.array, fetched: np.array) -> np.array:
+    """A function to combine two candle arrays, preferring fetched rows on duplicates.
+
+    :param cached: An (n, 6) array of candles, or None.
+    :param fetched: An (m, 6) array of candles, or None.
+    :return: An array of candles with unique datetimes, sorted by datetime.
+    """
+
+    if cached is None or len(cached) == 0:
+        return fetched
+    if fetched is None or len(fetched) == 0:
+        return cached
+
+    # Reverse so np.unique keeps the fetched copy of any repeated datetime
+    combined = np.concatenate([cached, fetched])[::-1]
+    _, first = np.unique(combined[:, 0], return_index=True)
+
+    return combined[first]
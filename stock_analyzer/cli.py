@@ -1,6 +1,7 @@
 import getopt
 import sys
-from stock_analyzer import core
+import time
+from stock_analyzer.instrument import instrumentation
 
 
 def main():
@@ -13,6 +14,30 @@ def main():
         cli.py -v|--version
         cli.py -e|--endDate
         cli.py -s|--symbol
+        cli.py --no-cache
+        cli.py --clear-cache
+        cli.py --scan [--symbols=LIST] [--output=FILE] [--processes=N]
+        cli.py --replay=DIR
+        cli.py --ingest=FILE [--output=FILE] [--processes=N]
+        cli.py --archive=DIR --update-archive [--symbols=LIST] [--replay=DIR]
+        cli.py --scan --archive=DIR
+        cli.py --scan --timeframes=LIST
+        cli.py --stream (--feed=HOST:PORT | --replay=DIR) [--symbols=LIST]
+        cli.py --fitter=NAME
+        cli.py --sweep [--entries=LIST] [--n=LIST] [--margin=LIST] """\
+                  """[--height-ratio=LIST] [--buy-threshold=LIST] [--symbols=LIST] """\
+                  """[--output=FILE]
+        cli.py --simulate [--history=N] [--entry-bars=N] [--max-holding=N] """\
+                  """[--symbols=LIST] [--output=FILE]
+        cli.py --scan --coordinator=FILE [--shard-size=N] [--output=FILE]
+        cli.py --worker=FILE [--lease=SECONDS] [--processes=N]
+        cli.py (--scan | -a) --journal=FILE [--retries=N]
+        cli.py --scan --store=FILE
+        cli.py --query --store=FILE [--pattern=NAME] [--days=N] [--min-profit=PCT] """\
+                  """[--max-apex=N] [--symbols=LIST] [--output=FILE]
+        cli.py --universe=LIST [--sectors=LIST] [--refresh-universe]
+        cli.py --instrument [--metrics=FILE]
+        cli.py --scan --charts=DIR [--chart-format=FORMAT] [--all-charts]
 
     Options:
         -h --help Show this screen
@@ -20,12 +45,114 @@ def main():
         -e --endDate Last day of data being requested. Default is today.
         -s --symbol Stock symbol you want to analyze. If not provided, you will be """\
                   """prompted for it.
-        -a --all Runs for all S&P 500 stocks
+        -a --all Runs for all stocks of the universe, S&P 500 by default
+        --no-cache Always download the full price history, bypassing the candle cache
+        --clear-cache Delete all cached candles before running
+        --scan Analyze without drawing charts, writing one result per symbol
+        --symbols Comma separated symbols to scan. Default is all stocks of the """\
+                  """universe.
+        --output File to write scan results to. A .csv file gets CSV, anything else """\
+                  """gets JSON Lines. Default is JSON Lines on stdout.
+        --processes Number of worker processes for a scan. Default is one per CPU.
+        --replay Read prices from <SYMBOL>.csv or <SYMBOL>.parquet files in DIR """\
+                  """instead of the Ameritrade API
+        --archive Read prices from the memory-mapped price archive in DIR """\
+                  """instead of the Ameritrade API
+        --update-archive Fetch prices, from the Ameritrade API or --replay, and """\
+                  """append the new candles to the --archive
+        --ingest Scan the most recent candles of every symbol in a CSV or NDJSON """\
+                  """dump, read a chunk at a time
+        --timeframes Comma separated timeframes for a scan to compare, such as """\
+                  """hourly,daily,weekly. Prices are fetched once at the finest and """\
+                  """resampled to the others.
+        --stream Watch a live feed and write an alert each time a pattern is """\
+                  """detected, until the feed ends
+        --feed HOST:PORT of a feed sending JSON Lines bars or ticks. Without it, """\
+                  """--stream replays the files in the --replay directory.
+        --fitter How trendlines are fitted: pairs tests every pair of local """\
+                  """minima/maxima, hull only tests the edges of the convex hull of """\
+                  """the prices and is much faster on long histories. Default is pairs.
+        --sweep Analyze every combination of the swept parameters and print a """\
+                  """table of detections per combination. --output gets one CSV row """\
+                  """per symbol and combination.
+        --entries Numbers of candles to analyze for --sweep. Default is 40.
+        --n Numbers of entries scanned for local minima/maxima for --sweep. """\
+                  """Default is 2.
+        --margin Trendline margins, as fractions of the price range, for --sweep. """\
+                  """Default is 0.05.
+        --height-ratio Target heights, as fractions of the triangle height, for """\
+                  """--sweep. Default is 0.7.
+        --buy-threshold Buy prices above resistance, as fractions of the triangle """\
+                  """height, for --sweep. Default is 0.01. Sweep values are comma """\
+                  """separated, or START:STOP:STEP ranges including STOP.
+        --simulate Backtest every symbol and simulate the trade of each """\
+                  """detection, printing a table of outcomes per pattern. --output """\
+                  """gets one CSV row per detection.
+        --history Number of daily candles to backtest for --simulate. Default is """\
+                  """1000.
+        --entry-bars Number of candles an order waits to be filled for --simulate. """\
+                  """Default is 5.
+        --max-holding Number of candles a trade is held for at most if neither """\
+                  """its target nor its stop is reached, for --simulate. Default is 40.
+        --universe Comma separated universes to merge for --all, --scan, """\
+                  """--sweep and --simulate: sp500, CSV files with a symbol column, """\
+                  """or watchlist files of symbols. Default is sp500, downloaded at """\
+                  """most once a week.
+        --sectors Comma separated sectors of the universe to keep, such as """\
+                  """"Information Technology,Energy"
+        --refresh-universe Download the universe even if the cached copy is recent
+        --coordinator Split a scan into shards on the SQLite work queue FILE, wait """\
+                  """for workers to scan them and write the merged results
+        --shard-size Number of symbols per shard of a --coordinator scan. """\
+                  """Default is 50.
+        --worker Scan shards from the SQLite work queue FILE until all are done. """\
+                  """Any number of workers can share a queue, on this or other hosts.
+        --lease Seconds a worker holds a shard for before it is handed to another """\
+                  """worker, unless renewed. Default is 300.
+        --journal Record each finished symbol of a --scan or --all run in FILE, so """\
+                  """running it again resumes where it stopped. Failed symbols are """\
+                  """retried on up to 3 runs.
+        --retries Number of times a symbol's lookup is retried after a connection """\
+                  """error, with exponential backoff. Default is 3.
+        --store SQLite file a scan stores its detected patterns in, or that """\
+                  """--query reads them from. Not available with --timeframes.
+        --query Find stored detections, most recent first
+        --pattern Only detections of this pattern, such as "Ascending Triangle"
+        --days Only detections from the last N days
+        --min-profit Only detections with a profit margin above PCT percent
+        --max-apex Only detections whose trendlines meet within N candles
+        --instrument Time each stage of the run and print a summary when it ends
+        --metrics File to write the instrumentation totals to, as JSON for a .json """\
+                  """file and Prometheus text otherwise. Implies --instrument.
+        --charts Directory a scan renders charts of symbols with a detected pattern to
+        --chart-format Image format of rendered charts, such as png or svg. Default """\
+                  """is png.
+        --all-charts Render charts for every scanned symbol, not only those with a """\
+                  """detected pattern
     
     Examples:
         cli.py -s AAPL
         cli.py --endDate=12-1-2020 --symbol=CHTR
         cli.py -a
+        cli.py --scan --output=scan.csv
+        cli.py --scan --symbols=AAPL,MSFT,CHTR
+        cli.py --scan --symbols=AAPL,MSFT --replay=./prices
+        cli.py --ingest=candles.ndjson.gz --output=scan.csv
+        cli.py --archive=./archive --update-archive --replay=./minute-prices
+        cli.py --scan --archive=./archive --output=scan.csv
+        cli.py --scan --symbols=AAPL,MSFT --timeframes=daily,weekly,monthly
+        cli.py --stream --feed=localhost:9000 --output=alerts.jsonl
+        cli.py --scan --fitter=hull --replay=./minute-prices
+        cli.py --sweep --symbols=AAPL,MSFT --n=2,4,6 --margin=0.03:0.07:0.01
+        cli.py --simulate --replay=./prices --max-holding=20 --output=trades.csv
+        cli.py --scan --universe=sp500,watchlist.txt --sectors=Energy
+        cli.py --scan --coordinator=/shared/queue.db --output=scan.csv
+        cli.py --worker=/shared/queue.db
+        cli.py --scan --journal=scan.journal --output=scan.csv
+        cli.py --scan --store=results.db
+        cli.py --query --store=results.db --pattern="Ascending Triangle" --days=30 """\
+                  """--min-profit=8 --max-apex=5
+        cli.py --scan --charts=./charts --chart-format=svg
     """
 
     argv = sys.argv
@@ -36,11 +163,68 @@ def main():
     try:
         opts, args = getopt.getopt(argv[1:], "es:hva", ["help", "endDate=",
                                                         "symbol=", "version",
-                                                        "all"])
+                                                        "all", "no-cache",
+                                                        "clear-cache", "scan",
+                                                        "symbols=", "output=",
+                                                        "processes=", "replay=",
+                                                        "archive=", "update-archive",
+                                                        "instrument", "metrics=",
+                                                        "charts=", "chart-format=",
+                                                        "all-charts", "ingest=",
+                                                        "timeframes=", "stream",
+                                                        "feed=", "fitter=", "sweep",
+                                                        "entries=", "n=", "margin=",
+                                                        "height-ratio=",
+                                                        "buy-threshold=", "universe=",
+                                                        "sectors=",
+                                                        "refresh-universe",
+                                                        "coordinator=", "worker=",
+                                                        "shard-size=", "lease=",
+                                                        "journal=", "retries=",
+                                                        "store=", "query", "pattern=",
+                                                        "days=", "min-profit=",
+                                                        "max-apex=", "simulate",
+                                                        "history=", "entry-bars=",
+                                                        "max-holding="])
     except getopt.GetoptError:
         sys.exit(2)
 
     get_all = False
+    use_cache = True
+    clear_cache = False
+    run_scan = False
+    scan_symbols = None
+    output_path = None
+    processes = None
+    replay_directory = None
+    archive_directory = None
+    update_archive = False
+    instrument = False
+    metrics_path = None
+    chart_directory = None
+    chart_format = 'png'
+    detected_only = True
+    ingest_path = None
+    timeframes = None
+    run_stream = False
+    feed_address = None
+    fitter = 'pairs'
+    run_sweep = False
+    run_simulate = False
+    simulate_parameters = {}
+    sweep_values = {}
+    universes = ['sp500']
+    sectors = None
+    refresh_universe = False
+    coordinator_path = None
+    worker_path = None
+    shard_size = 50
+    lease_seconds = 300
+    journal_path = None
+    retries = 3
+    store_path = None
+    run_query = False
+    query = {}
 
     for opt, arg in opts:
         if opt in ('-h', '--help'):
@@ -56,38 +240,372 @@ def main():
             sys.exit(0)
         elif opt in ('-a', '--all'):
             get_all = True
+        elif opt == '--no-cache':
+            use_cache = False
+        elif opt == '--clear-cache':
+            clear_cache = True
+        elif opt == '--scan':
+            run_scan = True
+        elif opt == '--symbols':
+            scan_symbols = [symbol.strip().upper() for symbol in arg.split(',')
+                            if symbol.strip()]
+        elif opt == '--output':
+            output_path = arg
+        elif opt == '--processes':
+            processes = int(arg)
+        elif opt == '--replay':
+            replay_directory = arg
+        elif opt == '--archive':
+            archive_directory = arg
+        elif opt == '--update-archive':
+            update_archive = True
+        elif opt == '--instrument':
+            instrument = True
+        elif opt == '--metrics':
+            instrument = True
+            metrics_path = arg
+        elif opt == '--charts':
+            chart_directory = arg
+        elif opt == '--chart-format':
+            chart_format = arg
+        elif opt == '--all-charts':
+            detected_only = False
+        elif opt == '--ingest':
+            ingest_path = arg
+        elif opt == '--timeframes':
+            timeframes = [timeframe.strip() for timeframe in arg.split(',')
+                          if timeframe.strip()]
+        elif opt == '--stream':
+            run_stream = True
+        elif opt == '--feed':
+            feed_address = arg
+        elif opt == '--fitter':
+            fitter = arg
+        elif opt == '--sweep':
+            run_sweep = True
+        elif opt in ('--entries', '--n', '--margin', '--height-ratio',
+                     '--buy-threshold'):
+            sweep_values[opt] = arg
+        elif opt == '--simulate':
+            run_simulate = True
+        elif opt in ('--history', '--entry-bars', '--max-holding'):
+            simulate_parameters[opt[2:].replace('-', '_')] = int(arg)
+        elif opt == '--universe':
+            universes = [name.strip() for name in arg.split(',') if name.strip()]
+        elif opt == '--sectors':
+            sectors = arg.split(',')
+        elif opt == '--refresh-universe':
+            refresh_universe = True
+        elif opt == '--coordinator':
+            coordinator_path = arg
+        elif opt == '--worker':
+            worker_path = arg
+        elif opt == '--shard-size':
+            shard_size = int(arg)
+        elif opt == '--lease':
+            lease_seconds = float(arg)
+        elif opt == '--journal':
+            journal_path = arg
+        elif opt == '--retries':
+            retries = int(arg)
+        elif opt == '--store':
+            store_path = arg
+        elif opt == '--query':
+            run_query = True
+        elif opt == '--pattern':
+            query['pattern_name'] = arg
+        elif opt == '--days':
+            query['since'] = int((time.time() - float(arg) * 24 * 60 * 60) * 1000)
+        elif opt == '--min-profit':
+            query['min_profit_margin'] = float(arg)
+        elif opt == '--max-apex':
+            query['max_apex'] = float(arg)
 
-    patterns = core.load_patterns()
+    # Deferred until here so --help and --version don't pay for the analysis imports
+    from stock_analyzer import config, core, sources
 
-    if get_all:
-        stocks = core.get_s_and_p_500()
-        for stock in stocks['symbol']:
-            stock_symbol = stock
-            generate_chart(stock_symbol, end_date, patterns)
+    if fitter not in core.FITTERS:
+        print(f"Unknown fitter {fitter}, expected one of {', '.join(core.FITTERS)}")
+        sys.exit(2)
+
+    if update_archive and archive_directory is None:
+        print("--update-archive needs --archive=DIR")
+        sys.exit(2)
+
+    if run_query and store_path is None:
+        print("--query needs --store=FILE")
+        sys.exit(2)
+
+    if store_path is not None and timeframes:
+        print("--store can't be used with --timeframes")
+        sys.exit(2)
+
+    if run_sweep:
+        from stock_analyzer import sweep
+
+        parameters = {'--entries': ('num_entries_to_analyze', int), '--n': ('n', int),
+                      '--margin': ('margin', float),
+                      '--height-ratio': ('height_ratio', float),
+                      '--buy-threshold': ('buy_threshold', float)}
+        try:
+            sweep_values = {parameters[opt][0]: sweep.parse_values(arg,
+                                                                   parameters[opt][1])
+                            for opt, arg in sweep_values.items()}
+        except ValueError:
+            print("Sweep values must be comma separated numbers or START:STOP:STEP")
+            sys.exit(2)
+
+    cache = None
+    if use_cache or clear_cache:
+        from stock_analyzer.cache import CandleCache
+        cache = CandleCache()
+        if clear_cache:
+            cache.invalidate()
+        if not use_cache:
+            cache = None
+
+    if replay_directory:
+        source = sources.ReplaySource(replay_directory)
+    elif archive_directory and not update_archive:
+        source = sources.ArchiveSource(archive_directory)
     else:
-        if not stock_symbol:
-            stock_symbol = input("Enter stock symbol: ")
+        source = sources.AmeritradeSource(cache=cache)
+
+    if instrument:
+        instrumentation.enabled = True
+
+    try:
+        patterns = core.load_patterns()
+
+        if update_archive:
+            from stock_analyzer.archive import PriceArchive
+
+            if scan_symbols is None:
+                scan_symbols = source.symbols() if replay_directory \
+                    else universe_symbols(universes, sectors, refresh_universe)
+            appended = PriceArchive(archive_directory).update(source, scan_symbols,
+                                                              end_date=end_date)
+            print(f"Appended {appended} candles to {archive_directory}")
+        elif run_query:
+            from stock_analyzer import store
+
+            with store.ResultStore(store_path) as result_store:
+                records = result_store.query(symbols=scan_symbols, **query)
+            store.write_results(records, output_path)
+        elif run_stream:
+            from stock_analyzer import scan, stream
+
+            if feed_address:
+                host, port = feed_address.rsplit(':', 1)
+                feed = stream.SocketFeed(host, int(port))
+            elif replay_directory:
+                feed = stream.ReplayFeed({symbol: source.load(symbol) for symbol
+                                          in scan_symbols or source.symbols()})
+            else:
+                print("--stream needs --feed=HOST:PORT or --replay=DIR")
+                sys.exit(2)
+
+            alerts = stream.watch(feed, patterns, symbols=scan_symbols)
+            if output_path is None:
+                scan.write_jsonl(alerts, sys.stdout)
+            else:
+                with open(output_path, 'w') as output_file:
+                    scan.write_jsonl(alerts, output_file)
+        elif worker_path:
+            from stock_analyzer import distributed
+
+            distributed.work(worker_path, lease_seconds=lease_seconds,
+                             processes=processes, source=source, cache=cache)
+        elif run_sweep:
+            if scan_symbols is None:
+                scan_symbols = universe_symbols(universes, sectors, refresh_universe)
+
+            results = sweep.sweep(scan_symbols, patterns, processes=processes,
+                                  source=source, fitter=fitter, end_date=end_date,
+                                  **sweep_values)
+            sweep.write_results(results, output_path)
+        elif run_simulate:
+            from stock_analyzer import simulate
+
+            if scan_symbols is None:
+                scan_symbols = universe_symbols(universes, sectors, refresh_universe)
+
+            outcomes = simulate.simulate_symbols(scan_symbols, patterns, source=source,
+                                                 processes=processes, fitter=fitter,
+                                                 end_date=end_date, **simulate_parameters)
+            simulate.write_results(outcomes, output_path)
+        elif ingest_path:
+            from stock_analyzer import ingest, scan
+
+            results = scan.scan_histories(ingest.last_windows(ingest_path), patterns,
+                                          processes=processes,
+                                          chart_directory=chart_directory,
+                                          chart_format=chart_format,
+                                          detected_only=detected_only, fitter=fitter)
+            scan.write_results(results, output_path)
+        elif run_scan:
+            from stock_analyzer import scan
+
+            if scan_symbols is None:
+                scan_symbols = universe_symbols(universes, sectors, refresh_universe)
+
+            if coordinator_path:
+                from stock_analyzer import distributed
 
-        generate_chart(stock_symbol, end_date, patterns)
+                parameters = {'fitter': fitter, 'end_date': end_date}
+                if timeframes:
+                    parameters['timeframes'] = timeframes
+                results = distributed.coordinate(coordinator_path, scan_symbols,
+                                                 shard_size, **parameters)
+                try:
+                    if timeframes:
+                        from stock_analyzer import timeframes as multi_timeframe
+                        multi_timeframe.write_results(results, timeframes, output_path)
+                    else:
+                        write_scan_results(results, output_path, store_path)
+                except distributed.QueueMismatchError as error:
+                    print(error)
+                    sys.exit(1)
+            elif timeframes:
+                from stock_analyzer import timeframes as multi_timeframe
 
+                results = multi_timeframe.scan_timeframes(
+                    scan_symbols, patterns, timeframes, processes=processes,
+                    source=source, cache=cache, chart_directory=chart_directory,
+                    chart_format=chart_format, detected_only=detected_only,
+                    fitter=fitter, end_date=end_date)
+                multi_timeframe.write_results(results, timeframes, output_path)
+            elif journal_path:
+                from stock_analyzer import journal
 
-def generate_chart(stock_symbol, end_date, patterns):
+                results = journal.resumable_scan(scan_symbols, patterns, journal_path,
+                                                 retries, processes=processes,
+                                                 source=source,
+                                                 chart_directory=chart_directory,
+                                                 chart_format=chart_format,
+                                                 detected_only=detected_only,
+                                                 fitter=fitter, end_date=end_date)
+                write_scan_results(results, output_path, store_path)
+            else:
+                results = scan.scan(scan_symbols, patterns, processes=processes,
+                                    source=source, chart_directory=chart_directory,
+                                    chart_format=chart_format,
+                                    detected_only=detected_only, fitter=fitter,
+                                    end_date=end_date, retries=retries)
+                write_scan_results(results, output_path, store_path)
+        elif get_all:
+            chart_all(universe_symbols(universes, sectors, refresh_universe), end_date,
+                      patterns, source, fitter, journal_path, retries)
+        else:
+            if not stock_symbol:
+                stock_symbol = input("Enter stock symbol: ")
+
+            generate_chart(stock_symbol, end_date, patterns, source=source,
+                           fitter=fitter)
+    except config.ConfigError as error:
+        print(error)
+        sys.exit(1)
+    finally:
+        if instrument:
+            print(instrumentation.summary_table(), file=sys.stderr)
+            if metrics_path:
+                instrumentation.write(metrics_path)
+
+
+def write_scan_results(results, output_path=None, store_path=None):
+    from stock_analyzer import scan
+
+    if store_path is None:
+        scan.write_results(results, output_path)
+        return
+
+    from stock_analyzer import store
+
+    with store.ResultStore(store_path) as result_store:
+        scan.write_results(result_store.record(results), output_path)
+
+
+def universe_symbols(names, sectors=None, refresh=False):
+    from stock_analyzer import universe
+
+    try:
+        symbols = universe.get_universes(names, refresh=refresh, sectors=sectors)
+    except universe.UniverseError as error:
+        print(error)
+        sys.exit(1)
+
+    return list(symbols['symbol'])
+
+
+def chart_all(symbols, end_date, patterns, source, fitter='pairs', journal_path=None,
+              retries=3, max_attempts=3):
+    from stock_analyzer import journal
+
+    run_journal = journal.Journal(journal_path) if journal_path else None
+    if run_journal:
+        symbols = [symbol for symbol in symbols
+                   if not run_journal.is_done(symbol, max_attempts)]
+
+    failures = {}
+
+    def lookup_failed(symbol, error):
+        failures[symbol] = error
+
+    try:
+        price_histories = source.lookup_prices_many(symbols, end_date=end_date,
+                                                    as_frame=False, retries=retries,
+                                                    on_error=lookup_failed)
+        for stock_symbol, price_history in price_histories:
+            error = failures.pop(stock_symbol, None)
+            if error is None and price_history is None:
+                print(f"Nothing found for {stock_symbol}!")
+            elif error is None:
+                try:
+                    generate_chart(stock_symbol, end_date, patterns, price_history,
+                                   fitter=fitter)
+                except Exception as chart_error:
+                    error = chart_error
+
+            if error is not None:
+                print(f"Error analyzing {stock_symbol}: {error}")
+
+            if run_journal:
+                run_journal.record(stock_symbol, 'done' if error is None else 'failed',
+                                   error=None if error is None else str(error))
+    finally:
+        if run_journal:
+            run_journal.close()
+
+
+def generate_chart(stock_symbol, end_date, patterns, price_history=None, source=None,
+                   fitter='pairs'):
+    from stock_analyzer import core, sources
+
+    if fitter not in core.FITTERS:
+        raise ValueError(f"Unknown fitter {fitter}, expected one of "
+                         f"{', '.join(core.FITTERS)}")
+
+    if price_history is None:
+        if source is None:
+            source = sources.AmeritradeSource()
 
-    print(f"Looking up historical price data for {stock_symbol}")
-    price_history = core.lookup_prices(stock_symbol, end_date=end_date)
+        print(f"Looking up historical price data for {stock_symbol}")
+        price_history = source.lookup_prices(stock_symbol, end_date=end_date,
+                                             as_frame=False)
 
     if price_history is None:
         print("Nothing found!")
-        sys.exit(0)
+        return
 
     support_points, resistance_points = \
         core.get_supports_and_resistances(price_history, 2)
 
     best_support_line = core.best_fit_line(price_history['low'],
-                                           support_points)
+                                           support_points,
+                                           fitter=fitter)
     best_resistance_line = core.best_fit_line(price_history['high'],
                                               resistance_points,
-                                              False)
+                                              False, fitter)
 
     this_chart_data = core.Chart(stock_symbol, price_history,
                                  best_support_line, best_resistance_line,
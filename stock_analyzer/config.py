@@ -1,12 +1,44 @@
-import sys
 import os
 import configparser
 
-# Read user configuration data from configuration.ini
-config = configparser.ConfigParser()
-file_name = './stock_analyzer/configuration.ini'
-config.read(file_name)
+file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'configuration.ini')
 
-if not config['AMERITRADE']['API_KEY']:
-    print("You must specify your Ameritrade API key in configuration.ini first.")
-    sys.exit(0)
+_config = None
+
+
+class ConfigError(Exception):
+    """Raised when configuration.ini is missing a setting that is needed"""
+
+
+def get_config() -> configparser.ConfigParser:
+    """A function that reads user configuration data from configuration.ini.
+
+    The file is only read the first time this is called.
+
+    :return: A ConfigParser holding the configuration.
+    """
+
+    global _config
+
+    if _config is None:
+        _config = configparser.ConfigParser()
+        _config.read(file_name)
+
+    return _config
+
+
+def get_api_key() -> str:
+    """A function that returns the Ameritrade API key from configuration.ini.
+
+    :return: The API key.
+    :raises ConfigError: If no key has been set, since nothing can be requested from the
+                         API without it.
+    """
+
+    api_key = get_config().get('AMERITRADE', 'API_KEY', fallback='')
+
+    if not api_key:
+        raise ConfigError(f"You must specify your Ameritrade API key in {file_name} "
+                          f"first.")
+
+    return api_key
@@ -1,30 +1,59 @@
+import collections
+import concurrent.futures
 import datetime
+import functools
 import os
-import sys
+import threading
 import time
-import urllib
 
-import requests
 import json
 import numpy as np
-import pandas as pd
-from matplotlib import pyplot as plt
-from mpl_finance import candlestick_ohlc
-import matplotlib.dates as mdates
 from stock_analyzer import config
+from stock_analyzer.instrument import instrumentation, timed
+from stock_analyzer.cache import CandleCache, merge_candles, COLUMNS as CANDLE_COLUMNS
 
+AMERITRADE_URL = "https://api.tdameritrade.com/v1"
 
-def load_patterns() -> list:
+# TD Ameritrade allows 120 price history requests per minute per API key
+AMERITRADE_CALLS_PER_MINUTE = 120
+
+# Trendline fitters best_fit_line can use
+FITTERS = ('pairs', 'hull')
+
+# Directions a pattern can be traded in. "both" trades each breakout of two-sided patterns
+BREAKOUTS = ('up', 'down', 'both')
+
+# Upper bound on the number of elements in the arrays built per chunk by best_fit_lines
+_BEST_FIT_CHUNK_ELEMENTS = 4_000_000
+
+
+PATTERN_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data',
+                                 'patterns')
+
+# Patterns already loaded, by directory
+_loaded_patterns = {}
+
+
+def load_patterns(pattern_directory: str = PATTERN_DIRECTORY) -> list:
     """A function that loads pattern data.
 
-    Patterns are store in /data/patterns directories, in json format.
+    Patterns are store in /data/patterns directories, in json format. Each directory is
+    only read once, later calls return the same Pattern objects.
+
+    Besides the sups, ress and intercepts criteria, which may be left out, a pattern may
+    have a "features" object bounding any of FEATURES, as {"name": {"min": x, "max": y}}
+    where either bound may be left out or null, and a "breakout" of "up" (the default),
+    "down" or "both" for the directions it is traded in.
 
+    :param pattern_directory: The directory to read. Defaults to the package's patterns.
     :return: List of Pattern objects
     """
 
+    if pattern_directory in _loaded_patterns:
+        return list(_loaded_patterns[pattern_directory])
+
     patterns = []
-    pattern_directory = './stock_analyzer/data/patterns'
-    for filename in os.listdir(pattern_directory):
+    for filename in sorted(os.listdir(pattern_directory)):
         with open(os.path.join(pattern_directory, filename)) as json_file:
             try:
                 data = json.load(json_file)
@@ -32,7 +61,7 @@ def load_patterns() -> list:
                 pattern_name = data['pattern_name']
 
                 sups = []
-                for json_support in data['sups']:
+                for json_support in data.get('sups', []):
                     sup = TrendLineCriteria(
                         json_support['id'],
                         'SUPPORT',
@@ -42,7 +71,7 @@ def load_patterns() -> list:
                     sups.append(sup)
 
                 ress = []
-                for json_support in data['ress']:
+                for json_support in data.get('ress', []):
                     res = TrendLineCriteria(
                         json_support['id'],
                         'RESISTANCE',
@@ -52,7 +81,7 @@ def load_patterns() -> list:
                     ress.append(res)
 
                 intercepts = []
-                for json_support in data['intercepts']:
+                for json_support in data.get('intercepts', []):
                     intercept = InterceptCriteria(
                         json_support['id'],
                         json_support['sup'],
@@ -61,14 +90,27 @@ def load_patterns() -> list:
                     )
                     intercepts.append(intercept)
 
-                pattern = Pattern(pattern_name, sups, ress, intercepts)
+                features = {}
+                for name, bounds in data.get('features', {}).items():
+                    if name not in FEATURES:
+                        raise KeyError(name)
+                    features[name] = (bounds.get('min'), bounds.get('max'))
+
+                breakout = data.get('breakout', 'up')
+                if breakout not in BREAKOUTS:
+                    raise KeyError('breakout')
+
+                pattern = Pattern(pattern_name, sups, ress, intercepts, features,
+                                  breakout)
                 patterns.append(pattern)
             except (KeyError, json.decoder.JSONDecodeError) as err:
                 print(f"Error in {load_patterns.__name__}: "
                       f"{filename} incorrectly formatted.", end=" ")
                 print(err)
 
-    return patterns
+    _loaded_patterns[pattern_directory] = patterns
+
+    return list(patterns)
 
 
 class TrendLineCriteria:
@@ -105,11 +147,21 @@ class Pattern:
     def __init__(self, pattern_name: str,
                  sups: [TrendLineCriteria],
                  ress: [TrendLineCriteria],
-                 intercepts: [InterceptCriteria]):
+                 intercepts: [InterceptCriteria],
+                 features: dict = None,
+                 breakout: str = 'up'):
         self.pattern_name = pattern_name
         self.sups = sups
         self.ress = ress
         self.intercepts = intercepts
+        self.features = features or {}
+        self.breakout = breakout
+
+    @property
+    def breakouts(self) -> tuple:
+        """The directions the pattern is traded in, ('up', 'down') for "both"."""
+
+        return ('up', 'down') if self.breakout == 'both' else (self.breakout,)
 
     def __str__(self):
         return f"name: {self.intercepts}, " \
@@ -118,6 +170,63 @@ class Pattern:
                f"intercepts: {len(self.intercepts)}"
 
 
+class Candles:
+    """Candles stored as contiguous float64 column arrays
+
+    A lightweight stand-in for the price history DataFrame: columns are read the same
+    way, as candles['high'], and np.asarray(candles) gives the (n, 6) OHLCV array.
+    Datetimes are Matplotlib dates.
+    """
+
+    __slots__ = ('datetime', 'open', 'high', 'low', 'close', 'volume')
+
+    columns = CANDLE_COLUMNS
+
+    def __init__(self, datetimes: np.array, opens: np.array, highs: np.array,
+                 lows: np.array, closes: np.array, volumes: np.array):
+        self.datetime = datetimes
+        self.open = opens
+        self.high = highs
+        self.low = lows
+        self.close = closes
+        self.volume = volumes
+
+    @classmethod
+    def from_array(cls, candles: np.array) -> 'Candles':
+        """A function to build Candles from raw candles.
+
+        :param candles: An (n, 6) array of candles with epoch millisecond datetimes.
+        :return: A Candles object.
+        """
+
+        columns = np.ascontiguousarray(np.asarray(candles, dtype=float).T)
+
+        return cls(epoch2num(columns[0] / 1000), *columns[1:])
+
+    def __repr__(self):
+        return f"Candles({len(self)} candles)"
+
+    def __len__(self):
+        return len(self.datetime)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Candles(*(getattr(self, column)[key] for column in self.columns))
+
+        return getattr(self, key)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.column_stack([getattr(self, column) for column in self.columns]) \
+            .astype(dtype or float, copy=False)
+
+    def to_frame(self) -> 'pd.DataFrame':
+        """A function that returns the candles as a price history DataFrame."""
+
+        import pandas as pd
+
+        return pd.DataFrame({column: getattr(self, column) for column in self.columns})
+
+
 class TrendLine:
     """Object that defines a trendline on a chart"""
 
@@ -134,24 +243,285 @@ class TrendLine:
         """A function to calculate the intercept point between two trendlines.
 
         :param other_line: A trendline
-        :return: A tuple in the form (x, y). None if other_trendline is None.
+        :return: A tuple in the form (x, y). None if other_trendline is None or parallel.
         """
 
-        if other_line is None:
+        if other_line is None or other_line.m == self.m:
             return None
 
         intercept_x = (self.b - other_line.b) / (other_line.m - self.m)
-        intercept_y = self.b * intercept_x + self.b
+        intercept_y = self.m * intercept_x + self.b
 
         return intercept_x, intercept_y
 
 
+# Features of a chart that patterns are matched against, in feature vector order.
+# Changes are the fraction of the price a trendline moves across the chart, widths are
+# the distance between the trendlines and spacings the mean number of periods between
+# consecutive extrema. The prior move is the fraction the close moved by before the
+# trendlines start, such as the pole of a flag.
+FEATURES = ('support_slope', 'resistance_slope', 'support_change', 'resistance_change',
+            'support_touches', 'resistance_touches', 'periods_till_intercept',
+            'width_ratio', 'channel_width', 'support_spacing', 'resistance_spacing',
+            'prior_move')
+
+
+def extrema_spacing(points: list) -> float:
+    """
+    A function to measure how far apart local minima or maxima are.
+
+    :param points: Indexes of local minima or maxima, in order.
+    :return: The mean number of periods between consecutive points. NaN if there are
+             fewer than 2.
+    """
+
+    if points is None or len(points) < 2:
+        return np.nan
+
+    return float(np.mean(np.diff(points)))
+
+
+def prior_move(closes: np.array, start) -> float:
+    """
+    A function to measure how far the price moved before a pattern started.
+
+    :param closes: The closing prices of a chart.
+    :param start: The index the pattern starts at, such as the first point of its
+                  earliest trendline.
+    :return: The fraction the close moved by from the first candle to start. NaN if
+             either is unknown.
+    """
+
+    if closes is None or start is None or np.isnan(start) or len(closes) == 0:
+        return np.nan
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return float((closes[int(start)] - closes[0]) / closes[0])
+
+
+def chart_features(support_m: np.array, support_b: np.array, resistance_m: np.array,
+                   resistance_b: np.array, n_prices, support_touches=np.nan,
+                   resistance_touches=np.nan, support_spacing=np.nan,
+                   resistance_spacing=np.nan, prior_moves=np.nan) -> np.array:
+    """
+    A function to compute the feature vectors of many charts at once.
+
+    Missing lines are given as NaN slope and intercept, and features that can't be
+    worked out are NaN.
+
+    :param support_m: Slopes of the support lines, one per chart.
+    :param support_b: Y-intercepts of the support lines.
+    :param resistance_m: Slopes of the resistance lines.
+    :param resistance_b: Y-intercepts of the resistance lines.
+    :param n_prices: The number of prices in each chart, a number or an array.
+    :param support_touches: Prices touching each support line, a number or an array.
+    :param resistance_touches: Prices touching each resistance line.
+    :param support_spacing: The extrema_spacing of each chart's local minima.
+    :param resistance_spacing: The extrema_spacing of each chart's local maxima.
+    :param prior_moves: The prior_move of each chart.
+    :return: An array of shape (charts, len(FEATURES)).
+    """
+
+    support_m = np.asarray(support_m, dtype=float)
+    support_b = np.asarray(support_b, dtype=float)
+    resistance_m = np.asarray(resistance_m, dtype=float)
+    resistance_b = np.asarray(resistance_b, dtype=float)
+    last = np.asarray(n_prices, dtype=float) - 1
+
+    support_end = support_m * last + support_b
+    resistance_end = resistance_m * last + resistance_b
+    level = (support_end + resistance_end) / 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intercept_x = (support_b - resistance_b) / (resistance_m - support_m)
+
+        columns = [support_m, resistance_m,
+                   support_m * last / level, resistance_m * last / level,
+                   support_touches, resistance_touches,
+                   intercept_x - (last + 1),
+                   (resistance_end - support_end) / (resistance_b - support_b),
+                   (resistance_end - support_end) / level,
+                   support_spacing, resistance_spacing, prior_moves]
+
+    return np.column_stack([np.broadcast_to(np.asarray(column, dtype=float),
+                                            support_m.shape)
+                            for column in columns])
+
+
+def line_features(supports: [TrendLine], resistances: [TrendLine], n_prices,
+                  support_points: [list] = None,
+                  resistance_points: [list] = None,
+                  closes: [np.array] = None) -> np.array:
+    """
+    A function to compute the feature vectors of many pairs of TrendLine objects.
+
+    :param supports: Support lines, one per chart. None for a missing line.
+    :param resistances: Resistance lines, one per chart. None for a missing line.
+    :param n_prices: The number of prices in each chart, a number or an array.
+    :param support_points: The local minima of each chart. Spacings are NaN if None.
+    :param resistance_points: The local maxima of each chart.
+    :param closes: The closing prices of each chart. Prior moves are NaN if None.
+    :return: An array of shape (charts, len(FEATURES)).
+    """
+
+    def line_arrays(lines):
+        return [np.array([np.nan if line is None else getattr(line, name)
+                          for line in lines], dtype=float)
+                for name in ('m', 'b', 'touches', 'first_day')]
+
+    support_m, support_b, support_touches, support_start = line_arrays(supports)
+    resistance_m, resistance_b, resistance_touches, resistance_start = \
+        line_arrays(resistances)
+
+    def spacings(points):
+        if points is None:
+            return np.nan
+        return np.array([extrema_spacing(chart_points) for chart_points in points])
+
+    prior_moves = np.nan
+    if closes is not None:
+        # The pattern starts where the earlier of its trendlines does
+        starts = np.fmin(support_start, resistance_start)
+        prior_moves = np.array([prior_move(chart_closes, start)
+                                for chart_closes, start in zip(closes, starts)])
+
+    return chart_features(support_m, support_b, resistance_m, resistance_b, n_prices,
+                          support_touches, resistance_touches, spacings(support_points),
+                          spacings(resistance_points), prior_moves)
+
+
+class PatternMatcher:
+    """Patterns compiled into arrays, so many charts can be classified at once
+
+    Every criterion in Pattern objects is folded into per-pattern bounds on FEATURES,
+    the tightest minimum and maximum for each feature. A chart is then classified against
+    every pattern with one comparison of its feature vector, so a longer pattern library
+    adds almost nothing to the cost per chart.
+    """
+
+    def __init__(self, patterns: [Pattern]):
+        self.patterns = list(patterns)
+
+        n_patterns = len(self.patterns)
+        self.minimums = np.full((n_patterns, len(FEATURES)), -np.inf)
+        self.maximums = np.full((n_patterns, len(FEATURES)), np.inf)
+        self.needs_support = np.zeros(n_patterns, dtype=bool)
+        self.needs_resistance = np.zeros(n_patterns, dtype=bool)
+
+        def bound(index, name, minimum, maximum):
+            feature = FEATURES.index(name)
+            if minimum is not None:
+                self.minimums[index, feature] = max(self.minimums[index, feature],
+                                                    minimum)
+            if maximum is not None:
+                self.maximums[index, feature] = min(self.maximums[index, feature],
+                                                    maximum)
+
+        for index, pattern in enumerate(self.patterns):
+            # A slope bound of 0 or None places no limit on the slope
+            for sup in pattern.sups:
+                bound(index, 'support_slope', sup.slope_min or None,
+                      sup.slope_max or None)
+            for res in pattern.ress:
+                bound(index, 'resistance_slope', res.slope_min or None,
+                      res.slope_max or None)
+            for intercept in pattern.intercepts:
+                bound(index, 'periods_till_intercept', None,
+                      intercept.periods_till_intercept)
+
+            # In the features object any bound that is given applies, including 0
+            for name, (minimum, maximum) in pattern.features.items():
+                bound(index, name, minimum, maximum)
+
+            self.needs_support[index] = bool(pattern.sups or pattern.intercepts
+                                             or pattern.features)
+            self.needs_resistance[index] = bool(pattern.ress or pattern.intercepts
+                                                or pattern.features)
+
+    def match_features(self, features: np.array) -> np.array:
+        """A function to classify many charts by their feature vectors at once.
+
+        A NaN feature doesn't rule a pattern out, but patterns with criteria need the
+        lines they apply to.
+
+        :param features: An array of shape (charts, len(FEATURES)), see chart_features.
+        :return: A boolean array of shape (charts, patterns).
+        """
+
+        features = np.asarray(features, dtype=float)[:, np.newaxis, :]
+
+        # Comparisons with NaN are False, so unknown features pass
+        found = ~((features < self.minimums) | (features > self.maximums)).any(axis=2)
+
+        has_support = ~np.isnan(features[:, :, FEATURES.index('support_slope')])
+        has_resistance = ~np.isnan(features[:, :, FEATURES.index('resistance_slope')])
+        found &= has_support | ~self.needs_support
+        found &= has_resistance | ~self.needs_resistance
+
+        return found
+
+    def match(self, support_m: np.array, support_b: np.array, resistance_m: np.array,
+              resistance_b: np.array, n_prices, **kwargs) -> np.array:
+        """A function to classify many (support, resistance) line pairs at once.
+
+        Missing lines are given as NaN slope and intercept.
+
+        :param support_m: Slopes of the support lines, one per chart.
+        :param support_b: Y-intercepts of the support lines.
+        :param resistance_m: Slopes of the resistance lines.
+        :param resistance_b: Y-intercepts of the resistance lines.
+        :param n_prices: The number of prices in each chart, a number or an array.
+        :param kwargs: Any other chart_features parameters, such as touches.
+        :return: A boolean array of shape (charts, patterns).
+        """
+
+        return self.match_features(chart_features(support_m, support_b, resistance_m,
+                                                  resistance_b, n_prices, **kwargs))
+
+    def match_lines(self, supports: [TrendLine], resistances: [TrendLine], n_prices,
+                    support_points: [list] = None, resistance_points: [list] = None,
+                    closes: [np.array] = None) -> np.array:
+        """A function to classify many pairs of TrendLine objects at once.
+
+        :param supports: Support lines, one per chart. None for a missing line.
+        :param resistances: Resistance lines, one per chart. None for a missing line.
+        :param n_prices: The number of prices in each chart, a number or an array.
+        :param support_points: The local minima of each chart, for the spacing features.
+        :param resistance_points: The local maxima of each chart.
+        :param closes: The closing prices of each chart, for the prior move feature.
+        :return: A boolean array of shape (charts, patterns).
+        """
+
+        return self.match_features(line_features(supports, resistances, n_prices,
+                                                 support_points, resistance_points,
+                                                 closes))
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_patterns(patterns: tuple) -> PatternMatcher:
+    return PatternMatcher(patterns)
+
+
+def compile_patterns(patterns: [Pattern]) -> PatternMatcher:
+    """A function that compiles patterns once and reuses the result for the same list.
+
+    :param patterns: List of Pattern objects, or an already compiled PatternMatcher.
+    :return: A PatternMatcher.
+    """
+
+    if isinstance(patterns, PatternMatcher):
+        return patterns
+
+    return _compile_patterns(tuple(patterns))
+
+
 class Chart:
     """Object that holds all information needed to draw a chart"""
 
     def __init__(self, symbol: str, prices: list, support: TrendLine,
                  resistance: TrendLine, support_points: list, resistance_points: list,
-                 patterns: [Pattern]):
+                 patterns: [Pattern], verbose: bool = True, height_ratio: float = 0.70,
+                 buy_threshold: float = 0.01):
 
         self.symbol = symbol
         self.prices = prices
@@ -160,6 +530,9 @@ class Chart:
         self.support_points = support_points
         self.resistance_points = resistance_points
         self.patterns = patterns
+        self.verbose = verbose
+        self.height_ratio = height_ratio
+        self.buy_threshold = buy_threshold
         self.detected_patterns = []
         self.detect_pattern()
 
@@ -169,85 +542,116 @@ class Chart:
                f"{self.support_points}, {self.resistance_points}" \
                f", {self.patterns})"
 
-    def detect_pattern(self):
-        for pattern in self.patterns:
-            pattern_found = True
+    @functools.cached_property
+    def features(self) -> np.array:
+        """The chart's feature vector, see chart_features. Only computed once."""
 
-            for sup in pattern.sups:
-                if self.support:
-                    if sup.slope_min:
-                        if self.support.m < sup.slope_min:
-                            pattern_found = False
-                    if sup.slope_max:
-                        if self.support.m > sup.slope_max:
-                            pattern_found = False
-                else:
-                    pattern_found = False
+        # Prices are a price history, or a plain series of closes
+        closes = self.prices['close'] if hasattr(self.prices, 'columns') else self.prices
 
-            for res in pattern.ress:
-                if self.resistance:
-                    if res.slope_min:
-                        if self.resistance.m < res.slope_min:
-                            pattern_found = False
+        return line_features([self.support], [self.resistance], len(self.prices),
+                             [self.support_points], [self.resistance_points],
+                             [np.asarray(closes, dtype=float)])[0]
 
-                    if res.slope_max:
-                        if self.resistance.m > res.slope_max:
-                            pattern_found = False
-                else:
-                    pattern_found = False
+    @timed('detect_pattern')
+    def detect_pattern(self):
+        matcher = compile_patterns(self.patterns)
+        found = matcher.match_features(self.features[np.newaxis, :])[0]
+
+        for pattern, pattern_found in zip(matcher.patterns, found):
+            if not (pattern_found and self.support and self.resistance):
+                continue
+
+            for breakout in pattern.breakouts:
+                trade_criteria = get_trade_criteria(pattern.pattern_name, self.support,
+                                                    self.resistance, self.height_ratio,
+                                                    self.buy_threshold, breakout)
+
+                if self.verbose:
+                    print("Pattern Found - " + pattern.pattern_name)
+                    print("Triangle Height: " + str(round(trade_criteria.height, 2)))
+                    print("Buy price: " + str(round(trade_criteria.buy_price, 2)))
+                    print("Target price: " + str(round(trade_criteria.sell_price, 2)))
+                    print("Stop price: " + str(round(trade_criteria.stop_price, 2)))
+                    print("Profit Margin: "
+                          + str(round(trade_criteria.profit_margin, 1)) + "%")
+                    print("Down Side: " + str(round(trade_criteria.loss_margin, 1)) + "%")
 
-            for intercept in pattern.intercepts:
-                intercept_point = self.support.intercept_point(self.resistance)
+                self.detected_patterns.append(trade_criteria)
 
-                if intercept_point:
-                    detected_periods_till_intercept = intercept_point[0] - len(
-                        self.prices)
 
-                    if intercept_point:
-                        if detected_periods_till_intercept > intercept.periods_till_intercept:
-                            pattern_found = False
-                else:
-                    pattern_found = False
+class TradeCriteria:
+    """Object that stores the trade suggested by a detected pattern
 
-            trade_criteria = None
-            if pattern_found:
-                height_ratio = 0.70
-                buy_threshold = 0.01
+    For a downward breakout the trade is a short sale: buy_price is where it is entered,
+    below the pattern, and sell_price the lower target it is covered at. Margins are
+    measured in the direction of the trade, so a profit margin is positive either way.
+    """
 
-                print("Pattern Found - " + pattern.pattern_name)
+    def __init__(self, pattern_name: str, height: float, buy_price: float,
+                 sell_price: float, stop_price: float, breakout: str = 'up'):
+        self.pattern_name = pattern_name
+        self.height = height
+        self.buy_price = buy_price
+        self.sell_price = sell_price
+        self.stop_price = stop_price
+        self.breakout = breakout
 
-                resistance_price = self.resistance.m * self.support.first_day \
-                                   + self.resistance.b
-                support_price = self.support.m * self.support.first_day + self.support.b
+        direction = 1 if breakout == 'up' else -1
+        self.profit_margin = direction * (sell_price - buy_price) / buy_price * 100
+        self.loss_margin = direction * (stop_price - buy_price) / buy_price * 100
 
-                triangle_height = resistance_price - support_price
-                print("Triangle Height: " + str(round(triangle_height, 2)))
+    def __repr__(self):
+        return f"TradeCriteria({self.pattern_name}, {self.height}, {self.buy_price}, " \
+               f"{self.sell_price}, {self.stop_price}, {self.breakout})"
 
-                buy_price = resistance_price + (triangle_height * buy_threshold)
-                print("Buy price: " + str(round(buy_price, 2)))
 
-                sell_price = height_ratio * triangle_height + resistance_price
-                print("Target price: " + str(round(sell_price, 2)))
+def get_trade_criteria(pattern_name: str, support: TrendLine, resistance: TrendLine,
+                       height_ratio: float = 0.70, buy_threshold: float = 0.01,
+                       breakout: str = 'up') -> TradeCriteria:
+    """
+    A function to work out the trade suggested by a pattern between two trendlines.
+
+    :param pattern_name: The name of the detected pattern.
+    :param support: The support TrendLine.
+    :param resistance: The resistance TrendLine.
+    :param height_ratio: The fraction of the triangle height targeted past the breakout
+                         line.
+    :param buy_threshold: The fraction of the triangle height past the breakout line to
+                          enter at.
+    :param breakout: 'up' to buy above resistance, 'down' to sell short below support.
+    :return: A TradeCriteria object.
+    """
 
-                stop_price = resistance_price - (triangle_height * .1)
-                print("Stop price: " + str(round(stop_price, 2)))
+    resistance_price = resistance.m * support.first_day + resistance.b
+    support_price = support.m * support.first_day + support.b
 
-                profit_margin = (sell_price - buy_price) / buy_price * 100
-                print("Profit Margin: " + str(round(profit_margin, 1)) + "%")
+    triangle_height = resistance_price - support_price
+    if breakout == 'up':
+        line_price, direction = resistance_price, 1
+    else:
+        line_price, direction = support_price, -1
 
-                loss_margin = (stop_price - buy_price) / buy_price * 100
-                print("Down Side: " + str(round(loss_margin, 1)) + "%")
+    buy_price = line_price + direction * (triangle_height * buy_threshold)
+    sell_price = line_price + direction * height_ratio * triangle_height
+    stop_price = line_price - direction * (triangle_height * .1)
 
-                self.detected_patterns.append(trade_criteria)
+    return TradeCriteria(pattern_name, triangle_height, buy_price, sell_price, stop_price,
+                         breakout)
 
 
+@timed('lookup_prices')
 def lookup_prices(symbol: str,
                   period: int = 2,
                   period_type: str = "month",
                   frequency: int = 1,
                   frequency_type: str = "daily",
                   end_date: str = "",
-                  num_entries_to_analyze: int = 40) -> pd.DataFrame:
+                  num_entries_to_analyze: int = 40,
+                  session: 'requests.Session' = None,
+                  base_url: str = AMERITRADE_URL,
+                  cache: CandleCache = None,
+                  as_frame: bool = True) -> 'pd.DataFrame':
     """
     A function to retrieve historical price data from the TD Ameritrade API.
 
@@ -266,19 +670,22 @@ def lookup_prices(symbol: str,
                                    Ameritrade's API doesn't allow you to specify 40 days,
                                    since you have to specify 1 month or 2.
     :param end_date: The last date of the data being requested.
+    :param session: An optional requests.Session, so connections can be kept alive and
+                    shared between calls.
+    :param base_url: The root of the API. Only needs changing to point at a stub server.
+    :param cache: An optional CandleCache. Cached candles are reused and only the missing
+                  tail is requested from the API.
+    :param as_frame: Return a DataFrame. Otherwise return a Candles object, which skips
+                     building a DataFrame.
     :return: A Pandas Dataframe containing the following fields:
                                     'datetime', 'open', 'high', 'low', 'close', 'volume'
     """
 
-    if end_date == "":
-        end_date = int(round(time.time() * 1000))
-    else:
-        end_date = int(
-            round(datetime.datetime.strptime(end_date, '%m-%d-%Y').timestamp() * 1000))
+    end_date = end_date_millis(end_date)
 
-    endpoint = f"https://api.tdameritrade.com/v1/marketdata/{symbol}/pricehistory"
+    endpoint = f"{base_url}/marketdata/{symbol}/pricehistory"
     payload = {
-        'apikey': config.config['AMERITRADE']['API_KEY'],
+        'apikey': config.get_api_key(),
         'period': period,
         'periodType': period_type,
         'frequency': frequency,
@@ -287,34 +694,279 @@ def lookup_prices(symbol: str,
         'needExtendedHoursData': 'false',
     }
 
+    if cache is None:
+        candles = _request_candles(endpoint, payload, session)
+    else:
+        candles = _cached_candles(cache, symbol, endpoint, payload, session,
+                                  num_entries_to_analyze)
+
+    return candle_frame(candles, num_entries_to_analyze, as_frame)
+
+
+def end_date_millis(end_date: str = "") -> int:
+    """
+    A function to convert an end date to epoch milliseconds.
+
+    :param end_date: A date in the form mm-dd-yyyy. Now if empty.
+    :return: Milliseconds since 1970-01-01.
+    """
+
+    if end_date == "":
+        return int(round(time.time() * 1000))
+
+    return int(round(datetime.datetime.strptime(end_date, '%m-%d-%Y').timestamp() * 1000))
+
+
+@timed('dataframe')
+def candle_frame(candles: np.array, num_entries_to_analyze: int = 40,
+                 as_frame: bool = True) -> 'pd.DataFrame':
+    """
+    A function to build the price history every price source returns.
+
+    :param candles: An (n, 6) array of candles sorted by datetime, with epoch
+                    millisecond datetimes.
+    :param num_entries_to_analyze: Used to look at the most recent number of data points.
+    :param as_frame: Return a DataFrame. Otherwise return the lighter Candles object.
+    :return: A Pandas Dataframe containing the following fields:
+                                    'datetime', 'open', 'high', 'low', 'close', 'volume'
+             None if there are no candles.
+    """
+
+    if candles is None or len(candles) == 0:
+        return None
+
+    if not as_frame:
+        return Candles.from_array(candles[-num_entries_to_analyze:])
+
+    import pandas as pd
+
+    candle_data = pd.DataFrame(candles[-num_entries_to_analyze:], columns=CANDLE_COLUMNS)
+
+    # Convert datetime TODO: Understand the different timestamps used
+    candle_data['datetime'] = epoch2num(candle_data['datetime'] / 1000)
+
+    return candle_data
+
+
+def _request_candles(endpoint: str, payload: dict,
+                     session: 'requests.Session' = None) -> np.array:
+    """
+    A function to request candles from the price history endpoint.
+
+    :param endpoint: The price history url for a symbol.
+    :param payload: The query parameters.
+    :param session: An optional requests.Session.
+    :return: An (n, 6) array of candles with epoch millisecond datetimes, or None if the
+             response could not be decoded.
+    """
+
+    import requests
+
     # TODO: Add more exception handling
     try:
-        content = requests.get(url=endpoint, params=payload)
+        with instrumentation.stage('http'):
+            content = (session or requests).get(url=endpoint, params=payload)
     except requests.exceptions.ProxyError:
         print("ProxyError, maybe you need to connect to to your proxy server?")
-        sys.exit()
+        raise
+
+    instrumentation.add('api_requests')
+    instrumentation.add('api_bytes', len(content.content))
 
     try:
-        data = content.json()
+        with instrumentation.stage('json'):
+            data = content.json()
     except json.decoder.JSONDecodeError:
         print("Error, API Request Returned: " + str(content))
         print("Endpoint: " + endpoint)
         print("payload:: " + str(payload))
         return None
 
-    candle_data = pd.DataFrame.from_records(data['candles'])
+    candles = np.array([[candle[column] for column in CANDLE_COLUMNS]
+                        for candle in data['candles']], dtype=float)
 
-    if candle_data.empty:
-        return None
+    return candles.reshape(-1, len(CANDLE_COLUMNS))
 
-    candle_data = candle_data[['datetime', 'open', 'high', 'low', 'close', 'volume']]
-    candle_data = candle_data[-num_entries_to_analyze:]
-    candle_data = pd.DataFrame.reset_index(candle_data, drop=True)
 
-    # Convert datetime TODO: Understand the different timestamps used
-    candle_data['datetime'] = mdates.epoch2num(candle_data['datetime'] / 1000)
+def _cached_candles(cache: CandleCache, symbol: str, endpoint: str, payload: dict,
+                    session: 'requests.Session', num_entries_to_analyze: int) -> np.array:
+    """
+    A function to serve candles from a CandleCache, fetching only what is missing.
 
-    return candle_data
+    :param cache: The CandleCache to read from and update.
+    :param symbol: A stock symbol. Example: 'AAPL'
+    :param endpoint: The price history url for the symbol.
+    :param payload: The query parameters of a full request.
+    :param session: An optional requests.Session.
+    :param num_entries_to_analyze: The number of candles needed up to the end date.
+    :return: An (n, 6) array of candles up to the end date, or None on a failed request.
+    """
+
+    frequency_type = payload['frequencyType']
+    frequency = payload['frequency']
+    end_date = payload['endDate']
+
+    candles, fetched_until = cache.load(symbol, frequency_type, frequency)
+
+    if candles is not None and len(candles) and fetched_until < end_date:
+        # Top up the tail, starting from the last cached candle in case it was partial
+        tail_payload = dict(payload)
+        del tail_payload['period']
+        tail_payload['startDate'] = int(candles[-1, 0])
+
+        fetched = _request_candles(endpoint, tail_payload, session)
+        if fetched is None:
+            return None
+
+        candles = merge_candles(candles, fetched)
+        fetched_until = end_date
+        cache.store(symbol, frequency_type, frequency, candles, fetched_until)
+
+    if candles is None or np.sum(candles[:, 0] <= end_date) < num_entries_to_analyze:
+        fetched = _request_candles(endpoint, payload, session)
+        if fetched is None:
+            return None
+
+        if candles is not None and len(candles) and end_date < candles[0, 0]:
+            # The new window ends before the cached range starts, so they can't be joined
+            candles, fetched_until = fetched, end_date
+        else:
+            candles = merge_candles(candles, fetched)
+            fetched_until = max(fetched_until, end_date)
+
+        cache.store(symbol, frequency_type, frequency, candles, fetched_until)
+
+    return candles[candles[:, 0] <= end_date]
+
+
+def lookup_prices_many(symbols: [str],
+                       max_workers: int = 8,
+                       calls_per_minute: int = AMERITRADE_CALLS_PER_MINUTE,
+                       retries: int = 0,
+                       backoff: float = 1.0,
+                       on_error=None,
+                       **kwargs):
+    """
+    A generator that retrieves historical price data for many symbols concurrently.
+
+    Requests are spread over a bounded pool of worker threads sharing one keep-alive
+    session, and are throttled to stay under the API's per-minute quota. Results are
+    yielded as each request finishes, not in the order of symbols.
+
+    :param symbols: A list of stock symbols.
+    :param max_workers: The number of requests allowed in flight at once.
+    :param calls_per_minute: The maximum number of requests started in any 60 seconds.
+    :param retries: The number of times a symbol is retried after a transient failure,
+                    see call_with_retries.
+    :param backoff: Seconds before the first retry of a symbol, doubled for each retry.
+    :param on_error: Called with the symbol and the exception when a symbol still fails,
+                     which is then yielded with None. Without it the exception is raised.
+    :param kwargs: Any other lookup_prices parameters, applied to every symbol.
+    :return: Yields (symbol, Pandas Dataframe or None) tuples.
+    """
+
+    import requests
+
+    rate_limiter = RateLimiter(calls_per_minute, 60)
+
+    def request(symbol):
+        rate_limiter.wait()
+        return lookup_prices(symbol, session=session, **kwargs)
+
+    def fetch(symbol):
+        return call_with_retries(request, symbol, retries=retries, backoff=backoff)
+
+    with requests.Session() as session:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=max_workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(fetch, symbol): symbol for symbol in symbols}
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    symbol = futures[future]
+                    try:
+                        price_history = future.result()
+                    except Exception as error:
+                        # A missing API key fails every symbol, not just this one
+                        if on_error is None or isinstance(error, config.ConfigError):
+                            raise
+                        on_error(symbol, error)
+                        price_history = None
+
+                    yield symbol, price_history
+            finally:
+                for future in futures:
+                    future.cancel()
+
+
+def call_with_retries(function, *args, retries: int = 0, backoff: float = 1.0,
+                      **kwargs):
+    """
+    A function that calls another, retrying transient failures with exponential backoff.
+
+    Transient failures are OSErrors, which include every requests exception such as
+    connection errors and timeouts. Any other exception is raised straight away.
+
+    :param function: The function to call with args and kwargs.
+    :param retries: The number of times to retry after the first failure.
+    :param backoff: Seconds to wait before the first retry, doubled for each retry after.
+    :return: The function's return value.
+    """
+
+    for attempt in range(retries + 1):
+        try:
+            return function(*args, **kwargs)
+        except OSError:
+            if attempt == retries:
+                raise
+
+            if instrumentation.enabled:
+                instrumentation.add('retries')
+            time.sleep(backoff * 2 ** attempt)
+
+
+class RateLimiter:
+    """Thread-safe sliding-window limiter allowing max_calls in any period seconds"""
+
+    def __init__(self, max_calls: int, period: float):
+        self.max_calls = max_calls
+        self.period = period
+        self.calls = collections.deque()
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Block until another call can be made without exceeding the limit."""
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.calls and now - self.calls[0] >= self.period:
+                    self.calls.popleft()
+
+                if len(self.calls) < self.max_calls:
+                    self.calls.append(now)
+                    return
+
+                delay = self.period - (now - self.calls[0])
+
+            time.sleep(delay)
+
+
+def epoch2num(seconds):
+    """
+    A function to convert Unix epoch seconds to Matplotlib dates.
+
+    Stands in for matplotlib.dates.epoch2num, which was removed in Matplotlib 3.9, and
+    saves importing Matplotlib when nothing is drawn.
+
+    :param seconds: Seconds since 1970-01-01, a number or array-like.
+    :return: Days since 1970-01-01, Matplotlib's default date epoch.
+    """
+
+    return seconds / (24 * 60 * 60)
 
 
 def get_supports_and_resistances(ltp: np.array, n: int) -> (list, list):
@@ -328,117 +980,308 @@ def get_supports_and_resistances(ltp: np.array, n: int) -> (list, list):
              resistance list.
     """
 
+    highs = np.asarray(ltp['high'], dtype=float)
+    lows = np.asarray(ltp['low'], dtype=float)
+
+    (support, resistance), = get_supports_and_resistances_many(highs[np.newaxis, :],
+                                                               lows[np.newaxis, :], n)
+
+    return support, resistance
+
+
+@timed('extrema')
+def get_supports_and_resistances_many(highs: np.array, lows: np.array,
+                                      n: int) -> [(list, list)]:
+    """
+    A function to find support and resistance levels for a universe of aligned series.
+
+    All rows are smoothed in a single Savitzky-Golay call, and the window sign tests are
+    run for every position at once using cumulative sums of the derivative signs.
+
+    :param highs: A 2-D array of high prices, one row per symbol.
+    :param lows: A 2-D array of low prices, one row per symbol.
+    :param n: is the number of entries to be scanned.
+    :return: A list with one (support list, resistance list) tuple per row.
+    """
+
     from scipy.signal import savgol_filter as smooth
 
     # converting n to a nearest even number
     if n % 2 != 0:
         n += 1
 
-    highs = ltp['high']
-    lows = ltp['low']
+    highs = np.atleast_2d(np.asarray(highs, dtype=float))
+    lows = np.atleast_2d(np.asarray(lows, dtype=float))
 
-    n_ltp = ltp.shape[0]
+    n_ltp = highs.shape[1]
+    half = n // 2
 
-    # smoothening the curve
-    highs_s = smooth(highs, (n + 1), 2)
-    lows_s = smooth(lows, (n + 1), 2)
+    # smoothening the curves
+    with instrumentation.stage('smoothing'):
+        highs_s = smooth(highs, (n + 1), 2, axis=1)
+        lows_s = smooth(lows, (n + 1), 2, axis=1)
 
     # taking a simple derivative
-    highs_d = np.zeros(n_ltp)
-    highs_d[1:] = np.subtract(highs_s[1:], highs_s[:-1])
-    lows_d = np.zeros(n_ltp)
-    lows_d[1:] = np.subtract(lows_s[1:], lows_s[:-1])
+    highs_d = np.zeros(highs.shape)
+    highs_d[:, 1:] = np.subtract(highs_s[:, 1:], highs_s[:, :-1])
+    lows_d = np.zeros(lows.shape)
+    lows_d[:, 1:] = np.subtract(lows_s[:, 1:], lows_s[:, :-1])
+
+    # local maxima: rising for the first half of the window, falling for the second
+    resistance = _sign_windows(highs_d > 0, highs_d < 0, half, n_ltp - n)
+
+    # local minima: falling for the first half of the window, rising for the second
+    support = _sign_windows(lows_d < 0, lows_d > 0, half, n_ltp - n)
 
-    resistance = []
-    support = []
+    return [((np.flatnonzero(support[row]) + half - 1).tolist(),
+             (np.flatnonzero(resistance[row]) + half - 1).tolist())
+            for row in range(highs.shape[0])]
 
-    for i in range(n_ltp - n):
-        lows_sl = lows_d[i:int(i + n)]
-        lows_first = lows_sl[:int(n / 2)]  # first half
-        lows_last = lows_sl[int(n / 2):]  # second half
 
-        highs_sl = highs_d[i:int(i + n)]
-        highs_first = highs_sl[:int(n / 2)]  # first half
-        highs_last = highs_sl[int(n / 2):]  # second half
+def _sign_windows(first: np.array, last: np.array, half: int, positions: int) -> np.array:
+    """
+    A function that tests every window of 2 * half entries at once.
 
-        r_1 = np.sum(highs_first > 0)
-        r_2 = np.sum(highs_last < 0)
+    :param first: Boolean mask that must hold for the whole first half of a window.
+    :param last: Boolean mask that must hold for the whole second half of a window.
+    :param half: Half the window size.
+    :param positions: Number of window start positions to test.
+    :return: A boolean array of shape (rows, positions).
+    """
 
-        s_1 = np.sum(lows_first < 0)
-        s_2 = np.sum(lows_last > 0)
+    if positions <= 0:
+        return np.zeros((first.shape[0], 0), dtype=bool)
 
-        # local maxima detection
-        if (r_1 == (n / 2)) and (r_2 == (n / 2)):
-            resistance.append(i + (int(n / 2) - 1))
+    first_count = np.zeros((first.shape[0], first.shape[1] + 1), dtype=np.intp)
+    np.cumsum(first, axis=1, out=first_count[:, 1:])
+    last_count = np.zeros((last.shape[0], last.shape[1] + 1), dtype=np.intp)
+    np.cumsum(last, axis=1, out=last_count[:, 1:])
 
-        # local minima detection
-        if (s_1 == (n / 2)) and (s_2 == (n / 2)):
-            support.append(i + (int(n / 2) - 1))
+    starts = np.arange(positions)
+    first_sum = first_count[:, starts + half] - first_count[:, starts]
+    last_sum = last_count[:, starts + 2 * half] - last_count[:, starts + half]
 
-    return support, resistance
+    return (first_sum == half) & (last_sum == half)
 
 
-def best_fit_line(prices: list, derivatives: list, is_support: bool = True) -> TrendLine:
+def best_fit_line(prices: list, derivatives: list, is_support: bool = True,
+                  fitter: str = 'pairs', margin: float = 0.05) -> TrendLine:
     """
     A function to find the best support/resistance line for a set of prices.
 
+    Every pair of derivative points is tested at once with NumPy broadcasting. Ties are
+    broken the same way as a pair-by-pair search: the last pair with the highest touch
+    count wins.
+
     :param prices: A list of prices.
     :param derivatives: A list of identified local minima/maxima.
     :param is_support: Boolean to indicate if this is a support line or not.
+    :param fitter: 'pairs' tests every pair of derivative points. 'hull' only tests the
+                   edges of the convex hull of the prices, see hull_fit_line, which is
+                   much faster on long price histories.
+    :param margin: The fraction of the price range a line may be crossed by, and that
+                   points must come within to touch it.
     :return: Trendline object.
     """
 
-    best_count = 0
-    best_trendline = None
+    if fitter == 'hull':
+        return hull_fit_line(prices, derivatives, is_support, margin)
+
+    return best_fit_lines(np.asarray(prices, dtype=float)[np.newaxis, :],
+                          [derivatives], is_support, fitter, margin)[0]
+
+
+@timed('best_fit_line')
+def best_fit_lines(prices: np.array, derivatives: list, is_support: bool = True,
+                   fitter: str = 'pairs', margin: float = 0.05) -> [TrendLine]:
+    """
+    A function to find the best support/resistance line for a stack of price series.
+
+    :param prices: A 2-D array of prices, one row per symbol. All rows must have the
+                   same length.
+    :param derivatives: A list with one list of local minima/maxima per row of prices.
+    :param is_support: Boolean to indicate if these are support lines or not.
+    :param fitter: 'pairs' or 'hull', as for best_fit_line.
+    :param margin: The fraction of the price range, as for best_fit_line.
+    :return: A list with one Trendline object (or None) per row of prices.
+    """
+
+    prices = np.atleast_2d(np.asarray(prices, dtype=float))
+    n_rows, n_prices = prices.shape
+
+    if len(derivatives) != n_rows:
+        raise ValueError(f"Expected {n_rows} derivative lists, got {len(derivatives)}")
+
+    if fitter == 'hull':
+        return [hull_fit_line(row, row_derivatives, is_support, margin)
+                for row, row_derivatives in zip(prices, derivatives)]
+    elif fitter != 'pairs':
+        raise ValueError(f"Unknown fitter {fitter}, expected one of {FITTERS}")
+
+    if n_prices == 0:
+        return [None] * n_rows
+
+    # Pad the ragged derivative lists into a rectangular index array plus a mask
+    n_derivatives = max((len(row) for row in derivatives), default=0)
+    points = np.zeros((n_rows, n_derivatives), dtype=np.intp)
+    point_mask = np.zeros((n_rows, n_derivatives), dtype=bool)
+    for row, row_derivatives in enumerate(derivatives):
+        points[row, :len(row_derivatives)] = row_derivatives
+        point_mask[row, :len(row_derivatives)] = True
+
+    price_margin = margin * (prices.max(axis=1) - prices.min(axis=1))
+    point_prices = np.take_along_axis(prices, points, axis=1)
+
+    # Every (start, end) combination, in the same order as a nested loop would visit them
+    starts, ends = np.triu_indices(n_derivatives, 1)
+
+    if instrumentation.enabled:
+        instrumentation.add('candidate_pairs',
+                            sum(len(row) * (len(row) - 1) // 2 for row in derivatives))
+
+    best_count = np.full(n_rows, -1)
+    best_pair = np.full(n_rows, -1)
+
+    # Work through the pairs in chunks to keep the (rows, pairs, prices) arrays bounded
+    chunk_size = max(1, _BEST_FIT_CHUNK_ELEMENTS // (n_rows * n_prices))
+    k = np.arange(n_prices)
+
+    for chunk_start in range(0, len(starts), chunk_size):
+        chunk_starts = starts[chunk_start:chunk_start + chunk_size]
+        chunk_ends = ends[chunk_start:chunk_start + chunk_size]
+
+        x_start = points[:, chunk_starts]
+        x_end = points[:, chunk_ends]
+        y_start = point_prices[:, chunk_starts]
+        y_end = point_prices[:, chunk_ends]
+        pair_mask = point_mask[:, chunk_starts] & point_mask[:, chunk_ends]
+
+        # Calculate slope and y-intercept for every pair of derivative points
+        with np.errstate(divide='ignore', invalid='ignore'):
+            m = (y_end - y_start) / (x_end - x_start)
+        b = y_end - m * x_end
+
+        # Make sure no prices pass through each line
+        test_y = m[:, :, np.newaxis] * k + b[:, :, np.newaxis]
+        if is_support:
+            test_y = test_y - price_margin[:, np.newaxis, np.newaxis]
+            broken = (prices[:, np.newaxis, :] < test_y).any(axis=2)
+        else:
+            test_y = test_y + price_margin[:, np.newaxis, np.newaxis]
+            broken = (prices[:, np.newaxis, :] > test_y).any(axis=2)
+
+        valid = pair_mask & ~broken
+
+        # Count the number of times the prices touch (come within price_margin) each line
+        test_y = m[:, :, np.newaxis] * points[:, np.newaxis, :] + b[:, :, np.newaxis]
+        lower = test_y - price_margin[:, np.newaxis, np.newaxis]
+        upper = test_y + price_margin[:, np.newaxis, np.newaxis]
+        touches = ((lower <= point_prices[:, np.newaxis, :])
+                   & (point_prices[:, np.newaxis, :] <= upper)
+                   & point_mask[:, np.newaxis, :]).sum(axis=2)
+
+        # Last pair with the highest touch count in this chunk, per row
+        touches = np.where(valid, touches, -1)
+        last = touches.shape[1] - 1 - np.argmax(touches[:, ::-1], axis=1)
+        chunk_best = touches[np.arange(n_rows), last]
+
+        update = (chunk_best >= 0) & (chunk_best >= best_count)
+        best_count[update] = chunk_best[update]
+        best_pair[update] = chunk_start + last[update]
+
+    trendlines = []
+    for row in range(n_rows):
+        if best_pair[row] < 0:
+            trendlines.append(None)
+            continue
+
+        pair = best_pair[row]
+        m = (point_prices[row, ends[pair]] - point_prices[row, starts[pair]]) / (
+                points[row, ends[pair]] - points[row, starts[pair]])
+        b = point_prices[row, ends[pair]] - m * points[row, ends[pair]]
+        trendlines.append(TrendLine(b, m, int(best_count[row]),
+                                    int(points[row, starts[pair]])))
+
+    return trendlines
+
+
+@timed('hull_fit_line')
+def hull_fit_line(prices: list, derivatives: list, is_support: bool = True,
+                  margin: float = 0.05) -> TrendLine:
+    """
+    A function to find the best support/resistance line among the edges of the convex
+    hull of the prices.
+
+    A line that no price crosses must lie along the lower convex hull of the prices for
+    a support, or the upper hull for a resistance. The hull is built in one pass over
+    the prices and only its edges are scored, by touches of the derivative points like
+    best_fit_line, so long price histories stay fast. Hull lines never dip into the
+    price margin best_fit_line allows, so the two fitters can pick different lines.
 
-    margin = 0.05
-    price_margin = margin * (max(prices) - min(prices))
+    :param prices: A list of prices.
+    :param derivatives: A list of identified local minima/maxima, used to count touches.
+    :param is_support: Boolean to indicate if this is a support line or not.
+    :param margin: The fraction of the price range that points must come within to
+                   touch a line.
+    :return: Trendline object. The last hull edge with the highest touch count wins.
+             None if there are fewer than 2 prices or derivative points, or if no edge
+             is touched by at least 2 of them, like best_fit_line's pairs.
+    """
+
+    prices = np.asarray(prices, dtype=float)
+    if len(prices) < 2 or len(derivatives) < 2:
+        return None
+
+    hull = np.asarray(_hull_chain(prices.tolist(), is_support), dtype=np.intp)
+    starts = hull[:-1]
+    ends = hull[1:]
+
+    m = (prices[ends] - prices[starts]) / (ends - starts)
+    b = prices[ends] - m * ends
+
+    # Count the number of times the derivative points touch (come within margin) each edge
+    price_margin = margin * (prices.max() - prices.min())
+    points = np.asarray(derivatives, dtype=np.intp)
+    test_y = m[:, np.newaxis] * points + b[:, np.newaxis]
+    touches = (np.abs(prices[points] - test_y) <= price_margin).sum(axis=1)
 
-    # Try every combination of derivative points
-    for derivative_start in range(len(derivatives)):
-        # print(str(derivative_start), end=", ")
-        for derivative_end in range(derivative_start + 1, len(derivatives)):
+    if instrumentation.enabled:
+        instrumentation.add('hull_edges', len(starts))
 
-            # print(str(derivative_end), end=", ")
+    edge = len(touches) - 1 - np.argmax(touches[::-1])
+    if touches[edge] < 2:
+        return None
 
-            # Calculate slope and y-intercept for these 2 derivative points
-            m = (prices[derivatives[derivative_end]]
-                 - prices[derivatives[derivative_start]]) / (
-                        derivatives[derivative_end]
-                        - derivatives[derivative_start])
-            b = prices[derivatives[derivative_end]] - m * derivatives[derivative_end]
+    return TrendLine(b[edge], m[edge], int(touches[edge]), int(starts[edge]))
 
-            # Loop through all prices to make sure none pass through this line
-            for k in range(len(prices)):
-                test_y = m * k + b
-                if is_support:
-                    test_y = test_y - price_margin
-                else:
-                    test_y = test_y + price_margin
 
-                if prices[k] < test_y and is_support \
-                        or prices[k] > test_y and not is_support:
-                    break
+def _hull_chain(prices: list, lower: bool) -> [int]:
+    """
+    A function that builds one chain of the convex hull of (index, price) points.
 
-            else:
-                # No prices broke through the trendline, so count the number of times the
-                # prices touch (come within price_margin) the trendline
+    Prices are already sorted by index, so Andrew's monotone chain needs a single pass.
 
-                touch_count = 0
-                for k in range(len(derivatives)):
-                    test_y = m * derivatives[k] + b
-                    if test_y - price_margin <= \
-                            prices[derivatives[k]] <= test_y + price_margin:
-                        touch_count += 1
+    :param prices: A list of prices.
+    :param lower: Build the lower chain, otherwise the upper one.
+    :return: The indexes of the chain's vertices, from left to right. Vertices in the
+             middle of a straight edge are dropped.
+    """
 
-                if touch_count >= best_count:
-                    best_count = touch_count
-                    best_trendline = TrendLine(b, m, best_count,
-                                               derivatives[derivative_start])
+    sign = 1 if lower else -1
+    chain = []
+    for x, y in enumerate(prices):
+        while len(chain) >= 2:
+            x1, y1 = chain[-2], prices[chain[-2]]
+            x2, y2 = chain[-1], prices[chain[-1]]
+            if sign * ((x2 - x1) * (y - y1) - (y2 - y1) * (x - x1)) > 0:
+                break
+            chain.pop()
+        chain.append(x)
 
-    return best_trendline
+    return chain
 
 
+@timed('draw_chart')
 def draw_chart(chart_data: Chart) -> None:
     """
     A function that draws the data on a matplotlib chart.
@@ -447,65 +1290,72 @@ def draw_chart(chart_data: Chart) -> None:
     :return: None.
     """
 
+    from matplotlib import pyplot as plt
+
     ax1 = plt.subplot2grid((1, 1), (0, 0))
-    candlestick_ohlc(ax1, chart_data.prices.values, width=0.0001, colorup='g',
-                     colordown='r')
-    ax1.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-    plt.title(chart_data.symbol)
+    plot_chart(ax1, chart_data)
+
+    print("Close chart to continue...")
+    plt.show()
+
+
+def plot_chart(axes, chart_data: Chart) -> None:
+    """
+    A function that draws the candles, extrema and trendlines of a chart onto axes.
+
+    :param axes: The matplotlib Axes to draw on.
+    :param chart_data: A Chart object containing all data needed to render a chart.
+    :return: None.
+    """
 
-    for label in ax1.xaxis.get_ticklabels():
-        label.set_rotation(45)
+    import matplotlib.dates as mdates
+    from mpl_finance import candlestick_ohlc
 
-    # Plot points for each maxima/minima found
-    for i in chart_data.support_points:
-        plt.plot(chart_data.prices['datetime'][i], chart_data.prices['low'][i], 'b+')
+    candlestick_ohlc(axes, np.asarray(chart_data.prices), width=0.0001, colorup='g',
+                     colordown='r')
+    axes.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+    axes.tick_params(axis='x', labelrotation=45)
+    axes.set_title(chart_data.symbol)
 
-    for i in chart_data.resistance_points:
-        plt.plot(chart_data.prices['datetime'][i], chart_data.prices['high'][i], 'y+')
+    x_dates = np.asarray(chart_data.prices['datetime'], dtype=float)
+    lows = np.asarray(chart_data.prices['low'], dtype=float)
+    highs = np.asarray(chart_data.prices['high'], dtype=float)
 
-    axes = plt.gca()
+    # Plot points for each maxima/minima found, one call per kind
+    support_points = np.asarray(chart_data.support_points, dtype=np.intp)
+    resistance_points = np.asarray(chart_data.resistance_points, dtype=np.intp)
+    axes.plot(x_dates[support_points], lows[support_points], 'b+')
+    axes.plot(x_dates[resistance_points], highs[resistance_points], 'y+')
 
     ymin, ymax = axes.get_ylim()
     xmin, xmax = axes.get_xlim()
 
-    x_vals = np.array(range(len(chart_data.prices['datetime'])))
-    x_dates = np.array(chart_data.prices['datetime'])
+    x_vals = np.arange(len(x_dates))
 
     if chart_data.resistance:
         y_vals_res = chart_data.resistance.m * x_vals + chart_data.resistance.b
-        plt.plot(x_dates, y_vals_res, '--')
+        axes.plot(x_dates, y_vals_res, '--')
 
     if chart_data.support:
         y_vals_sup = chart_data.support.m * x_vals + chart_data.support.b
-        plt.plot(x_dates, y_vals_sup, '--')
+        axes.plot(x_dates, y_vals_sup, '--')
 
     # re-set the y limits
     axes.set_ylim(ymin, ymax)
     axes.set_xlim(xmin, xmax)
 
-    print("Close chart to continue...")
-    plt.show()
-
 
-def get_s_and_p_500():
+def get_s_and_p_500(refresh: bool = False):
     """
     A function to get all S&P 500 stock symbols.
 
-    Credit: https://medium.com/wealthy-bytes/5-lines-of-python-to-automate-getting-the-s-p-500-95a632e5e567
-    :return: pandas.DataFrame[['symbol', 'company_name']]
-    """
-
-    s_p_url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
-    try:
-        sp_table = pd.read_html(s_p_url)
-    except urllib.error.URLError:
-        print(f"Error reading S&P 500 stocks symbols from Wikipedia, check your internet "
-              f"connection, the url {s_p_url} and then try again.")
-        sys.exit(0)
+    The list is downloaded from Wikipedia at most once a week and cached, see
+    universe.get_universe.
 
-    df = sp_table[0]
+    :param refresh: Download the list even if the cached copy is recent.
+    :return: pandas.DataFrame[['symbol', 'company_name', 'sector']]
+    """
 
-    df = df[['Symbol', 'Security']]
-    df = df.rename(columns={"Symbol": "symbol", "Security": "company_name"})
+    from stock_analyzer import universe
 
-    return df
+    return universe.get_universe('sp500', refresh=refresh)
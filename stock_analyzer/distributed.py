@@ -0,0 +1,400 @@
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+from stock_analyzer import core, scan
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS parameters (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shards (
+    id INTEGER PRIMARY KEY,
+    symbols TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS results (
+    shard_id INTEGER NOT NULL,
+    symbol TEXT NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (shard_id, symbol)
+);
+"""
+
+
+# Number of times a shard is leased before it is given up on, if its leases keep expiring
+MAX_ATTEMPTS = 3
+
+# Name the scan's symbols are stored under in the parameters table. Never a scan
+# parameter, since the symbols are scan's first argument.
+_SYMBOLS = 'symbols'
+
+
+class QueueMismatchError(Exception):
+    """Raised when a queue is resumed for a scan of other symbols or parameters"""
+
+
+class WorkQueue:
+    """Durable queue of symbol shards in a SQLite file, shared by workers on any host
+
+    Workers lease a shard for a limited time and renew the lease while they work on it.
+    Shards whose lease runs out, because their worker died or lost touch with the queue,
+    are handed to the next worker that asks for one, until they have been leased
+    max_attempts times. They are then marked failed, with an error result per symbol,
+    so a shard that crashes every worker can't hold up the scan. The file can be shared
+    between hosts on any filesystem that supports SQLite locking.
+    """
+
+    def __init__(self, path: str, timeout: float = 60):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def create(self, symbols: [str], shard_size: int = 50,
+               parameters: dict = None) -> int:
+        """A function to split symbols into shards and put them on the queue.
+
+        A queue that already has shards is left as it is, so a coordinator can be
+        restarted without scanning everything again, as long as it is restarted for the
+        same symbols and parameters.
+
+        :param symbols: A list of stock symbols.
+        :param shard_size: The number of symbols per shard.
+        :param parameters: The scan parameters every worker uses, such as n, fitter,
+                           end_date or timeframes. Must be JSON serializable.
+        :return: The number of shards added.
+        :raises QueueMismatchError: If the queue already holds a scan of other symbols or
+                                    with other parameters.
+        """
+
+        stored = {_SYMBOLS: list(symbols), **(parameters or {})}
+        with self._transaction() as cursor:
+            if cursor.execute("SELECT COUNT(*) FROM shards").fetchone()[0]:
+                queued = {name: json.loads(value) for name, value
+                          in cursor.execute("SELECT name, value FROM parameters")}
+                # Compare the JSON forms, as tuples come back as lists
+                if queued != json.loads(json.dumps(stored)):
+                    raise QueueMismatchError(
+                        f"{self.path} holds a scan of other symbols or parameters. "
+                        f"Remove it to start a new scan.")
+                return 0
+
+            cursor.executemany("INSERT INTO parameters VALUES (?, ?)",
+                               [(name, json.dumps(value))
+                                for name, value in stored.items()])
+            shards = [symbols[start:start + shard_size]
+                      for start in range(0, len(symbols), shard_size)]
+            cursor.executemany("INSERT INTO shards (symbols) VALUES (?)",
+                               [(json.dumps(shard),) for shard in shards])
+
+        return len(shards)
+
+    def parameters(self) -> dict:
+        """A function to read the scan parameters given to create.
+
+        :return: A dictionary of parameter name -> value.
+        """
+
+        return {name: json.loads(value) for name, value
+                in self.connection.execute("SELECT name, value FROM parameters")
+                if name != _SYMBOLS}
+
+    def claim(self, worker: str, lease_seconds: float = 300,
+              max_attempts: int = MAX_ATTEMPTS) -> (int, [str]):
+        """A function to lease the next pending or expired shard.
+
+        :param worker: A name for the worker, unique across hosts.
+        :param lease_seconds: How long the shard is leased for before it may be handed to
+                              another worker, unless renewed.
+        :param max_attempts: The number of leases a shard gets. An expired shard that
+                             has had them all is marked failed instead of leased again.
+        :return: A tuple of the shard id and its symbols. None if no shard is available.
+        """
+
+        now = time.time()
+        with self._transaction() as cursor:
+            self._fail_exhausted(cursor, now, max_attempts)
+
+            shard = cursor.execute(
+                "SELECT id, symbols FROM shards WHERE status = 'pending' "
+                "OR (status = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1",
+                (now,)).fetchone()
+            if shard is None:
+                return None
+
+            cursor.execute("UPDATE shards SET status = 'leased', worker = ?, "
+                           "lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                           (worker, now + lease_seconds, shard[0]))
+
+        return shard[0], json.loads(shard[1])
+
+    def fail_exhausted(self, max_attempts: int = MAX_ATTEMPTS) -> int:
+        """A function to mark failed every expired shard that has had all its leases.
+
+        claim does this too, but the coordinator also needs it when no worker is left to
+        claim anything.
+
+        :param max_attempts: The number of leases a shard gets.
+        :return: The number of shards marked failed.
+        """
+
+        with self._transaction() as cursor:
+            return self._fail_exhausted(cursor, time.time(), max_attempts)
+
+    @staticmethod
+    def _fail_exhausted(cursor, now: float, max_attempts: int) -> int:
+        exhausted = cursor.execute(
+            "SELECT id, symbols, attempts FROM shards WHERE status = 'leased' "
+            "AND lease_expires < ? AND attempts >= ?", (now, max_attempts)).fetchall()
+        for shard_id, symbols, attempts in exhausted:
+            error = RuntimeError(f"shard {shard_id} failed after {attempts} attempts")
+            cursor.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                               [(shard_id, symbol,
+                                 json.dumps(scan.error_result(symbol, error)))
+                                for symbol in json.loads(symbols)])
+            cursor.execute("UPDATE shards SET status = 'failed', lease_expires = NULL "
+                           "WHERE id = ?", (shard_id,))
+
+        return len(exhausted)
+
+    def renew(self, shard_id: int, worker: str, lease_seconds: float = 300) -> bool:
+        """A function to extend a worker's lease on a shard.
+
+        :param shard_id: The shard id returned by claim.
+        :param worker: The worker that claimed the shard.
+        :param lease_seconds: How long from now the lease lasts.
+        :return: False if the lease was lost to another worker or the shard is done.
+        """
+
+        with self._transaction() as cursor:
+            cursor.execute("UPDATE shards SET lease_expires = ? WHERE id = ? AND "
+                           "worker = ? AND status = 'leased'",
+                           (time.time() + lease_seconds, shard_id, worker))
+            return cursor.rowcount == 1
+
+    def complete(self, shard_id: int, results: [dict]) -> None:
+        """A function to store the results of a shard and mark it done.
+
+        Results are stored per symbol, so a shard finished by two workers after a lease
+        expired is only reported once.
+
+        :param shard_id: The shard id returned by claim.
+        :param results: One analyze dictionary per symbol of the shard.
+        :return: None.
+        """
+
+        with self._transaction() as cursor:
+            cursor.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                               [(shard_id, result['symbol'], json.dumps(result))
+                                for result in results])
+            cursor.execute("UPDATE shards SET status = 'done', lease_expires = NULL "
+                           "WHERE id = ?", (shard_id,))
+
+    def progress(self) -> dict:
+        """A function to count the shards in each state.
+
+        :return: A dictionary with 'pending', 'leased', 'done' and 'failed' shard counts.
+        """
+
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        counts.update(self.connection.execute(
+            "SELECT status, COUNT(*) FROM shards GROUP BY status"))
+
+        return counts
+
+    def results(self):
+        """A generator that reads the stored results in shard and symbol order.
+
+        :return: Yields one analyze dictionary per symbol.
+        """
+
+        for result, in self.connection.execute(
+                "SELECT result FROM results ORDER BY shard_id, symbol"):
+            yield json.loads(result)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # Take the write lock up front, so two workers never claim the same shard
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        cursor.execute("COMMIT")
+
+
+class LeaseRenewer:
+    """Renews a worker's lease on a shard on a timer while the worker scans it
+
+    Renewals run on a thread with its own connection to the queue, so a symbol that takes
+    longer than the lease, such as one waiting out lookup retries, doesn't lose the shard
+    to another worker. Used as a context manager around the scan of the shard.
+    """
+
+    def __init__(self, queue_path: str, shard_id: int, worker: str,
+                 lease_seconds: float = 300):
+        self.queue_path = queue_path
+        self.shard_id = shard_id
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._renew, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+
+    def _renew(self) -> None:
+        queue = WorkQueue(self.queue_path)
+        try:
+            while not self._stop.wait(self.lease_seconds / 3):
+                if not queue.renew(self.shard_id, self.worker, self.lease_seconds):
+                    self.lost.set()
+                    return
+        finally:
+            queue.close()
+
+
+def default_worker_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def work(queue_path: str, worker: str = None, lease_seconds: float = 300,
+         poll_interval: float = 5, processes: int = None, source=None, cache=None,
+         max_attempts: int = MAX_ATTEMPTS) -> int:
+    """
+    A function that claims shards from a queue and scans them until all are done.
+
+    While a shard is scanned a LeaseRenewer renews its lease every third of
+    lease_seconds. If the lease is lost before the scan ends, the shard is given up.
+    When every remaining shard is leased by another worker, this waits in case one of
+    their leases expires. Returns straight away if the coordinator hasn't filled the
+    queue yet.
+
+    :param queue_path: The SQLite file of the WorkQueue.
+    :param worker: A name for this worker, unique across hosts. Defaults to the host name
+                   and process id.
+    :param lease_seconds: How long a shard is leased for between renewals.
+    :param poll_interval: Seconds to wait between claims while other workers hold leases.
+    :param processes: The number of worker processes. Defaults to the number of CPUs.
+    :param source: Where prices come from. Defaults to the Ameritrade API.
+    :param cache: A CandleCache, for multi-timeframe scans.
+    :param max_attempts: The number of leases a shard gets before it is marked failed.
+    :return: The number of shards this worker completed.
+    """
+
+    if worker is None:
+        worker = default_worker_name()
+
+    queue = WorkQueue(queue_path)
+    try:
+        patterns = core.load_patterns()
+
+        completed = 0
+        while True:
+            shard = queue.claim(worker, lease_seconds, max_attempts)
+            if shard is None:
+                progress = queue.progress()
+                if not progress['pending'] and not progress['leased']:
+                    return completed
+                time.sleep(poll_interval)
+                continue
+
+            shard_id, symbols = shard
+            parameters = queue.parameters()
+            timeframes = parameters.pop('timeframes', None)
+            if timeframes:
+                from stock_analyzer import timeframes as multi_timeframe
+                results = multi_timeframe.scan_timeframes(symbols, patterns, timeframes,
+                                                          processes=processes,
+                                                          source=source, cache=cache,
+                                                          **parameters)
+            else:
+                results = scan.scan(symbols, patterns, processes=processes,
+                                    source=source, **parameters)
+
+            shard_results = []
+            try:
+                with LeaseRenewer(queue_path, shard_id, worker, lease_seconds) as renewer:
+                    for result in results:
+                        shard_results.append(result)
+                        if renewer.lost.is_set():
+                            break
+            finally:
+                results.close()
+
+            # A lease lost after the last symbol still leaves a whole shard to store, and
+            # completing a shard twice is harmless
+            if len(shard_results) < len(symbols):
+                print(f"Lost the lease on shard {shard_id}, leaving it to another worker",
+                      file=sys.stderr)
+                continue
+
+            queue.complete(shard_id, shard_results)
+            completed += 1
+    finally:
+        queue.close()
+
+
+def coordinate(queue_path: str, symbols: [str], shard_size: int = 50,
+               poll_interval: float = 5, max_attempts: int = MAX_ATTEMPTS, **parameters):
+    """
+    A generator that puts a scan on a queue, waits for workers to finish it and yields
+    the merged results.
+
+    Progress is printed to stderr whenever it changes. An existing queue is resumed
+    rather than filled again.
+
+    :param queue_path: The SQLite file of the WorkQueue. Created if it doesn't exist.
+    :param symbols: A list of stock symbols.
+    :param shard_size: The number of symbols per shard.
+    :param poll_interval: Seconds between progress checks.
+    :param max_attempts: The number of leases a shard gets before it is marked failed.
+    :param parameters: The scan parameters every worker uses, such as n, fitter,
+                       end_date or timeframes.
+    :return: Yields one analyze dictionary per symbol, in shard order. Symbols of failed
+             shards get a scan.error_result.
+    """
+
+    queue = WorkQueue(queue_path)
+    try:
+        queue.create(symbols, shard_size, parameters)
+
+        last_progress = None
+        while True:
+            # Workers only fail exhausted shards when they claim, and may all be gone
+            queue.fail_exhausted(max_attempts)
+            progress = queue.progress()
+            if progress != last_progress:
+                total = sum(progress.values())
+                print(f"{progress['done']}/{total} shards done, {progress['leased']} "
+                      f"leased, {progress['pending']} pending, {progress['failed']} "
+                      f"failed", file=sys.stderr)
+                last_progress = progress
+            if progress['done'] + progress['failed'] == sum(progress.values()):
+                break
+            time.sleep(poll_interval)
+
+        yield from queue.results()
+    finally:
+        queue.close()
@@ -0,0 +1,140 @@
+import numpy as np
+
+from stock_analyzer import core
+from stock_analyzer.cache import COLUMNS as CANDLE_COLUMNS
+
+
+JSON_EXTENSIONS = ('.ndjson', '.jsonl', '.json')
+
+
+def epoch_millis(datetimes: 'pd.Series') -> 'pd.Series':
+    """
+    A function that converts a datetime column to epoch milliseconds.
+
+    :param datetimes: Epoch milliseconds, or anything pandas.to_datetime understands.
+    :return: The datetimes as epoch milliseconds.
+    """
+
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(datetimes):
+        return datetimes
+
+    return pd.to_datetime(datetimes).astype('datetime64[ms]').astype(np.int64)
+
+
+def read_chunks(path: str, chunk_size: int = 100_000):
+    """
+    A generator that reads a candle dump a chunk of rows at a time.
+
+    Dumps are CSV or NDJSON files, optionally compressed, with one candle per row and
+    'symbol', 'datetime', 'open', 'high', 'low', 'close' and 'volume' fields. Files ending
+    in .ndjson, .jsonl or .json (before any compression extension) are read as NDJSON,
+    anything else as CSV.
+
+    :param path: The dump to read.
+    :param chunk_size: The number of rows held in memory at once.
+    :return: Yields (symbols, candles) tuples: an array of symbols and the matching
+             (n, 6) array of candles with epoch millisecond datetimes, in file order.
+    """
+
+    name = path.lower()
+    for extension in ('.gz', '.bz2', '.xz', '.zip', '.zst'):
+        name = name.removesuffix(extension)
+
+    import pandas as pd
+
+    if name.endswith(JSON_EXTENSIONS):
+        reader = pd.read_json(path, lines=True, chunksize=chunk_size,
+                              dtype={'symbol': str}, convert_dates=False)
+    else:
+        reader = pd.read_csv(path, chunksize=chunk_size, dtype={'symbol': str},
+                             usecols=['symbol'] + CANDLE_COLUMNS)
+
+    with reader:
+        for chunk in reader:
+            chunk['datetime'] = epoch_millis(chunk['datetime'])
+            yield chunk['symbol'].to_numpy(dtype=str), \
+                chunk[CANDLE_COLUMNS].to_numpy(dtype=float)
+
+
+def _group_by_symbol(symbols: np.array, candles: np.array):
+    """Yields (symbol, candles) for each symbol in a chunk, keeping the file order of
+    each symbol's rows."""
+
+    order = np.argsort(symbols, kind='stable')
+    unique, starts = np.unique(symbols[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+
+    for symbol, start, end in zip(unique, starts, ends):
+        yield str(symbol), candles[order[start:end]]
+
+
+def last_windows(path: str, window: int = 40, chunk_size: int = 100_000,
+                 as_frame: bool = False):
+    """
+    A generator that yields the most recent candles of every symbol in a dump.
+
+    Only the last window candles of each symbol are kept while the file is read, so
+    memory is bounded by the chunk size plus window candles per symbol, whatever the size
+    of the file. Rows may be in any order.
+
+    :param path: A CSV or NDJSON dump, as read by read_chunks.
+    :param window: The number of candles per symbol, like num_entries_to_analyze.
+    :param chunk_size: The number of rows held in memory at once.
+    :param as_frame: Yield DataFrames instead of Candles.
+    :return: Yields (symbol, price history) tuples in symbol order, once the whole file
+             has been read.
+    """
+
+    tails = {}
+    for symbols, candles in read_chunks(path, chunk_size):
+        for symbol, rows in _group_by_symbol(symbols, candles):
+            if symbol in tails:
+                rows = np.concatenate([tails[symbol], rows])
+
+            tails[symbol] = rows[np.argsort(rows[:, 0], kind='stable')][-window:]
+
+    for symbol in sorted(tails):
+        yield symbol, core.candle_frame(tails.pop(symbol), window, as_frame)
+
+
+def symbol_windows(path: str, window: int = 40, step: int = 1,
+                   chunk_size: int = 100_000, as_frame: bool = False):
+    """
+    A generator that slides a window over the candles of every symbol in a dump.
+
+    Each symbol's rows must be in date order, but symbols may be interleaved. Windows
+    are yielded as soon as the chunk that completes them is read, and only the last
+    window - 1 candles of each symbol are carried between chunks, so memory is bounded
+    by the chunk size plus one window per symbol.
+
+    :param path: A CSV or NDJSON dump, as read by read_chunks.
+    :param window: The number of candles in each window.
+    :param step: The number of candles between the starts of successive windows.
+    :param chunk_size: The number of rows held in memory at once.
+    :param as_frame: Yield DataFrames instead of Candles.
+    :return: Yields (symbol, price history) tuples, one per window.
+    """
+
+    tails = {}
+    counts = {}
+    for symbols, candles in read_chunks(path, chunk_size):
+        for symbol, rows in _group_by_symbol(symbols, candles):
+            tail = tails.get(symbol)
+            if tail is not None:
+                rows = np.concatenate([tail, rows])
+
+            seen = counts.get(symbol, 0)
+            total = seen + len(rows) - (0 if tail is None else len(tail))
+            first = total - len(rows)
+
+            # Windows end after candle number `end`, counted over the whole file
+            for end in range(max(seen + 1, window), total + 1):
+                if (end - window) % step == 0:
+                    start = end - window - first
+                    yield symbol, core.candle_frame(rows[start:end - first], window,
+                                                    as_frame)
+
+            tails[symbol] = rows[-(window - 1):] if window > 1 else rows[:0]
+            counts[symbol] = total
@@ -0,0 +1,152 @@
+import contextlib
+import functools
+import json
+import threading
+import time
+
+
+class Instrumentation:
+    """Thread-safe wall time and counter totals for each stage of a run
+
+    Recording is off until enable is called, and costs one attribute check per call
+    while it is off.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+
+    def record(self, stage: str, seconds: float, calls: int = 1) -> None:
+        """A function to add time spent in a stage."""
+
+        with self.lock:
+            total = self.timers.setdefault(stage, {'calls': 0, 'seconds': 0.0})
+            total['calls'] += calls
+            total['seconds'] += seconds
+
+    def add(self, counter: str, value: int = 1) -> None:
+        """A function to increase a counter."""
+
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    @contextlib.contextmanager
+    def stage(self, stage: str):
+        """A context manager that records the wall time of the block inside it."""
+
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        """A function that returns a copy of everything recorded so far.
+
+        :return: A dictionary with 'timers' (stage -> calls and seconds) and 'counters'.
+        """
+
+        with self.lock:
+            return {'timers': {stage: dict(total)
+                               for stage, total in self.timers.items()},
+                    'counters': dict(self.counters)}
+
+    def merge(self, snapshot: dict) -> None:
+        """A function to add a snapshot taken elsewhere, such as in a worker process."""
+
+        for stage, total in snapshot['timers'].items():
+            self.record(stage, total['seconds'], total['calls'])
+
+        with self.lock:
+            for counter, value in snapshot['counters'].items():
+                self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def summary_table(self) -> str:
+        """A function that formats the recorded totals as a table."""
+
+        snapshot = self.snapshot()
+        lines = [f"{'stage':<24}{'calls':>10}{'seconds':>14}{'ms/call':>12}"]
+        for stage, total in sorted(snapshot['timers'].items(),
+                                   key=lambda item: -item[1]['seconds']):
+            per_call = total['seconds'] / total['calls'] * 1000 if total['calls'] else 0
+            lines.append(f"{stage:<24}{total['calls']:>10}{total['seconds']:>14.4f}"
+                         f"{per_call:>12.3f}")
+
+        if snapshot['counters']:
+            lines.append("")
+            lines.append(f"{'counter':<24}{'value':>10}")
+            for counter, value in sorted(snapshot['counters'].items()):
+                lines.append(f"{counter:<24}{value:>10}")
+
+        return "\n".join(lines)
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """A function that formats the recorded totals in the Prometheus text format."""
+
+        snapshot = self.snapshot()
+        lines = ["# TYPE stock_analyzer_stage_seconds_total counter"]
+        for stage, total in sorted(snapshot['timers'].items()):
+            lines.append(f'stock_analyzer_stage_seconds_total{{stage="{stage}"}} '
+                         f"{total['seconds']}")
+
+        lines.append("# TYPE stock_analyzer_stage_calls_total counter")
+        for stage, total in sorted(snapshot['timers'].items()):
+            lines.append(f'stock_analyzer_stage_calls_total{{stage="{stage}"}} '
+                         f"{total['calls']}")
+
+        for counter, value in sorted(snapshot['counters'].items()):
+            lines.append(f"# TYPE stock_analyzer_{counter}_total counter")
+            lines.append(f"stock_analyzer_{counter}_total {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """A function that writes the totals to a file, as JSON for a .json path and as
+        Prometheus text otherwise."""
+
+        with open(path, 'w') as metrics_file:
+            if path.lower().endswith('.json'):
+                metrics_file.write(self.to_json())
+            else:
+                metrics_file.write(self.to_prometheus())
+
+
+# The instrumentation shared by the whole process
+instrumentation = Instrumentation()
+
+
+def timed(stage: str):
+    """A decorator that records the wall time and calls of a function as a stage."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not instrumentation.enabled:
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                instrumentation.record(stage, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,118 @@
+import json
+import os
+import time
+
+from stock_analyzer import core, scan
+
+
+class Journal:
+    """Append-only JSON Lines record of the symbols a run has finished or failed
+
+    Each symbol gets a line as soon as it finishes, flushed to disk, so an interrupted run
+    can be resumed without redoing finished symbols. The last line for a symbol wins, and
+    a partial last line left by a crash is ignored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+
+        ends_with_newline = True
+        if os.path.exists(path):
+            with open(path) as journal_file:
+                for line in journal_file:
+                    ends_with_newline = line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry['symbol']] = entry
+
+        self.file = open(path, 'a')
+        if not ends_with_newline:
+            self.file.write('\n')
+
+    def close(self) -> None:
+        self.file.close()
+
+    def is_done(self, symbol: str, max_attempts: int = None) -> bool:
+        """A function to check whether a symbol needs to be run again.
+
+        :param symbol: A stock symbol. Example: 'AAPL'
+        :param max_attempts: Also treat symbols that failed this many times as done.
+        :return: True if the symbol finished, or failed too often to retry.
+        """
+
+        entry = self.entries.get(symbol)
+        if entry is None:
+            return False
+
+        return entry['status'] == 'done' or \
+            max_attempts is not None and entry['attempts'] >= max_attempts
+
+    def record(self, symbol: str, status: str, result: dict = None,
+               error: str = None) -> None:
+        """A function to append the outcome of a symbol to the journal.
+
+        :param symbol: A stock symbol. Example: 'AAPL'
+        :param status: 'done' or 'failed'.
+        :param result: The symbol's result, reported again when the run is resumed.
+        :param error: The error message of a failed symbol.
+        :return: None.
+        """
+
+        previous = self.entries.get(symbol, {})
+        entry = {'symbol': symbol, 'status': status,
+                 'attempts': previous.get('attempts', 0) + 1, 'time': time.time(),
+                 'error': error, 'result': result}
+        self.entries[symbol] = entry
+
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+
+def resumable_scan(symbols: [str], patterns: [core.Pattern], journal_path: str,
+                   retries: int = 3, backoff: float = 1.0, max_attempts: int = 3,
+                   **kwargs):
+    """
+    A generator that runs scan.scan with a journal, so an interrupted scan can resume.
+
+    Symbols the journal has a result for are reported from it rather than scanned
+    again. Transient lookup failures are retried with backoff, and a symbol that still
+    fails, or whose analysis raises, gets an error result without stopping the others.
+    Failed symbols are scanned again when the scan is resumed, until they have failed
+    max_attempts times.
+
+    :param symbols: A list of stock symbols.
+    :param patterns: List of Pattern objects to detect.
+    :param journal_path: The journal file. Created if it doesn't exist.
+    :param retries: The number of times a lookup is retried within a run.
+    :param backoff: Seconds before the first retry of a lookup, doubled for each retry.
+    :param max_attempts: The number of runs a symbol is attempted in.
+    :param kwargs: Any other scan.scan parameters, such as source, processes or end_date.
+    :return: Yields one analyze dictionary per symbol: journaled ones first, then the
+             rest as they finish.
+    """
+
+    journal = Journal(journal_path)
+    try:
+        remaining = []
+        for symbol in dict.fromkeys(symbols):
+            if journal.is_done(symbol, max_attempts) \
+                    and journal.entries[symbol]['result'] is not None:
+                yield journal.entries[symbol]['result']
+            else:
+                remaining.append(symbol)
+
+        for result in scan.scan(remaining, patterns, retries=retries, backoff=backoff,
+                                **kwargs):
+            symbol = result['symbol']
+            if result['status'] == 'error':
+                journal.record(symbol, 'failed', result, result['error'])
+            else:
+                journal.record(symbol, 'done', result)
+
+            yield result
+    finally:
+        journal.close()
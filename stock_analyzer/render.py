@@ -0,0 +1,84 @@
+import concurrent.futures
+import os
+
+from stock_analyzer import core
+from stock_analyzer.instrument import timed
+
+
+class ChartRenderer:
+    """Draws charts to image files on one reusable, non-interactive figure
+
+    Uses Matplotlib's Agg canvas directly, so no GUI backend or pyplot state is involved
+    and the figure and axes are cleared and reused for every chart.
+    """
+
+    def __init__(self, width: float = 12, height: float = 6, dpi: int = 100):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.figure = Figure(figsize=(width, height), dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot(1, 1, 1)
+
+    @timed('render')
+    def render(self, chart_data: core.Chart, path: str) -> str:
+        """A function that draws a chart and saves it, in the format of the extension.
+
+        :param chart_data: A Chart object containing all data needed to render a chart.
+        :param path: The image file to write, such as AAPL.png or AAPL.svg.
+        :return: The path written.
+        """
+
+        self.axes.clear()
+        core.plot_chart(self.axes, chart_data)
+        self.figure.savefig(path, bbox_inches='tight')
+
+        return path
+
+
+# Each process keeps one renderer, created the first time it draws a chart
+_renderer = None
+
+
+def render_to_file(chart_data: core.Chart, path: str) -> str:
+    """
+    A function that renders a chart with this process's shared ChartRenderer.
+
+    :param chart_data: A Chart object containing all data needed to render a chart.
+    :param path: The image file to write.
+    :return: The path written.
+    """
+
+    global _renderer
+
+    if _renderer is None:
+        _renderer = ChartRenderer()
+
+    return _renderer.render(chart_data, path)
+
+
+def chart_path(directory: str, symbol: str, file_format: str = 'png') -> str:
+    return os.path.join(directory, f"{symbol}.{file_format}")
+
+
+def render_charts(charts: [core.Chart], directory: str, file_format: str = 'png',
+                  detected_only: bool = False, processes: int = None) -> [str]:
+    """
+    A function that renders many charts to image files on a process pool.
+
+    :param charts: Chart objects to render.
+    :param directory: The directory to write <SYMBOL>.<file_format> files to.
+    :param file_format: 'png', 'svg' or any other format Matplotlib can save.
+    :param detected_only: Only render charts with a detected pattern.
+    :param processes: The number of worker processes. Defaults to the number of CPUs.
+    :return: The paths written, in the order of charts.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+
+    charts = [chart for chart in charts if chart.detected_patterns or not detected_only]
+    paths = [chart_path(directory, chart.symbol, file_format) for chart in charts]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(render_to_file, charts, paths,
+                                 chunksize=max(1, len(charts) // 32)))
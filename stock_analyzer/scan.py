@@ -0,0 +1,307 @@
+import concurrent.futures
+import csv
+import functools
+import json
+import os
+import sys
+
+import numpy as np
+
+from stock_analyzer import core
+from stock_analyzer.instrument import instrumentation
+from stock_analyzer.sources import AmeritradeSource, PriceSource
+
+
+CSV_FIELDS = ['symbol', 'status', 'support_b', 'support_m', 'support_touches',
+              'support_first_day', 'resistance_b', 'resistance_m', 'resistance_touches',
+              'resistance_first_day', 'pattern_name', 'breakout', 'buy_price',
+              'sell_price', 'stop_price', 'profit_margin', 'loss_margin', 'chart']
+
+
+def analyze(symbol: str, price_history, patterns: [core.Pattern], n: int = 2,
+            chart_directory: str = None, chart_format: str = 'png',
+            detected_only: bool = True, fitter: str = 'pairs') -> dict:
+    """
+    A function that runs the analysis pipeline for one symbol.
+
+    Nothing is drawn unless a chart_directory is given, and then only to an image file.
+
+    :param symbol: A stock symbol. Example: 'AAPL'
+    :param price_history: A Pandas Dataframe as returned by core.lookup_prices, or None.
+    :param patterns: List of Pattern objects to detect.
+    :param n: The number of entries scanned for local minima/maxima.
+    :param chart_directory: Directory to render <SYMBOL>.<chart_format> charts to.
+    :param chart_format: 'png', 'svg' or any other format Matplotlib can save.
+    :param detected_only: Only render charts with a detected pattern.
+    :param fitter: The trendline fitter, 'pairs' or 'hull'. See core.best_fit_line.
+    :return: A dictionary with the symbol, its status, the epoch milliseconds of the last
+             candle ('as_of'), trendlines, the number of candles after the last one
+             until the trendlines meet ('apex', None if they don't) and detected
+             patterns, plus the chart path if one was rendered.
+    """
+
+    if price_history is None:
+        return {'symbol': symbol, 'status': 'no data', 'support': None,
+                'resistance': None, 'patterns': []}
+
+    support_points, resistance_points = \
+        core.get_supports_and_resistances(price_history, n)
+
+    best_support_line = core.best_fit_line(price_history['low'], support_points,
+                                           fitter=fitter)
+    best_resistance_line = core.best_fit_line(price_history['high'], resistance_points,
+                                              False, fitter)
+
+    chart = core.Chart(symbol, price_history, best_support_line, best_resistance_line,
+                       support_points, resistance_points, patterns, verbose=False)
+
+    apex = None
+    intercept = chart.support.intercept_point(chart.resistance) if chart.support else None
+    if intercept is not None:
+        apex = float(intercept[0] - (len(price_history) - 1))
+
+    result = {
+        'symbol': symbol,
+        'status': 'ok',
+        'as_of': int(round(float(np.asarray(price_history['datetime'])[-1])
+                           * 86_400_000)),
+        'support': _trendline_record(chart.support),
+        'resistance': _trendline_record(chart.resistance),
+        'apex': apex,
+        'patterns': [{'pattern_name': trade.pattern_name,
+                      'breakout': trade.breakout,
+                      'buy_price': float(trade.buy_price),
+                      'sell_price': float(trade.sell_price),
+                      'stop_price': float(trade.stop_price),
+                      'profit_margin': float(trade.profit_margin),
+                      'loss_margin': float(trade.loss_margin)}
+                     for trade in chart.detected_patterns],
+    }
+
+    if chart_directory and (chart.detected_patterns or not detected_only):
+        from stock_analyzer import render
+        result['chart'] = render.render_to_file(
+            chart, render.chart_path(chart_directory, symbol, chart_format))
+
+    return result
+
+
+def error_result(symbol: str, error: Exception) -> dict:
+    """
+    A function that builds the result of a symbol whose analysis failed.
+
+    :param symbol: A stock symbol. Example: 'AAPL'
+    :param error: The exception that was raised.
+    :return: A dictionary with the symbol, an 'error' status and the error message, and
+             no trendlines or patterns.
+    """
+
+    return {'symbol': symbol, 'status': 'error',
+            'error': f"{type(error).__name__}: {error}", 'support': None,
+            'resistance': None, 'patterns': []}
+
+
+def _analyze_instrumented(symbol: str, price_history, analyzer=analyze,
+                          **kwargs) -> (dict, dict):
+    """Runs an analyzer in a worker process and returns its instrumentation with the
+    result."""
+
+    instrumentation.enabled = True
+    instrumentation.reset()
+    result = analyzer(symbol, price_history, **kwargs)
+
+    return result, instrumentation.snapshot()
+
+
+def _trendline_record(trendline: core.TrendLine) -> dict:
+    if trendline is None:
+        return None
+
+    return {'b': float(trendline.b), 'm': float(trendline.m),
+            'touches': int(trendline.touches), 'first_day': int(trendline.first_day)}
+
+
+def scan(symbols: [str], patterns: [core.Pattern], processes: int = None, n: int = 2,
+         source: PriceSource = None, chart_directory: str = None,
+         chart_format: str = 'png', detected_only: bool = True, fitter: str = 'pairs',
+         **kwargs):
+    """
+    A generator that analyzes many symbols on a process pool.
+
+    Prices are fetched with the source's lookup_prices_many, and each history is handed
+    to a worker process as soon as it arrives. Results are yielded as they finish. Charts
+    are only rendered when a chart_directory is given, by the worker that analyzed them.
+    A symbol whose lookup fails, after any retries, gets an error_result.
+
+    :param symbols: A list of stock symbols.
+    :param patterns: List of Pattern objects to detect.
+    :param processes: The number of worker processes. Defaults to the number of CPUs.
+    :param n: The number of entries scanned for local minima/maxima.
+    :param source: Where prices come from. Defaults to the Ameritrade API.
+    :param chart_directory: Directory to render <SYMBOL>.<chart_format> charts to.
+    :param chart_format: 'png', 'svg' or any other format Matplotlib can save.
+    :param detected_only: Only render charts with a detected pattern.
+    :param fitter: The trendline fitter, 'pairs' or 'hull'. See core.best_fit_line.
+    :param kwargs: Any other lookup_prices_many parameters, such as retries, or
+                   lookup_prices parameters, applied to every symbol. Prices are fetched
+                   as Candles unless as_frame=True is given.
+    :return: Yields one analyze dictionary per symbol.
+    """
+
+    if source is None:
+        source = AmeritradeSource()
+
+    # Candles are cheaper to build and to pickle to workers than DataFrames
+    kwargs.setdefault('as_frame', False)
+
+    failures = {}
+
+    def lookup_failed(symbol, error):
+        failures[symbol] = error
+
+    price_histories = source.lookup_prices_many(symbols, on_error=lookup_failed, **kwargs)
+    for result in scan_histories(price_histories, patterns, processes=processes, n=n,
+                                 chart_directory=chart_directory,
+                                 chart_format=chart_format, detected_only=detected_only,
+                                 fitter=fitter):
+        error = failures.pop(result['symbol'], None)
+        yield result if error is None else error_result(result['symbol'], error)
+
+
+def scan_histories(price_histories, patterns: [core.Pattern], processes: int = None,
+                   n: int = 2, chart_directory: str = None, chart_format: str = 'png',
+                   detected_only: bool = True, analyzer=analyze, max_pending: int = None,
+                   **kwargs):
+    """
+    A generator that analyzes price histories on a process pool as they arrive.
+
+    At most max_pending histories are submitted and not yet analyzed at any time, so a
+    chunked reader such as ingest.symbol_windows isn't drained into the pool's queue.
+
+    :param price_histories: An iterable of (symbol, price history or None) tuples, such as
+                            a source's lookup_prices_many or ingest.symbol_windows.
+    :param patterns: List of Pattern objects to detect.
+    :param processes: The number of worker processes. Defaults to the number of CPUs.
+    :param n: The number of entries scanned for local minima/maxima.
+    :param chart_directory: Directory to render <SYMBOL>.<chart_format> charts to.
+    :param chart_format: 'png', 'svg' or any other format Matplotlib can save.
+    :param detected_only: Only render charts with a detected pattern.
+    :param analyzer: The function each worker runs, analyze unless another analysis,
+                     such as timeframes.analyze_timeframes, is wanted. It must be
+                     picklable.
+    :param max_pending: The number of histories in flight before waiting for a result.
+                        Defaults to twice the number of worker processes.
+    :param kwargs: Any other analyzer parameters.
+    :return: Yields one analyzer dictionary per price history. A history whose analysis
+             raises gets an error_result instead, so one symbol can't stop the scan.
+    """
+
+    # Worker processes have their own instrumentation, so send theirs back to merge
+    instrumented = instrumentation.enabled
+    worker = functools.partial(_analyze_instrumented, analyzer=analyzer) \
+        if instrumented else analyzer
+    worker = functools.partial(worker, patterns=patterns, n=n,
+                               chart_directory=chart_directory,
+                               chart_format=chart_format, detected_only=detected_only,
+                               **kwargs)
+
+    if chart_directory:
+        os.makedirs(chart_directory, exist_ok=True)
+
+    if max_pending is None:
+        max_pending = 2 * (processes or os.cpu_count() or 1)
+
+    symbols = {}
+
+    def result(future):
+        try:
+            analysis = future.result()
+        except Exception as error:
+            return error_result(symbols.pop(future), error)
+
+        symbols.pop(future)
+        if instrumented:
+            analysis, snapshot = analysis
+            instrumentation.merge(snapshot)
+
+        return analysis
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = set()
+        for symbol, price_history in price_histories:
+            future = executor.submit(worker, symbol, price_history)
+            symbols[future] = symbol
+            pending.add(future)
+
+            # Wait for a result before reading any further once the pool is full
+            timeout = None if len(pending) >= max_pending else 0
+            done, pending = concurrent.futures.wait(
+                pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield result(future)
+
+        for future in concurrent.futures.as_completed(pending):
+            yield result(future)
+
+
+def write_jsonl(results, output_file) -> None:
+    """
+    A function that writes scan results as JSON Lines, one symbol per line.
+
+    :param results: An iterable of analyze dictionaries.
+    :param output_file: A writable text file.
+    :return: None.
+    """
+
+    for result in results:
+        output_file.write(json.dumps(result) + '\n')
+        output_file.flush()
+
+
+def write_csv(results, output_file) -> None:
+    """
+    A function that writes scan results as CSV, one row per detected pattern.
+
+    Symbols without a detected pattern get a single row with empty pattern columns.
+
+    :param results: An iterable of analyze dictionaries.
+    :param output_file: A writable text file.
+    :return: None.
+    """
+
+    writer = csv.DictWriter(output_file, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+
+    for result in results:
+        row = {'symbol': result['symbol'], 'status': result['status'],
+               'chart': result.get('chart')}
+        for line_type in ('support', 'resistance'):
+            if result[line_type]:
+                for key, value in result[line_type].items():
+                    row[f"{line_type}_{key}"] = value
+
+        for pattern in result['patterns'] or [{}]:
+            writer.writerow({**row, **pattern})
+
+        output_file.flush()
+
+
+def write_results(results, output_path: str = None) -> None:
+    """
+    A function that writes scan results to a file, choosing the format by extension.
+
+    :param results: An iterable of analyze dictionaries.
+    :param output_path: A .csv path for CSV, any other path for JSON Lines. Writes JSON
+                        Lines to stdout if None.
+    :return: None.
+    """
+
+    if output_path is None:
+        write_jsonl(results, sys.stdout)
+        return
+
+    with open(output_path, 'w', newline='') as output_file:
+        if os.path.splitext(output_path)[1].lower() == '.csv':
+            write_csv(results, output_file)
+        else:
+            write_jsonl(results, output_file)
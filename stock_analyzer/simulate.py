@@ -0,0 +1,328 @@
+import csv
+
+import numpy as np
+
+from stock_analyzer import backtest, core, timeframes
+
+
+# What happened to a signal's trade, by outcome code
+OUTCOMES = ('unfilled', 'target', 'stop', 'expired', 'open')
+OUTCOME_FIELDS = ['outcome', 'fill_index', 'fill_price', 'exit_index', 'exit_price',
+                  'holding', 'return']
+CSV_FIELDS = ['symbol', 'index', 'datetime', 'pattern_name', 'breakout', 'buy_price',
+              'sell_price', 'stop_price', *OUTCOME_FIELDS]
+SUMMARY_FIELDS = ['pattern_name', 'signals', 'filled', 'targets', 'stops', 'expired',
+                  'win_rate', 'mean_return', 'median_return', 'mean_holding']
+
+
+def _first_true(mask: np.array) -> np.array:
+    """The column of the first True in each row, or the number of columns if none."""
+
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), mask.shape[1])
+
+
+def simulate_trades(signal_index: np.array, buy_price: np.array, sell_price: np.array,
+                    stop_price: np.array, direction: np.array, opens: np.array,
+                    highs: np.array, lows: np.array, closes: np.array, ends: np.array,
+                    entry_bars: int = 5, max_holding: int = 40,
+                    chunk_size: int = 20_000) -> dict:
+    """
+    A function that works out the trades of many signals at once.
+
+    Each signal places a stop order at its buy price on the candles after the one it was
+    detected on. An order that fills within entry_bars candles is then held until the
+    price first touches the target or the stop, or for max_holding candles. First
+    touches are found for a chunk of signals at a time with array operations over a
+    window of candles per signal. Orders and exits that gap through their price are
+    filled at the open. When a candle touches both the target and the stop, the stop is
+    assumed to come first.
+
+    :param signal_index: The candle each signal was detected on, as an index into the
+                         price arrays.
+    :param buy_price: The price each order is entered at.
+    :param sell_price: The target of each trade.
+    :param stop_price: The stop of each trade.
+    :param direction: 1 for trades that buy above the pattern, -1 for short sales.
+    :param opens: Open prices of every series, concatenated.
+    :param highs: High prices, aligned with opens.
+    :param lows: Low prices, aligned with opens.
+    :param closes: Close prices, aligned with opens.
+    :param ends: For each signal, the index just past the end of its series.
+    :param entry_bars: The number of candles an order waits to be filled.
+    :param max_holding: The number of candles a trade is held for at most.
+    :param chunk_size: The number of signals simulated together.
+    :return: A dictionary of arrays, one value per signal: 'outcome' (an index into
+             OUTCOMES), 'fill_index' and 'exit_index' (indexes into the price arrays, -1
+             when unfilled), 'fill_price', 'exit_price', 'holding' (candles from fill to
+             exit) and 'return' (percent, in the direction of the trade). Prices and
+             returns are NaN when unfilled.
+    """
+
+    signal_index = np.asarray(signal_index, dtype=np.int64)
+    buy_price, sell_price, stop_price, direction = (
+        np.asarray(column, dtype=float)
+        for column in (buy_price, sell_price, stop_price, direction))
+    ends = np.asarray(ends, dtype=np.int64)
+    n_signals = len(signal_index)
+
+    # A trailing NaN candle stands in for anything past the end of a series
+    def padded(column):
+        return np.append(np.asarray(column, dtype=float), np.nan)
+
+    opens, highs, lows, closes = (padded(column)
+                                  for column in (opens, highs, lows, closes))
+    outside = len(opens) - 1
+
+    outcome = np.zeros(n_signals, dtype=np.int8)
+    fill_index = np.full(n_signals, -1, dtype=np.int64)
+    exit_index = np.full(n_signals, -1, dtype=np.int64)
+    fill_price = np.full(n_signals, np.nan)
+    exit_price = np.full(n_signals, np.nan)
+
+    width = entry_bars + max_holding
+    offsets = np.arange(width)
+    for start in range(0, n_signals, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        first = signal_index[chunk] + 1
+        rows = first[:, np.newaxis] + offsets
+        rows = np.where(rows < ends[chunk, np.newaxis], rows, outside)
+
+        # Short sales are simulated as long trades on negated prices
+        sign = direction[chunk, np.newaxis]
+        window_opens = opens[rows] * sign
+        window_closes = closes[rows] * sign
+        window_highs = np.where(sign > 0, highs[rows], -lows[rows])
+        window_lows = np.where(sign > 0, lows[rows], -highs[rows])
+        buy = buy_price[chunk, np.newaxis] * sign
+        sell = sell_price[chunk, np.newaxis] * sign
+        stop = stop_price[chunk, np.newaxis] * sign
+
+        fill = _first_true((window_highs >= buy) & (offsets < entry_bars))
+        filled = fill < entry_bars
+        fill_column = np.minimum(fill, width - 1)[:, np.newaxis]
+        fill_value = np.maximum(buy, np.take_along_axis(window_opens, fill_column, 1))
+
+        # Comparisons with the NaN candles past the end of a series are False
+        held = (offsets >= fill_column) & (offsets <= fill_column + max_holding)
+        stopped = _first_true(held & (window_lows <= stop))
+        targeted = _first_true(held & (window_highs >= sell))
+        stop_first = (stopped < width) & (stopped <= targeted)
+        target_first = (targeted < width) & ~stop_first
+
+        # Without a touch the trade is closed at its last candle, or the last there is
+        available = np.minimum(ends[chunk] - first, width) - 1
+        expired = fill + max_holding <= available
+        exit_column = np.select([stop_first, target_first], [stopped, targeted],
+                                np.minimum(fill + max_holding, available))
+        exit_column = np.maximum(exit_column, 0)[:, np.newaxis]
+
+        # On the fill candle the open came before the fill, so only later exits gap
+        at_open = np.take_along_axis(window_opens, exit_column, 1)[:, 0]
+        at_open = np.where(exit_column[:, 0] > fill, at_open, fill_value[:, 0])
+        exit_value = np.select(
+            [stop_first, target_first],
+            [np.minimum(stop[:, 0], at_open), np.maximum(sell[:, 0], at_open)],
+            np.take_along_axis(window_closes, exit_column, 1)[:, 0])
+
+        outcome[chunk] = np.select(
+            [~filled, stop_first, target_first, expired],
+            [OUTCOMES.index('unfilled'), OUTCOMES.index('stop'),
+             OUTCOMES.index('target'), OUTCOMES.index('expired')],
+            OUTCOMES.index('open'))
+        exit_column = exit_column[:, 0]
+        fill_index[chunk] = np.where(filled, first + fill, -1)
+        exit_index[chunk] = np.where(filled, first + exit_column, -1)
+        fill_price[chunk] = np.where(filled, fill_value[:, 0] * sign[:, 0], np.nan)
+        exit_price[chunk] = np.where(filled, exit_value * sign[:, 0], np.nan)
+
+    holding = np.where(fill_index >= 0, exit_index - fill_index, 0)
+    with np.errstate(invalid='ignore'):
+        returns = direction * (exit_price - fill_price) / fill_price * 100
+
+    return {'outcome': outcome, 'fill_index': fill_index, 'fill_price': fill_price,
+            'exit_index': exit_index, 'exit_price': exit_price, 'holding': holding,
+            'return': returns}
+
+
+def simulate(signals: [dict], price_histories: dict, entry_bars: int = 5,
+             max_holding: int = 40, chunk_size: int = 20_000) -> [dict]:
+    """
+    A function that works out the trades of detected signals, see simulate_trades.
+
+    :param signals: Detection dictionaries as yielded by backtest.backtest, with the
+                    index of the candle each was detected on.
+    :param price_histories: A dictionary of symbol -> the price history the signals of
+                            that symbol were detected in, including the candles after.
+    :param entry_bars: The number of candles an order waits to be filled.
+    :param max_holding: The number of candles a trade is held for at most.
+    :param chunk_size: The number of signals simulated together.
+    :return: A list with one dictionary per signal: the signal with OUTCOME_FIELDS
+             added. Indexes are into the symbol's price history, and outcomes are
+             OUTCOMES names.
+    """
+
+    symbols = list(price_histories)
+    starts = {}
+    columns = {column: [] for column in ('open', 'high', 'low', 'close')}
+    length = 0
+    for symbol in symbols:
+        starts[symbol] = length
+        for column, values in columns.items():
+            values.append(np.asarray(price_histories[symbol][column], dtype=float))
+        length += len(price_histories[symbol])
+    columns = {column: np.concatenate(values) if values else np.empty(0)
+               for column, values in columns.items()}
+
+    signals = [signal for signal in signals if signal['symbol'] in starts]
+    offsets = np.array([starts[signal['symbol']] for signal in signals], dtype=np.int64)
+    ends = offsets + np.array([len(price_histories[signal['symbol']])
+                               for signal in signals], dtype=np.int64)
+    trades = simulate_trades(
+        offsets + np.array([signal['index'] for signal in signals], dtype=np.int64),
+        np.array([signal['buy_price'] for signal in signals], dtype=float),
+        np.array([signal['sell_price'] for signal in signals], dtype=float),
+        np.array([signal['stop_price'] for signal in signals], dtype=float),
+        np.array([1 if signal.get('breakout', 'up') == 'up' else -1
+                  for signal in signals], dtype=float),
+        columns['open'], columns['high'], columns['low'], columns['close'], ends,
+        entry_bars, max_holding, chunk_size)
+
+    filled = trades['fill_index'] >= 0
+    trades['fill_index'] = trades['fill_index'] - offsets
+    trades['exit_index'] = trades['exit_index'] - offsets
+    columns = [trades[field].tolist() for field in OUTCOME_FIELDS[1:]]
+
+    outcomes = []
+    for position, signal in enumerate(signals):
+        outcome = {**signal, 'outcome': OUTCOMES[trades['outcome'][position]]}
+        for field, values in zip(OUTCOME_FIELDS[1:], columns):
+            outcome[field] = values[position] if filled[position] else None
+        outcomes.append(outcome)
+
+    return outcomes
+
+
+def summarize(outcomes) -> [dict]:
+    """
+    A function that totals simulated trades per pattern.
+
+    :param outcomes: An iterable of simulate dictionaries.
+    :return: A list of dictionaries with SUMMARY_FIELDS keys, one per pattern, sorted by
+             name. The win rate is the fraction of filled trades with a positive return.
+             Means are None without filled trades.
+    """
+
+    totals = {}
+    for outcome in outcomes:
+        total = totals.setdefault(outcome['pattern_name'],
+                                  {'signals': 0, 'targets': 0, 'stops': 0, 'expired': 0,
+                                   'returns': [], 'holding': 0})
+        total['signals'] += 1
+        if outcome['outcome'] == 'unfilled':
+            continue
+        total['returns'].append(outcome['return'])
+        total['holding'] += outcome['holding']
+        if outcome['outcome'] == 'target':
+            total['targets'] += 1
+        elif outcome['outcome'] == 'stop':
+            total['stops'] += 1
+        else:
+            total['expired'] += 1
+
+    summary = []
+    for pattern_name, total in sorted(totals.items()):
+        returns = np.array(total['returns'], dtype=float)
+        filled = len(returns)
+        summary.append({'pattern_name': pattern_name, 'signals': total['signals'],
+                        'filled': filled, 'targets': total['targets'],
+                        'stops': total['stops'], 'expired': total['expired'],
+                        'win_rate': float(np.mean(returns > 0)) if filled else None,
+                        'mean_return': float(np.mean(returns)) if filled else None,
+                        'median_return': float(np.median(returns)) if filled else None,
+                        'mean_holding': total['holding'] / filled if filled else None})
+
+    return summary
+
+
+def summary_table(summary: [dict]) -> str:
+    """
+    A function that formats a simulation summary as an aligned text table.
+
+    :param summary: A list of summarize dictionaries.
+    :return: The table, one pattern per line, as a string.
+    """
+
+    headers = ['signals', 'filled', 'targets', 'stops', 'expired', 'win %', 'mean %',
+               'median %', 'holding']
+    width = max([len('pattern')] + [len(total['pattern_name']) for total in summary])
+    lines = [f"{'pattern':<{width}}" + ''.join(f"{header:>10}" for header in headers)]
+
+    for total in summary:
+        cells = [f"{total['pattern_name']:<{width}}"]
+        cells += [f"{total[field]:>10}"
+                  for field in ('signals', 'filled', 'targets', 'stops', 'expired')]
+        win_rate = None if total['win_rate'] is None else total['win_rate'] * 100
+        for mean in (win_rate, total['mean_return'], total['median_return'],
+                     total['mean_holding']):
+            cells.append(f"{'':>10}" if mean is None else f"{mean:>10.2f}")
+        lines.append(''.join(cells))
+
+    return '\n'.join(lines)
+
+
+def simulate_symbols(symbols: [str], patterns: [core.Pattern], source=None,
+                     processes: int = None, history: int = 1000, entry_bars: int = 5,
+                     max_holding: int = 40, fitter: str = 'pairs', **kwargs) -> [dict]:
+    """
+    A function that backtests symbols and simulates the trades of every detection.
+
+    :param symbols: A list of stock symbols.
+    :param patterns: List of Pattern objects to detect.
+    :param source: Where prices come from. Defaults to the Ameritrade API.
+    :param processes: The number of worker processes. Defaults to the number of CPUs.
+    :param history: The number of daily candles fetched per symbol.
+    :param entry_bars: The number of candles an order waits to be filled.
+    :param max_holding: The number of candles a trade is held for at most.
+    :param fitter: The trendline fitter, 'pairs' or 'hull'. See core.best_fit_line.
+    :param kwargs: Any other lookup_prices parameters, applied to every symbol.
+    :return: A list of simulate dictionaries.
+    """
+
+    if source is None:
+        from stock_analyzer.sources import AmeritradeSource
+        source = AmeritradeSource()
+
+    parameters = timeframes.fetch_parameters(['daily'], history)
+    parameters.update(kwargs)
+    parameters.setdefault('as_frame', False)
+
+    price_histories = {symbol: price_history for symbol, price_history
+                       in source.lookup_prices_many(symbols, **parameters)
+                       if price_history is not None}
+
+    signals = []
+    for _, detections in backtest.backtest_many(price_histories.items(), patterns,
+                                                processes=processes, fitter=fitter):
+        signals.extend(detections)
+
+    return simulate(signals, price_histories, entry_bars, max_holding)
+
+
+def write_results(outcomes: [dict], output_path: str = None) -> None:
+    """
+    A function that writes simulated trades and prints a summary table per pattern.
+
+    :param outcomes: A list of simulate dictionaries.
+    :param output_path: A path to write one CSV row per signal to. Only the summary is
+                        printed if None.
+    :return: None.
+    """
+
+    if output_path is not None:
+        with open(output_path, 'w', newline='') as output_file:
+            writer = csv.DictWriter(output_file, fieldnames=CSV_FIELDS,
+                                    extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(outcomes)
+
+    print(summary_table(summarize(outcomes)))
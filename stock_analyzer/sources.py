@@ -0,0 +1,200 @@
+import abc
+import os
+
+import numpy as np
+
+from stock_analyzer import config, core
+from stock_analyzer.archive import PriceArchive
+from stock_analyzer.cache import CandleCache, COLUMNS as CANDLE_COLUMNS
+from stock_analyzer.ingest import epoch_millis
+
+
+class PriceSource(abc.ABC):
+    """Interface for anything that can supply historical price data
+
+    Implementations return the same DataFrame shape as core.lookup_prices, or Candles when
+    as_frame is False, so the rest of the pipeline doesn't need to know where prices came
+    from.
+    """
+
+    @abc.abstractmethod
+    def lookup_prices(self, symbol: str, period: int = 2, period_type: str = "month",
+                      frequency: int = 1, frequency_type: str = "daily",
+                      end_date: str = "",
+                      num_entries_to_analyze: int = 40,
+                      as_frame: bool = True) -> 'pd.DataFrame':
+        """A function to retrieve historical price data for one symbol.
+
+        Takes the same parameters as core.lookup_prices.
+
+        :return: A Pandas Dataframe containing the following fields:
+                 'datetime', 'open', 'high', 'low', 'close', 'volume'. None if nothing is
+                 found.
+        """
+
+    def lookup_prices_many(self, symbols: [str], retries: int = 0, backoff: float = 1.0,
+                           on_error=None, **kwargs):
+        """A generator that retrieves historical price data for many symbols.
+
+        :param symbols: A list of stock symbols.
+        :param retries: The number of times a symbol is retried after a transient
+                        failure, see core.call_with_retries.
+        :param backoff: Seconds before the first retry of a symbol, doubled for each
+                        retry.
+        :param on_error: Called with the symbol and the exception when a symbol still
+                         fails, which is then yielded with None. Without it the exception
+                         is raised.
+        :param kwargs: Any other lookup_prices parameters, applied to every symbol.
+        :return: Yields (symbol, Pandas Dataframe or None) tuples.
+        """
+
+        for symbol in symbols:
+            try:
+                price_history = core.call_with_retries(self.lookup_prices, symbol,
+                                                       retries=retries, backoff=backoff,
+                                                       **kwargs)
+            except Exception as error:
+                # A missing API key fails every symbol, not just this one
+                if on_error is None or isinstance(error, config.ConfigError):
+                    raise
+                on_error(symbol, error)
+                price_history = None
+
+            yield symbol, price_history
+
+
+class AmeritradeSource(PriceSource):
+    """Price source backed by the TD Ameritrade REST API"""
+
+    def __init__(self, cache: CandleCache = None, base_url: str = core.AMERITRADE_URL,
+                 max_workers: int = 8,
+                 calls_per_minute: int = core.AMERITRADE_CALLS_PER_MINUTE):
+        self.cache = cache
+        self.base_url = base_url
+        self.max_workers = max_workers
+        self.calls_per_minute = calls_per_minute
+
+    def lookup_prices(self, symbol: str, **kwargs) -> 'pd.DataFrame':
+        return core.lookup_prices(symbol, base_url=self.base_url, cache=self.cache,
+                                  **kwargs)
+
+    def lookup_prices_many(self, symbols: [str], **kwargs):
+        return core.lookup_prices_many(symbols, max_workers=self.max_workers,
+                                       calls_per_minute=self.calls_per_minute,
+                                       base_url=self.base_url, cache=self.cache,
+                                       **kwargs)
+
+
+class ReplaySource(PriceSource):
+    """Price source that replays OHLCV files from a local directory
+
+    Each symbol is read from <directory>/<SYMBOL>.csv or <directory>/<SYMBOL>.parquet,
+    with 'datetime', 'open', 'high', 'low', 'close' and 'volume' columns. Datetimes may
+    be epoch milliseconds or anything pandas.to_datetime understands. Parquet files need
+    pyarrow or fastparquet installed.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._candles = {}
+
+    def _path(self, symbol: str) -> str:
+        for name in (symbol, symbol.upper()):
+            for extension in ('.parquet', '.csv'):
+                path = os.path.join(self.directory, name + extension)
+                if os.path.exists(path):
+                    return path
+
+        return None
+
+    def symbols(self) -> [str]:
+        """A function that lists the symbols with a file in the directory."""
+
+        return sorted({os.path.splitext(name)[0] for name in os.listdir(self.directory)
+                       if name.endswith(('.parquet', '.csv'))})
+
+    def load(self, symbol: str) -> np.array:
+        """A function to read every candle stored for a symbol.
+
+        Files are only read once, later calls are served from memory.
+
+        :param symbol: A stock symbol. Example: 'AAPL'
+        :return: An (n, 6) array of candles sorted by datetime, with epoch millisecond
+                 datetimes. None if there is no file for the symbol.
+        """
+
+        if symbol in self._candles:
+            return self._candles[symbol]
+
+        path = self._path(symbol)
+        if path is None:
+            candles = None
+        else:
+            import pandas as pd
+
+            if path.endswith('.parquet'):
+                candle_data = pd.read_parquet(path)
+            else:
+                candle_data = pd.read_csv(path)
+
+            candle_data = candle_data[CANDLE_COLUMNS]
+            candle_data['datetime'] = epoch_millis(candle_data['datetime'])
+
+            candles = candle_data.to_numpy(dtype=float)
+            candles = candles[np.argsort(candles[:, 0], kind='stable')]
+
+        self._candles[symbol] = candles
+
+        return candles
+
+    def lookup_prices(self, symbol: str, period: int = 2, period_type: str = "month",
+                      frequency: int = 1, frequency_type: str = "daily",
+                      end_date: str = "",
+                      num_entries_to_analyze: int = 40,
+                      as_frame: bool = True) -> 'pd.DataFrame':
+        """A function to replay the candles of a symbol up to an end date.
+
+        The period and frequency parameters are accepted for compatibility only; files are
+        replayed at whatever frequency they were recorded.
+        """
+
+        candles = self.load(symbol)
+        if candles is None:
+            return None
+
+        candles = candles[candles[:, 0] <= core.end_date_millis(end_date)]
+
+        return core.candle_frame(candles, num_entries_to_analyze, as_frame)
+
+
+class ArchiveSource(PriceSource):
+    """Price source that reads candles from a PriceArchive
+
+    With as_frame False the price columns are views of the memory-mapped archive rather
+    than copies, see archive.PriceArchive.candles.
+    """
+
+    def __init__(self, directory: str):
+        self.archive = PriceArchive(directory)
+
+    def symbols(self) -> [str]:
+        """A function that lists the symbols in the archive."""
+
+        return self.archive.symbols()
+
+    def lookup_prices(self, symbol: str, period: int = 2, period_type: str = "month",
+                      frequency: int = 1, frequency_type: str = "daily",
+                      end_date: str = "",
+                      num_entries_to_analyze: int = 40,
+                      as_frame: bool = True) -> 'pd.DataFrame':
+        """A function to read the candles of a symbol up to an end date.
+
+        The period and frequency parameters are accepted for compatibility only; candles
+        are read at whatever frequency they were archived.
+        """
+
+        candles = self.archive.candles(symbol, num_entries_to_analyze, end_date)
+        if candles is None or not as_frame:
+            return candles
+
+        return candles.to_frame()
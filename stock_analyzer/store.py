@@ -0,0 +1,224 @@
+import csv
+import os
+import sqlite3
+import sys
+import time
+
+from stock_analyzer import cache
+
+
+DEFAULT_PATH = os.path.join(os.path.dirname(cache.DEFAULT_DIRECTORY), 'results.db')
+
+# Columns of a detection record, in table order
+COLUMNS = ['symbol', 'detected_at', 'scanned_at', 'pattern_name', 'breakout',
+           'support_b', 'support_m', 'support_touches', 'support_first_day',
+           'resistance_b', 'resistance_m', 'resistance_touches', 'resistance_first_day',
+           'apex', 'buy_price', 'sell_price', 'stop_price', 'profit_margin',
+           'loss_margin']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL,
+    detected_at INTEGER NOT NULL,
+    scanned_at REAL NOT NULL,
+    pattern_name TEXT NOT NULL,
+    breakout TEXT NOT NULL,
+    support_b REAL, support_m REAL, support_touches INTEGER, support_first_day INTEGER,
+    resistance_b REAL, resistance_m REAL, resistance_touches INTEGER,
+    resistance_first_day INTEGER,
+    apex REAL,
+    buy_price REAL, sell_price REAL, stop_price REAL,
+    profit_margin REAL, loss_margin REAL,
+    UNIQUE (symbol, detected_at, pattern_name, breakout)
+);
+CREATE INDEX IF NOT EXISTS detections_by_pattern
+    ON detections (pattern_name, detected_at);
+CREATE INDEX IF NOT EXISTS detections_by_symbol
+    ON detections (symbol, detected_at);
+CREATE INDEX IF NOT EXISTS detections_by_time
+    ON detections (detected_at);
+"""
+
+
+def detection_records(result: dict, scanned_at: float = None) -> [dict]:
+    """
+    A function that flattens a scan result into one detection record per pattern.
+
+    :param result: A scan.analyze dictionary.
+    :param scanned_at: The epoch seconds of the scan. Defaults to now.
+    :return: A list of dictionaries with COLUMNS keys. Empty if nothing was detected.
+    """
+
+    if not result.get('patterns'):
+        return []
+
+    if scanned_at is None:
+        scanned_at = time.time()
+
+    record = {'symbol': result['symbol'], 'detected_at': result['as_of'],
+              'scanned_at': scanned_at, 'apex': result.get('apex')}
+    for line_type in ('support', 'resistance'):
+        for key, value in (result[line_type] or {}).items():
+            record[f"{line_type}_{key}"] = value
+
+    return [{column: {**record, **pattern}.get(column) for column in COLUMNS}
+            for pattern in result['patterns']]
+
+
+class ResultStore:
+    """Indexed SQLite store of detected patterns, written in batches
+
+    Detections are keyed by symbol, the time of the last candle analyzed, pattern and
+    breakout, so storing a rerun of the same scan replaces its records rather than
+    duplicating them.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, batch_size: int = 1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = []
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        # Readers don't block the writer, and a batch only needs one sync
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        """A function to write any pending records and close the store."""
+
+        self.flush()
+        self.connection.close()
+
+    def add(self, records: [dict]) -> None:
+        """A function to queue detection records, writing them once a batch is full.
+
+        :param records: Dictionaries with COLUMNS keys.
+        :return: None.
+        """
+
+        self.pending.extend(records)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """A function to write all queued records in one transaction."""
+
+        if not self.pending:
+            return
+
+        placeholders = ', '.join('?' * len(COLUMNS))
+        self.connection.execute("BEGIN")
+        try:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO detections ({', '.join(COLUMNS)}) "
+                f"VALUES ({placeholders})",
+                [[record.get(column) for column in COLUMNS] for record in self.pending])
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+        self.pending = []
+
+    def record(self, results):
+        """
+        A generator that stores the detections of scan results as they pass through.
+
+        :param results: An iterable of scan.analyze dictionaries.
+        :return: Yields the results unchanged, so they can still be written elsewhere.
+        """
+
+        scanned_at = time.time()
+        for result in results:
+            self.add(detection_records(result, scanned_at))
+            yield result
+
+        self.flush()
+
+    def query(self, pattern_name: str = None, symbols: [str] = None, since: int = None,
+              until: int = None, min_profit_margin: float = None,
+              max_apex: float = None, limit: int = None) -> [dict]:
+        """
+        A function to find stored detections.
+
+        :param pattern_name: Only this pattern. Example: 'Ascending Triangle'
+        :param symbols: Only these symbols.
+        :param since: Only detections at or after these epoch milliseconds.
+        :param until: Only detections before these epoch milliseconds.
+        :param min_profit_margin: Only detections with a larger profit margin, in percent.
+        :param max_apex: Only detections whose trendlines meet within this many candles
+                         after the last one.
+        :param limit: The maximum number of detections returned.
+        :return: A list of dictionaries with COLUMNS keys, most recent first.
+        """
+
+        # Include records still waiting for a full batch
+        self.flush()
+
+        conditions = []
+        parameters = []
+        if pattern_name is not None:
+            conditions.append("pattern_name = ?")
+            parameters.append(pattern_name)
+        if symbols:
+            conditions.append(f"symbol IN ({', '.join('?' * len(symbols))})")
+            parameters.extend(symbols)
+        if since is not None:
+            conditions.append("detected_at >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("detected_at < ?")
+            parameters.append(until)
+        if min_profit_margin is not None:
+            conditions.append("profit_margin > ?")
+            parameters.append(min_profit_margin)
+        if max_apex is not None:
+            conditions.append("apex >= 0 AND apex <= ?")
+            parameters.append(max_apex)
+
+        sql = f"SELECT {', '.join(COLUMNS)} FROM detections"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY detected_at DESC"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+
+        return [dict(zip(COLUMNS, row))
+                for row in self.connection.execute(sql, parameters)]
+
+
+def write_results(records: [dict], output_path: str = None) -> None:
+    """
+    A function that writes detection records, choosing the format by extension.
+
+    :param records: A list of query dictionaries.
+    :param output_path: A .csv path for CSV, any other path for JSON Lines. Writes JSON
+                        Lines to stdout if None.
+    :return: None.
+    """
+
+    from stock_analyzer import scan
+
+    if output_path is None:
+        scan.write_jsonl(records, sys.stdout)
+        return
+
+    with open(output_path, 'w', newline='') as output_file:
+        if os.path.splitext(output_path)[1].lower() == '.csv':
+            writer = csv.DictWriter(output_file, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(records)
+        else:
+            scan.write_jsonl(records, output_file)
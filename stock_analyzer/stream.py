@@ -0,0 +1,480 @@
+import abc
+import functools
+import json
+import socket
+import time
+
+import numpy as np
+
+from stock_analyzer import core
+from stock_analyzer.cache import COLUMNS as CANDLE_COLUMNS
+from stock_analyzer.instrument import instrumentation, timed
+
+
+class Feed(abc.ABC):
+    """Interface for a live source of candles
+
+    Iterating a feed yields (symbol, candle) tuples, where a candle is a sequence of
+    datetime (epoch milliseconds), open, high, low, close and volume. A candle with the
+    same datetime as the symbol's previous one updates that bar, so a feed may send a
+    bar repeatedly while it is still forming.
+    """
+
+    @abc.abstractmethod
+    def __iter__(self):
+        pass
+
+
+class ReplayFeed(Feed):
+    """Feed that replays recorded candles of many symbols in datetime order"""
+
+    def __init__(self, candles: dict, interval: float = 0):
+        """
+        :param candles: A dictionary of symbol -> (n, 6) array of candles with epoch
+                        millisecond datetimes, such as ReplaySource.load returns.
+        :param interval: Seconds to wait between candles. 0 replays as fast as possible.
+        """
+
+        self.candles = candles
+        self.interval = interval
+
+    def __iter__(self):
+        symbols = [symbol for symbol, candles in self.candles.items()
+                   if candles is not None and len(candles)]
+        if not symbols:
+            return
+
+        candles = np.concatenate([self.candles[symbol] for symbol in symbols])
+        owners = np.repeat(np.arange(len(symbols)),
+                           [len(self.candles[symbol]) for symbol in symbols])
+
+        for row in np.argsort(candles[:, 0], kind='stable'):
+            if self.interval:
+                time.sleep(self.interval)
+            yield symbols[owners[row]], candles[row]
+
+
+class SocketFeed(Feed):
+    """Feed reading newline delimited JSON messages from a TCP socket
+
+    Each message is either a bar, with 'symbol', 'datetime', 'open', 'high', 'low',
+    'close' and 'volume' fields, or a tick, with 'symbol', 'datetime', 'price' and an
+    optional 'volume'. Ticks are built into bars of bar_milliseconds, and the forming bar
+    is yielded after every tick. Datetimes are epoch milliseconds.
+    """
+
+    def __init__(self, host: str, port: int, bar_milliseconds: int = 60_000,
+                 timeout: float = None):
+        self.host = host
+        self.port = port
+        self.bar_milliseconds = bar_milliseconds
+        self.timeout = timeout
+
+    def __iter__(self):
+        bars = {}
+        with socket.create_connection((self.host, self.port),
+                                      timeout=self.timeout) as connection:
+            with connection.makefile('r', encoding='utf-8') as messages:
+                for line in messages:
+                    if not line.strip():
+                        continue
+
+                    message = json.loads(line)
+                    symbol = message['symbol']
+                    if 'price' not in message:
+                        yield symbol, [float(message[column])
+                                       for column in CANDLE_COLUMNS]
+                        continue
+
+                    yield symbol, _add_tick(bars, symbol, message, self.bar_milliseconds)
+
+
+def _add_tick(bars: dict, symbol: str, tick: dict, bar_milliseconds: int) -> list:
+    """Adds a tick to the forming bar of its symbol and returns that bar."""
+
+    price = float(tick['price'])
+    volume = float(tick.get('volume', 0))
+    start = tick['datetime'] - tick['datetime'] % bar_milliseconds
+
+    bar = bars.get(symbol)
+    if bar is None or bar[0] != start:
+        bar = [float(start), price, price, price, price, volume]
+        bars[symbol] = bar
+    else:
+        bar[2] = max(bar[2], price)
+        bar[3] = min(bar[3], price)
+        bar[4] = price
+        bar[5] += volume
+
+    return list(bar)
+
+
+class _TrendLineCandidates:
+    """Every candidate trendline of one window, kept valid as the window slides
+
+    Candidates are the pairs of extrema best_fit_line tests. Each pair remembers the
+    last bar that breaks it, so sliding the window costs one test per pair for the new
+    bar instead of testing every pair against every price again.
+    """
+
+    def __init__(self, prices: np.array, points: list, first: int, is_support: bool):
+        """
+        :param prices: The prices of the window.
+        :param points: The local minima/maxima of the window.
+        :param first: The index of the window's first candle in the whole stream.
+        :param is_support: Boolean to indicate if these are support lines or not.
+        """
+
+        self.is_support = is_support
+        self.margin = 0.05 * (prices.max() - prices.min())
+
+        points = np.asarray(points, dtype=np.intp)
+        point_prices = prices[points]
+        starts, ends = _pairs(len(points))
+
+        # Slope and y-intercept of every pair, in the window's own coordinates
+        with np.errstate(divide='ignore', invalid='ignore'):
+            m = (point_prices[ends] - point_prices[starts]) / (
+                    points[ends] - points[starts])
+        b = point_prices[ends] - m * points[ends]
+
+        # The newest price may still change, so best() tests it separately
+        final_prices = prices[:-1]
+        test_y = m[:, np.newaxis] * np.arange(len(final_prices)) + b[:, np.newaxis]
+        if is_support:
+            broken = final_prices < test_y - self.margin
+        else:
+            broken = final_prices > test_y + self.margin
+
+        test_y = m[:, np.newaxis] * points + b[:, np.newaxis]
+        self.touches = ((test_y - self.margin <= point_prices)
+                        & (point_prices <= test_y + self.margin)).sum(axis=1)
+
+        # Points and lines are kept in stream coordinates, so they survive the slide
+        self.x_start = points[starts] + first
+        self.x_end = points[ends] + first
+        self.y_start = point_prices[starts]
+        self.y_end = point_prices[ends]
+        self.m = m
+        self.b = b - m * first
+
+        last_broken = len(final_prices) - 1 - np.argmax(broken[:, ::-1], axis=1)
+        self.broken_until = np.where(broken.any(axis=1), last_broken + first, -1)
+
+    def broken_by(self, index: int, price: float) -> np.array:
+        """A function that tests which candidates a price at a stream index breaks."""
+
+        test_y = self.m * index + self.b
+        if self.is_support:
+            return price < test_y - self.margin
+        return price > test_y + self.margin
+
+    def add_price(self, index: int, price: float) -> None:
+        """A function to record a final price, which may break candidates."""
+
+        self.broken_until[self.broken_by(index, price)] = index
+
+    def best(self, first: int, last_index: int, last_price: float) -> core.TrendLine:
+        """
+        A function that picks the trendline best_fit_line would for the current window.
+
+        :param first: The stream index of the window's first candle.
+        :param last_index: The stream index of the newest candle, which may still change.
+        :param last_price: The price of the newest candle.
+        :return: Trendline object, in the window's coordinates. None if no pair is valid.
+        """
+
+        valid = (self.broken_until < first) & ~self.broken_by(last_index, last_price)
+        if not valid.any():
+            return None
+
+        touches = np.where(valid, self.touches, -1)
+        pair = len(touches) - 1 - np.argmax(touches[::-1])
+
+        m = (self.y_end[pair] - self.y_start[pair]) / (
+                self.x_end[pair] - self.x_start[pair])
+        b = self.y_end[pair] - m * (self.x_end[pair] - first)
+
+        return core.TrendLine(b, m, int(self.touches[pair]),
+                              int(self.x_start[pair] - first))
+
+
+class SymbolStream:
+    """Rolling analysis of one symbol's candles, updated one candle at a time
+
+    Gives the same extrema, trendlines and detected patterns as running the batch
+    pipeline on the last window candles, without redoing it for every candle:
+
+    - Savitzky-Golay smoothing only changes at the ends of the window, so just the first
+      and last n + 1 smoothed prices, their derivatives and the extrema tests touching
+      them are recomputed.
+    - Trendline candidates are only refitted when the extrema or the price range change.
+      Otherwise each candidate is tested against the new candle alone.
+    """
+
+    def __init__(self, symbol: str, patterns: [core.Pattern], window: int = 40,
+                 n: int = 2):
+        # converting n to a nearest even number, like get_supports_and_resistances
+        if n % 2 != 0:
+            n += 1
+
+        if window < 2 * n + 2:
+            raise ValueError(f"window must be at least {2 * n + 2} for n={n}")
+
+        self.symbol = symbol
+        self.patterns = patterns
+        self.window = window
+        self.n = n
+        self.half = n // 2
+        self.count = 0
+        self.chart = None
+        self.refits = 0
+
+        # Stream index of buffer column 0. Buffers hold up to two windows, and the newest
+        # window is copied to the front when they fill, so every window is contiguous.
+        self._offset = 0
+        self._candles = np.zeros((len(CANDLE_COLUMNS), 2 * window))
+        # Row 0 is lows (supports), row 1 is highs (resistances)
+        self._smoothed = np.zeros((2, 2 * window))
+        self._derivative = np.zeros((2, 2 * window))
+        self._extremum = np.zeros((2, 2 * window), dtype=bool)
+        self._points = [None, None]
+        self._candidates = [None, None]
+
+    @property
+    def candles(self) -> core.Candles:
+        """The candles of the current window, as Matplotlib dated Candles."""
+
+        start = max(self.count - self.window, 0) - self._offset
+        window = self._candles[:, start:self.count - self._offset]
+        return core.Candles(core.epoch2num(window[0] / 1000), *window[1:].copy())
+
+    @timed('stream_update')
+    def update(self, candle) -> [core.TradeCriteria]:
+        """
+        A function to add a candle, or replace the newest one, and re-evaluate patterns.
+
+        :param candle: A sequence of datetime (epoch milliseconds), open, high, low, close
+                       and volume. A candle older than the newest one is ignored.
+        :return: TradeCriteria of the patterns detected now that weren't detected with
+                 the previous candle.
+        """
+
+        end = self.count - self._offset
+        replaces = self.count > 0 and candle[0] == self._candles[0, end - 1]
+
+        if not replaces:
+            if self.count and candle[0] < self._candles[0, end - 1]:
+                return []
+
+            # The previous candle can no longer change, so candidates can keep its breaks
+            for side, candidates in enumerate(self._candidates):
+                if candidates is not None:
+                    candidates.add_price(self.count - 1,
+                                         self._candles[_PRICE_ROWS[side], end - 1])
+
+            if end == self._candles.shape[1]:
+                self._compact()
+                end = self.count - self._offset
+
+            self.count += 1
+            end += 1
+
+        self._candles[:, end - 1] = candle
+        instrumentation.add('stream_candles')
+
+        if self.count < self.window:
+            return []
+
+        if self.count == self.window:
+            self._smooth_all()
+        else:
+            self._smooth_edges()
+
+        previous = set() if self.chart is None else \
+            {(trade.pattern_name, trade.breakout)
+             for trade in self.chart.detected_patterns}
+        self.chart = self._chart()
+
+        return [trade for trade in self.chart.detected_patterns
+                if (trade.pattern_name, trade.breakout) not in previous]
+
+    def _compact(self) -> None:
+        """Moves the newest window to the front of the buffers."""
+
+        shift = self.count - self._offset - self.window
+        for buffer in (self._candles, self._smoothed, self._derivative, self._extremum):
+            buffer[:, :self.window] = buffer[:, shift:shift + self.window]
+        self._offset += shift
+
+    def _smooth_all(self) -> None:
+        """Smooths the whole window and tests every extremum, like the batch pipeline."""
+
+        from scipy.signal import savgol_filter as smooth
+
+        first = self.count - self.window - self._offset
+        end = self.count - self._offset
+
+        self._smoothed[:, first:end] = smooth(self._candles[_PRICE_ROWS, first:end],
+                                              self.n + 1, 2, axis=1)
+        self._derivative[:, first] = 0
+        self._derivative[:, first + 1:end] = np.diff(self._smoothed[:, first:end], axis=1)
+        self._test_extrema(first, end - self.n)
+
+    def _smooth_edges(self) -> None:
+        """Re-smooths only the ends of the window, the only smoothed prices that change
+        when it slides or its newest candle is replaced."""
+
+        first = self.count - self.window - self._offset
+        end = self.count - self._offset
+        length = self.n + 1
+        half = self.half
+        head_filter, tail_filter = _edge_filters(self.n)
+
+        # The last `length` prices are fitted to the last `length` candles, or smoothed
+        # over neighbours that are all within the last length + half candles
+        self._smoothed[:, end - length:end] = \
+            self._candles[_PRICE_ROWS, end - length - half:end] @ tail_filter
+        # The first half of the window is fitted to its first `length` candles
+        self._smoothed[:, first:first + half] = \
+            self._candles[_PRICE_ROWS, first:first + length] @ head_filter
+
+        self._derivative[:, first] = 0
+        self._derivative[:, first + 1:first + half + 1] = \
+            np.diff(self._smoothed[:, first:first + half + 1], axis=1)
+        self._derivative[:, end - length:end] = np.diff(
+            self._smoothed[:, end - length - 1:end], axis=1)
+
+        self._test_extrema(first, first + half + 1)
+        self._test_extrema(max(first, end - length - self.n + 1), end - self.n)
+
+    def _test_extrema(self, start: int, stop: int) -> None:
+        """Runs the window sign tests of get_supports_and_resistances for the windows
+        starting in buffer columns start to stop."""
+
+        if stop <= start:
+            return
+
+        span = stop - start
+        derivative = self._derivative[:, start:stop + self.n - 1]
+        falling = derivative < 0
+        rising = derivative > 0
+
+        # local minima: falling for the first half of the window, rising for the second
+        support = falling[0, :span].copy()
+        # local maxima: rising for the first half of the window, falling for the second
+        resistance = rising[1, :span].copy()
+        for k in range(1, self.n):
+            if k < self.half:
+                support &= falling[0, k:k + span]
+                resistance &= rising[1, k:k + span]
+            else:
+                support &= rising[0, k:k + span]
+                resistance &= falling[1, k:k + span]
+
+        self._extremum[0, start:stop] = support
+        self._extremum[1, start:stop] = resistance
+
+    def _chart(self) -> core.Chart:
+        """Finds the trendlines of the current window and detects patterns on them."""
+
+        first = self.count - self.window
+        start = first - self._offset
+        end = self.count - self._offset
+
+        trendlines = []
+        extrema = []
+        for side in (0, 1):
+            points = np.flatnonzero(self._extremum[side, start:end - self.n]) \
+                + self.half - 1
+            prices = self._candles[_PRICE_ROWS[side], start:end]
+
+            candidates = self._candidates[side]
+            if candidates is None \
+                    or 0.05 * (prices.max() - prices.min()) != candidates.margin \
+                    or not np.array_equal(points + first, self._points[side]):
+                candidates = _TrendLineCandidates(prices, points, first, side == 0)
+                self._candidates[side] = candidates
+                self._points[side] = points + first
+                self.refits += 1
+                instrumentation.add('trendline_refits')
+
+            trendlines.append(candidates.best(first, self.count - 1, prices[-1]))
+            extrema.append(points.tolist())
+
+        return core.Chart(self.symbol, self.candles, trendlines[0], trendlines[1],
+                          extrema[0], extrema[1], self.patterns, verbose=False)
+
+
+@functools.lru_cache(maxsize=None)
+def _pairs(n_points: int) -> (np.array, np.array):
+    """Every (start, end) pair of n_points, in the order best_fit_lines tests them."""
+
+    return np.triu_indices(n_points, 1)
+
+
+@functools.lru_cache(maxsize=None)
+def _edge_filters(n: int) -> (np.array, np.array):
+    """
+    A function that turns the Savitzky-Golay smoothing of the window ends into matrices.
+
+    Smoothing is linear in the prices, so filtering an identity matrix gives the weights
+    of every input price in every output. Multiplying by these small matrices is much
+    cheaper than calling savgol_filter for a handful of prices.
+
+    :param n: The even number of entries scanned for local minima/maxima.
+    :return: A (n + 1, n / 2) matrix from the first n + 1 prices of a window to the
+             smoothed first half, and a (3n / 2 + 1, n + 1) matrix from the last
+             3n / 2 + 1 prices to the last n + 1 smoothed prices.
+    """
+
+    from scipy.signal import savgol_filter as smooth
+
+    length = n + 1
+    half = n // 2
+    head = smooth(np.eye(length), length, 2, axis=0)[:half]
+    tail = smooth(np.eye(length + half), length, 2, axis=0)[half:]
+
+    return head.T, tail.T
+
+
+# Candle rows holding the prices supports and resistances are fitted to
+_PRICE_ROWS = [CANDLE_COLUMNS.index('low'), CANDLE_COLUMNS.index('high')]
+
+
+def watch(feed: Feed, patterns: [core.Pattern], window: int = 40, n: int = 2,
+          symbols: [str] = None):
+    """
+    A generator that analyzes every symbol of a feed as candles arrive.
+
+    :param feed: The Feed to read candles from.
+    :param patterns: List of Pattern objects to detect.
+    :param window: The number of candles analyzed for each symbol.
+    :param n: The number of entries scanned for local minima/maxima.
+    :param symbols: Only watch these symbols. Watches every symbol of the feed if None.
+    :return: Yields one alert dictionary each time a pattern starts being detected on a
+             symbol, with the symbol, the candle's datetime in epoch milliseconds and the
+             suggested trade.
+    """
+
+    watched = None if symbols is None else set(symbols)
+    streams = {}
+
+    for symbol, candle in feed:
+        if watched is not None and symbol not in watched:
+            continue
+
+        stream = streams.get(symbol)
+        if stream is None:
+            stream = streams[symbol] = SymbolStream(symbol, patterns, window, n)
+
+        for trade in stream.update(candle):
+            yield {'symbol': symbol,
+                   'datetime': int(candle[0]),
+                   'pattern_name': trade.pattern_name,
+                   'breakout': trade.breakout,
+                   'buy_price': float(trade.buy_price),
+                   'sell_price': float(trade.sell_price),
+                   'stop_price': float(trade.stop_price),
+                   'profit_margin': float(trade.profit_margin),
+                   'loss_margin': float(trade.loss_margin)}
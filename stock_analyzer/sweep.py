@@ -0,0 +1,307 @@
+import csv
+import itertools
+
+import numpy as np
+
+from stock_analyzer import core, scan, timeframes
+from stock_analyzer.instrument import instrumentation
+
+
+SWEEP_PARAMETERS = ('num_entries_to_analyze', 'n', 'margin', 'height_ratio',
+                    'buy_threshold')
+DEFAULT_VALUES = {'num_entries_to_analyze': (40,), 'n': (2,), 'margin': (0.05,),
+                  'height_ratio': (0.70,), 'buy_threshold': (0.01,)}
+CSV_FIELDS = ['symbol', *SWEEP_PARAMETERS, 'status', 'support_touches',
+              'resistance_touches', 'patterns', 'pattern_name', 'breakout', 'buy_price',
+              'sell_price', 'stop_price', 'profit_margin', 'loss_margin']
+SUMMARY_FIELDS = [*SWEEP_PARAMETERS, 'symbols', 'detections', 'mean_profit_margin',
+                  'mean_loss_margin']
+
+
+def parse_values(text: str, value_type=float) -> tuple:
+    """
+    A function that parses the values of one swept parameter.
+
+    :param text: Comma separated values such as '2,4,6', or an inclusive range with a
+                 step such as '0.03:0.07:0.01'.
+    :param value_type: int or float.
+    :return: A tuple of values.
+    """
+
+    if ':' in text:
+        start, stop, step = (value_type(part) for part in text.split(':'))
+        if step <= 0:
+            raise ValueError(f"Range step must be positive: {text}")
+
+        count = int(np.floor((stop - start) / step + 1e-9)) + 1
+        return tuple(value_type(round(start + index * step, 10))
+                     for index in range(max(count, 0)))
+
+    return tuple(value_type(value) for value in text.split(',') if value.strip())
+
+
+def parameter_grid(**values) -> [dict]:
+    """
+    A function that lists every combination of the swept parameters.
+
+    :param values: A sequence of values per parameter in SWEEP_PARAMETERS. Parameters
+                   that are not given keep their default value.
+    :return: A list of dictionaries, one per combination, with the last parameter of
+             SWEEP_PARAMETERS varying fastest.
+    """
+
+    unknown = set(values) - set(SWEEP_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters {sorted(unknown)}, expected some "
+                         f"of {SWEEP_PARAMETERS}")
+
+    values = {**DEFAULT_VALUES, **values}
+    return [dict(zip(SWEEP_PARAMETERS, combination))
+            for combination in itertools.product(*(values[parameter]
+                                                   for parameter in SWEEP_PARAMETERS))]
+
+
+def sweep_symbol(symbol: str, price_history, patterns: [core.Pattern], n=(2,),
+                 chart_directory: str = None, chart_format: str = 'png',
+                 detected_only: bool = True, fitter: str = 'pairs',
+                 num_entries_to_analyze=(40,), margin=(0.05,), height_ratio=(0.70,),
+                 buy_threshold=(0.01,)) -> dict:
+    """
+    A function that runs the analysis pipeline for every combination of parameters.
+
+    Each stage only depends on some of the parameters, so its results are kept for the
+    combinations that share them: extrema per (num_entries_to_analyze, n), trendlines and
+    detected patterns per margin on top of those, and only the trade prices are worked
+    out for every height_ratio and buy_threshold.
+
+    :param symbol: A stock symbol. Example: 'AAPL'
+    :param price_history: Candles or a Pandas Dataframe with at least the largest
+                          num_entries_to_analyze candles, or None.
+    :param patterns: List of Pattern objects to detect.
+    :param n: The numbers of entries scanned for local minima/maxima.
+    :param chart_directory: Ignored, a sweep does not render charts. Accepted so that
+                            sweep_symbol can be run by scan.scan_histories.
+    :param chart_format: Ignored.
+    :param detected_only: Ignored.
+    :param fitter: The trendline fitter, 'pairs' or 'hull'. See core.best_fit_line.
+    :param num_entries_to_analyze: The numbers of most recent candles analyzed.
+    :param margin: The trendline margins, see core.best_fit_line.
+    :param height_ratio: The target height ratios, see core.get_trade_criteria.
+    :param buy_threshold: The buy thresholds, see core.get_trade_criteria.
+    :return: A dictionary with the symbol, its status and a 'combinations' list with one
+             row per combination, with CSV_FIELDS keys. 'patterns' lists every detected
+             pattern, and the trade columns are for the pattern_name and breakout the
+             chart trades first.
+    """
+
+    if price_history is None:
+        return {'symbol': symbol, 'status': 'no data', 'combinations': []}
+
+    matcher = core.compile_patterns(patterns)
+    highs = np.asarray(price_history['high'], dtype=float)
+    lows = np.asarray(price_history['low'], dtype=float)
+    closes = np.asarray(price_history['close'], dtype=float)
+
+    extrema = {}
+    lines = {}
+    rows = []
+    for parameters in parameter_grid(num_entries_to_analyze=num_entries_to_analyze, n=n,
+                                     margin=margin, height_ratio=height_ratio,
+                                     buy_threshold=buy_threshold):
+        entries = parameters['num_entries_to_analyze']
+        row = {'symbol': symbol, **parameters, 'status': 'ok', 'patterns': ''}
+        rows.append(row)
+
+        if len(highs) < entries:
+            row['status'] = 'not enough data'
+            continue
+
+        extrema_key = (entries, parameters['n'])
+        if extrema_key not in extrema:
+            extrema[extrema_key] = core.get_supports_and_resistances_many(
+                highs[np.newaxis, -entries:], lows[np.newaxis, -entries:],
+                parameters['n'])[0]
+        support_points, resistance_points = extrema[extrema_key]
+
+        lines_key = (*extrema_key, parameters['margin'])
+        if lines_key not in lines:
+            support = core.best_fit_line(lows[-entries:], support_points,
+                                         fitter=fitter, margin=parameters['margin'])
+            resistance = core.best_fit_line(highs[-entries:], resistance_points, False,
+                                            fitter, parameters['margin'])
+            found = []
+            if support and resistance:
+                found = [pattern for pattern, pattern_found
+                         in zip(matcher.patterns,
+                                matcher.match_lines([support], [resistance], entries,
+                                                    [support_points],
+                                                    [resistance_points],
+                                                    [closes[-entries:]])[0])
+                         if pattern_found]
+            lines[lines_key] = support, resistance, found
+        support, resistance, found = lines[lines_key]
+
+        row['support_touches'] = support.touches if support else None
+        row['resistance_touches'] = resistance.touches if resistance else None
+
+        if found:
+            # Report the first of the chart's trades: the first pattern found, breaking
+            # out in its first direction
+            trade = core.get_trade_criteria(found[0].pattern_name, support, resistance,
+                                            parameters['height_ratio'],
+                                            parameters['buy_threshold'],
+                                            found[0].breakouts[0])
+            row.update({'patterns': ';'.join(pattern.pattern_name for pattern in found),
+                        'pattern_name': trade.pattern_name, 'breakout': trade.breakout,
+                        'buy_price': float(trade.buy_price),
+                        'sell_price': float(trade.sell_price),
+                        'stop_price': float(trade.stop_price),
+                        'profit_margin': float(trade.profit_margin),
+                        'loss_margin': float(trade.loss_margin)})
+
+    if instrumentation.enabled:
+        instrumentation.add('sweep_combinations', len(rows))
+
+    return {'symbol': symbol, 'status': 'ok', 'combinations': rows}
+
+
+def sweep(symbols: [str], patterns: [core.Pattern], processes: int = None,
+          source=None, fitter: str = 'pairs', num_entries_to_analyze=(40,), n=(2,),
+          margin=(0.05,), height_ratio=(0.70,), buy_threshold=(0.01,), **kwargs):
+    """
+    A generator that sweeps the analysis parameters over many symbols.
+
+    Each symbol is fetched once, with enough daily candles for the largest
+    num_entries_to_analyze, and all of its combinations are analyzed by the same worker
+    process.
+
+    :param symbols: A list of stock symbols.
+    :param patterns: List of Pattern objects to detect.
+    :param processes: The number of worker processes. Defaults to the number of CPUs.
+    :param source: Where prices come from. Defaults to the Ameritrade API.
+    :param fitter: The trendline fitter, 'pairs' or 'hull'. See core.best_fit_line.
+    :param num_entries_to_analyze: The numbers of most recent candles analyzed.
+    :param n: The numbers of entries scanned for local minima/maxima.
+    :param margin: The trendline margins, see core.best_fit_line.
+    :param height_ratio: The target height ratios, see core.get_trade_criteria.
+    :param buy_threshold: The buy thresholds, see core.get_trade_criteria.
+    :param kwargs: Any other lookup_prices parameters, applied to every symbol.
+    :return: Yields one sweep_symbol dictionary per symbol.
+    """
+
+    if source is None:
+        from stock_analyzer.sources import AmeritradeSource
+        source = AmeritradeSource()
+
+    parameters = timeframes.fetch_parameters(['daily'], max(num_entries_to_analyze))
+    parameters.update(kwargs)
+    parameters.setdefault('as_frame', False)
+
+    return scan.scan_histories(source.lookup_prices_many(symbols, **parameters),
+                               patterns, processes=processes, n=tuple(n),
+                               analyzer=sweep_symbol, fitter=fitter,
+                               num_entries_to_analyze=tuple(num_entries_to_analyze),
+                               margin=tuple(margin), height_ratio=tuple(height_ratio),
+                               buy_threshold=tuple(buy_threshold))
+
+
+def summarize(rows) -> [dict]:
+    """
+    A function that totals sweep rows per combination of parameters.
+
+    :param rows: An iterable of sweep_symbol combination rows.
+    :return: A list of dictionaries with SUMMARY_FIELDS keys, one per combination,
+             sorted by parameters. Mean margins are None without detections.
+    """
+
+    totals = {}
+    for row in rows:
+        key = tuple(row[parameter] for parameter in SWEEP_PARAMETERS)
+        total = totals.setdefault(key, {'symbols': 0, 'detections': 0, 'profit': 0.0,
+                                        'loss': 0.0})
+        total['symbols'] += row['status'] == 'ok'
+        if row['patterns']:
+            total['detections'] += 1
+            total['profit'] += row['profit_margin']
+            total['loss'] += row['loss_margin']
+
+    summary = []
+    for key, total in sorted(totals.items()):
+        detections = total['detections']
+        summary.append({**dict(zip(SWEEP_PARAMETERS, key)), 'symbols': total['symbols'],
+                        'detections': detections,
+                        'mean_profit_margin': total['profit'] / detections
+                        if detections else None,
+                        'mean_loss_margin': total['loss'] / detections
+                        if detections else None})
+
+    return summary
+
+
+def summary_table(summary: [dict]) -> str:
+    """
+    A function that formats a sweep summary as an aligned text table.
+
+    :param summary: A list of summarize dictionaries.
+    :return: The table, one combination per line, as a string.
+    """
+
+    headers = ['entries', 'n', 'margin', 'height', 'buy', 'symbols', 'detections',
+               'profit %', 'loss %']
+    lines = [''.join(f"{header:>12}" for header in headers)]
+
+    for total in summary:
+        cells = [f"{total['num_entries_to_analyze']:>12}", f"{total['n']:>12}",
+                 f"{total['margin']:>12.4g}", f"{total['height_ratio']:>12.4g}",
+                 f"{total['buy_threshold']:>12.4g}", f"{total['symbols']:>12}",
+                 f"{total['detections']:>12}"]
+        for mean in (total['mean_profit_margin'], total['mean_loss_margin']):
+            cells.append(f"{'':>12}" if mean is None else f"{mean:>12.2f}")
+        lines.append(''.join(cells))
+
+    return '\n'.join(lines)
+
+
+def write_csv(results, output_file) -> [dict]:
+    """
+    A function that writes sweep results as CSV, one row per symbol and combination.
+
+    :param results: An iterable of sweep_symbol dictionaries.
+    :param output_file: A writable text file.
+    :return: The rows written, for summarize.
+    """
+
+    writer = csv.DictWriter(output_file, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+
+    written = []
+    for result in results:
+        if not result.get('combinations'):
+            writer.writerow({'symbol': result['symbol'], 'status': result['status']})
+
+        for row in result.get('combinations', []):
+            writer.writerow(row)
+            written.append(row)
+
+        output_file.flush()
+
+    return written
+
+
+def write_results(results, output_path: str = None) -> None:
+    """
+    A function that writes sweep results and prints a summary table per combination.
+
+    :param results: An iterable of sweep_symbol dictionaries.
+    :param output_path: A path to write one CSV row per symbol and combination to. Only
+                        the summary table is printed if None.
+    :return: None.
+    """
+
+    if output_path is None:
+        rows = [row for result in results for row in result.get('combinations', [])]
+    else:
+        with open(output_path, 'w', newline='') as output_file:
+            rows = write_csv(results, output_file)
+
+    print(summary_table(summarize(rows)))
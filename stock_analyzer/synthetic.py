@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+
+PATTERNS = ['noise', 'triangle', 'channel']
+
+# 01-04-2021, as a Matplotlib date
+FIRST_DATETIME = 18631.0
+
+
+def synthetic_prices(length: int = 40, pattern: str = 'noise', seed: int = 0,
+                     start_price: float = 100.0, noise: float = 0.002,
+                     period: int = 8) -> pd.DataFrame:
+    """
+    A function that generates deterministic OHLCV candles for tests and benchmarks.
+
+    :param length: The number of candles.
+    :param pattern: What to plant in the prices. 'noise' is a random walk, 'triangle' is
+                    an ascending triangle (flat resistance, rising support) and 'channel'
+                    oscillates between two parallel rising lines.
+    :param seed: Seed for the random number generator. The same seed always gives the
+                 same candles.
+    :param start_price: The price the series starts around.
+    :param noise: Standard deviation of the random moves, as a fraction of the price.
+    :param period: The number of candles in one swing between the lines of a triangle or
+                   channel.
+    :return: A Pandas Dataframe shaped like core.lookup_prices output, with the
+             following fields: 'datetime', 'open', 'high', 'low', 'close', 'volume'
+    """
+
+    rng = np.random.default_rng(seed)
+    day = np.arange(length)
+
+    if pattern == 'noise':
+        closes = start_price * np.exp(np.cumsum(rng.normal(0, noise * 5, length)))
+        opens = np.concatenate([[start_price], closes[:-1]])
+        spread = start_price * np.abs(rng.normal(0, noise * 2, (2, length)))
+        highs = np.maximum(opens, closes) + spread[0]
+        lows = np.minimum(opens, closes) - spread[1]
+    elif pattern in ('triangle', 'channel'):
+        height = 0.1 * start_price
+        if pattern == 'triangle':
+            # Support climbs to within 5% of the height of the flat resistance
+            resistance = np.full(length, start_price + height / 2)
+            support = resistance - height + 0.95 * height * day / max(length, 1)
+        else:
+            support = start_price - height / 2 + 0.001 * start_price * day
+            resistance = support + height
+
+        wave = 0.5 + 0.5 * np.cos(2 * np.pi * day / period)
+        jitter = start_price * rng.normal(0, noise, length)
+        highs = support + (resistance - support) * wave + abs(jitter) * 0.1
+        lows = support + (resistance - support) * wave * 0.9 - abs(jitter) * 0.1
+        lows = np.minimum(lows, highs - 0.005 * start_price)
+        opens = lows + 0.25 * (highs - lows)
+        closes = lows + 0.75 * (highs - lows)
+    else:
+        raise ValueError(f"Unknown pattern {pattern}, expected one of {PATTERNS}")
+
+    return pd.DataFrame({'datetime': FIRST_DATETIME + day.astype(float),
+                         'open': opens, 'high': highs, 'low': lows, 'close': closes,
+                         'volume': rng.integers(10_000, 1_000_000, length).astype(float)})
+
+
+def synthetic_universe(n_symbols: int, length: int = 40, seed: int = 0,
+                       patterns: [str] = None) -> dict:
+    """
+    A function that generates a universe of synthetic symbols.
+
+    :param n_symbols: The number of symbols.
+    :param length: The number of candles per symbol.
+    :param seed: Seed for the whole universe.
+    :param patterns: The patterns to cycle through. Defaults to all of PATTERNS.
+    :return: A dictionary of symbol -> Pandas Dataframe. Symbols are named SYN0, SYN1...
+    """
+
+    patterns = patterns or PATTERNS
+
+    return {f"SYN{index}": synthetic_prices(length, patterns[index % len(patterns)],
+                                            seed=seed * 1_000_003 + index,
+                                            start_price=20 + (index * 37) % 480)
+            for index in range(n_symbols)}
+
@@ -0,0 +1,90 @@
+"""
+Shared fixtures for the unit tests
+"""
+
+import datetime
+
+import pytest
+
+# Local midnight, in a span without daylight saving changes
+STUB_FIRST_CANDLE = int(datetime.datetime(2021, 5, 1).timestamp() * 1000)
+STUB_DAY = 86400000
+
+
+def end_date(day):
+    """The --endDate string for the stub's candle on day."""
+    timestamp = (STUB_FIRST_CANDLE + day * STUB_DAY) / 1000
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%m-%d-%Y')
+
+
+@pytest.fixture
+def price_history_stub(monkeypatch):
+    """Local HTTP server serving the /pricehistory JSON shape for any symbol.
+
+    Serves 100 daily candles from STUB_FIRST_CANDLE, filtered by startDate/endDate, or
+    the 60 days up to endDate when no startDate is given. A dummy API key is configured
+    for the duration of the test.
+    """
+    import configparser
+    import http.server
+    import json
+    import threading
+    import urllib.parse
+
+    from stock_analyzer import config
+
+    dummy_config = configparser.ConfigParser()
+    dummy_config['AMERITRADE'] = {'API_KEY': 'dummy'}
+    monkeypatch.setattr(config, '_config', dummy_config)
+
+    requested = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            symbol = url.path.split('/')[2]
+            query = dict(urllib.parse.parse_qsl(url.query))
+            requested.append((symbol, query))
+
+            end_date = int(query['endDate'])
+            start_date = int(query.get('startDate', end_date - 60 * STUB_DAY))
+            # Like the real API, unknown symbols get no candles
+            candles = [] if symbol == 'EMPTY' or not symbol.isupper() else [
+                {'datetime': STUB_FIRST_CANDLE + day * STUB_DAY, 'open': 10.0 + day,
+                 'high': 11.0 + day, 'low': 9.0 + day, 'close': 10.5 + day,
+                 'volume': 1000}
+                for day in range(100)
+                if start_date <= STUB_FIRST_CANDLE + day * STUB_DAY <= end_date]
+            body = json.dumps({'candles': candles, 'symbol': symbol}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", requested
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def ascending_triangle():
+    """40 candles oscillating between a flat resistance and a rising support."""
+    import numpy as np
+    import pandas as pd
+
+    day = np.arange(40)
+    support = 90 + 0.22 * day
+    wave = 0.5 + 0.5 * np.cos(2 * np.pi * day / 8)
+    highs = support + (100 - support) * wave + 0.5
+    lows = np.minimum(support + (100 - support) * wave * 0.9, highs - 0.5)
+
+    return pd.DataFrame({'datetime': day.astype(float), 'open': lows + 0.2,
+                         'high': highs, 'low': lows, 'close': highs - 0.2,
+                         'volume': 1000.0})
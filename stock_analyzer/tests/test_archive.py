@@ -0,0 +1,104 @@
+"""
+Unit tests for archive
+"""
+
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from stock_analyzer import backtest, core, synthetic
+from stock_analyzer.archive import PriceArchive
+from stock_analyzer.sources import ArchiveSource, ReplaySource
+
+
+def _raw_candles(length, pattern, seed):
+    prices = synthetic.synthetic_prices(length, pattern, seed=seed)
+    prices['datetime'] = (prices['datetime'] * 86400000).round()
+
+    return prices.to_numpy(dtype=float)
+
+
+def test_reads_are_views_of_the_archive(tmp_path):
+    triangle = _raw_candles(300, 'triangle', 0)
+    noise = _raw_candles(200, 'noise', 1)
+    archive = PriceArchive(str(tmp_path))
+
+    assert archive.append_many([('TRI', triangle), ('NOISE', noise)]) == 500
+
+    columns = PriceArchive(str(tmp_path)).columns('NOISE')
+    assert isinstance(columns['high'].base, np.memmap)
+    assert not columns['high'].flags.writeable
+    np.testing.assert_array_equal(np.column_stack(list(columns.values())), noise)
+
+    candles = archive.candles('TRI', 40, end_date='')
+    assert np.shares_memory(candles.high, archive.columns('TRI')['high'])
+    np.testing.assert_array_equal(candles.low, triangle[-40:, 3])
+    assert archive.candles('MISSING') is None
+    assert archive.symbols() == ['NOISE', 'TRI']
+
+
+def test_appends_skip_known_candles_and_compact(tmp_path):
+    triangle = _raw_candles(300, 'triangle', 0)
+    noise = _raw_candles(200, 'noise', 1)
+    archive = PriceArchive(str(tmp_path))
+    archive.append_many([('TRI', triangle[:100]), ('NOISE', noise[:150])])
+
+    # A crashed writer's partial rows are never read, and overwritten by the next append
+    with open(tmp_path / 'high.0.f8', 'ab') as column_file:
+        column_file.write(b'\xff' * 12)
+
+    assert archive.append('NOISE', noise[100:]) == 50
+    assert archive.append('TRI', triangle[50:]) == 200
+    assert archive.append('TRI', triangle[-10:]) == 0
+    assert archive.extents['NOISE'] == [(100, 200)]
+    assert len(archive.extents['TRI']) == 2
+
+    reader = PriceArchive(str(tmp_path))
+    np.testing.assert_array_equal(np.column_stack(list(reader.columns('TRI').values())),
+                                  triangle)
+    np.testing.assert_array_equal(reader.columns('NOISE')['high'], noise[:, 2])
+
+    archive.compact()
+
+    assert archive.extents == {'NOISE': [(0, 200)], 'TRI': [(200, 300)]}
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [f"{column}.1.f8" for column in core.Candles.columns] + ['index.json'])
+    np.testing.assert_array_equal(archive.columns('TRI')['close'], triangle[:, 4])
+    # Readers that mapped the old files keep working until they refresh
+    np.testing.assert_array_equal(reader.columns('NOISE')['high'], noise[:, 2])
+
+
+def test_archive_source_matches_replay(tmp_path):
+    archive_directory = tmp_path / 'archive'
+    replay_directory = tmp_path / 'replay'
+    replay_directory.mkdir()
+    for index, pattern in enumerate(['triangle', 'noise']):
+        candles = _raw_candles(120, pattern, index)
+        pd.DataFrame(candles, columns=core.Candles.columns) \
+            .to_csv(replay_directory / f"SYN{index}.csv", index=False)
+
+    replay = ReplaySource(str(replay_directory))
+    assert PriceArchive(str(archive_directory)).update(replay, replay.symbols()) == 240
+    source = ArchiveSource(str(archive_directory))
+
+    assert source.symbols() == ['SYN0', 'SYN1']
+    pd.testing.assert_frame_equal(source.lookup_prices('SYN0', end_date='03-01-2021'),
+                                  replay.lookup_prices('SYN0', end_date='03-01-2021'))
+
+
+def test_backtest_archive_shares_the_files(tmp_path):
+    archive = PriceArchive(str(tmp_path))
+    archive.append_many([(f"SYN{index}", _raw_candles(120, pattern, index))
+                         for index, pattern in enumerate(['triangle', 'noise'])])
+    patterns = core.load_patterns()
+
+    assert len(pickle.dumps(archive)) < 200
+    results = dict(backtest.backtest_archive(str(tmp_path), ['SYN0', 'SYN1', 'MISSING'],
+                                             patterns, processes=2))
+
+    assert results['MISSING'] == []
+    for symbol in ('SYN0', 'SYN1'):
+        assert results[symbol] == list(backtest.backtest(symbol, archive.candles(symbol),
+                                                         patterns))
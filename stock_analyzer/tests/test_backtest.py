@@ -0,0 +1,56 @@
+"""
+Unit tests for backtest
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from stock_analyzer import backtest, core, scan, synthetic
+
+
+def test_backtest_matches_per_window_analysis(ascending_triangle):
+    rng = np.random.default_rng(7)
+    lows = 95 + np.cumsum(rng.normal(0, 0.5, 60))
+    noise = pd.DataFrame({'datetime': np.arange(-60, 0, dtype=float),
+                          'open': lows + 0.2, 'high': lows + 1, 'low': lows,
+                          'close': lows + 0.8, 'volume': 1000.0})
+    history = pd.concat([noise, ascending_triangle], ignore_index=True)
+    patterns = core.load_patterns()
+
+    detections = list(backtest.backtest('TRI', history, patterns, chunk_size=16))
+
+    expected = []
+    for start in range(len(history) - 40 + 1):
+        window = history.iloc[start:start + 40].reset_index(drop=True)
+        for pattern in scan.analyze('TRI', window, patterns)['patterns']:
+            expected.append((start + 39, pattern['pattern_name'], pattern['buy_price']))
+
+    assert expected
+    assert [(detection['index'], detection['pattern_name'], detection['buy_price'])
+            for detection in detections] == expected
+    assert detections[-1]['datetime'] == history['datetime'].iloc[-1]
+
+
+def test_incremental_backtest_matches_batched():
+    history = synthetic.synthetic_prices(400, 'noise', seed=1)
+    patterns = core.load_patterns()
+
+    batched = list(backtest.backtest('SYN', history, patterns, n=3, chunk_size=64))
+    incremental = list(backtest.backtest('SYN', history, patterns, n=3,
+                                         incremental=True))
+
+    assert batched
+    assert [(detection['index'], detection['pattern_name'], detection['breakout'])
+            for detection in incremental] == \
+           [(detection['index'], detection['pattern_name'], detection['breakout'])
+            for detection in batched]
+    for batched_detection, incremental_detection in zip(batched, incremental):
+        assert incremental_detection == pytest.approx(batched_detection)
+
+    with pytest.raises(ValueError):
+        list(backtest.backtest('SYN', history, patterns, fitter='hull', incremental=True))
+
+
+def test_backtest_short_history(ascending_triangle):
+    assert list(backtest.backtest('TRI', ascending_triangle.iloc[:10], [])) == []
@@ -0,0 +1,50 @@
+"""
+Unit tests for benchmark and synthetic
+"""
+
+import pandas as pd
+import pytest
+
+from stock_analyzer import benchmark, core, scan, synthetic
+
+
+def test_synthetic_prices_are_deterministic():
+    pd.testing.assert_frame_equal(synthetic.synthetic_prices(100, 'noise', seed=4),
+                                  synthetic.synthetic_prices(100, 'noise', seed=4))
+
+
+@pytest.mark.parametrize('pattern', synthetic.PATTERNS)
+def test_synthetic_prices_are_valid_candles(pattern):
+    prices = synthetic.synthetic_prices(1000, pattern)
+
+    assert list(prices.columns) == ['datetime', 'open', 'high', 'low', 'close', 'volume']
+    assert (prices['low'] <= prices[['open', 'close']].min(axis=1)).all()
+    assert (prices['high'] >= prices[['open', 'close']].max(axis=1)).all()
+
+
+def test_synthetic_triangle_is_detected():
+    patterns = core.load_patterns()
+
+    for seed in range(5):
+        triangle = scan.analyze('SYN', synthetic.synthetic_prices(40, 'triangle', seed),
+                                patterns)
+        channel = scan.analyze('SYN', synthetic.synthetic_prices(40, 'channel', seed),
+                               patterns)
+        assert [pattern['pattern_name'] for pattern in triangle['patterns']] == \
+               ['Ascending Triangle']
+        assert [pattern['pattern_name'] for pattern in channel['patterns']] == \
+               ['Ascending Channel']
+
+
+def test_find_regressions():
+    baseline = {'fast': 1.0, 'slow': 1.0}
+    results = {'fast': 1.2, 'slow': 1.3, 'new': 5.0}
+
+    assert benchmark.find_regressions(results, baseline, 0.25) == [('slow', 1.0, 1.3)]
+
+
+def test_run_benchmarks_subset():
+    results = benchmark.run_benchmarks(quick=True, only='_40')
+
+    assert set(results) == {'extrema_40', 'best_fit_line_40'}
+    assert all(seconds > 0 for seconds in results.values())
@@ -0,0 +1,100 @@
+"""
+Unit tests for cli
+"""
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+from stock_analyzer import cli, synthetic
+from stock_analyzer.instrument import instrumentation
+
+
+def _write_replay_files(directory):
+    for symbol, pattern in [('TRI', 'triangle'), ('NOISE', 'noise')]:
+        prices = synthetic.synthetic_prices(60, pattern)
+        prices['datetime'] = (prices['datetime'] * 86400000).astype('int64')
+        prices.to_csv(directory / f"{symbol}.csv", index=False)
+
+
+def test_scan_replay_with_metrics(monkeypatch, tmp_path):
+    _write_replay_files(tmp_path)
+    output_path = tmp_path / 'scan.jsonl'
+    metrics_path = tmp_path / 'metrics.json'
+    monkeypatch.setattr(sys, 'argv', ['cli.py', '--scan', '--symbols=TRI,NOISE,MISSING',
+                                      f"--replay={tmp_path}", f"--output={output_path}",
+                                      f"--metrics={metrics_path}", '--processes=2',
+                                      '--no-cache'])
+    monkeypatch.setattr(instrumentation, 'enabled', False)
+    instrumentation.reset()
+
+    cli.main()
+
+    with open(output_path) as output_file:
+        results = {result['symbol']: result for result in map(json.loads, output_file)}
+    assert results['MISSING']['status'] == 'no data'
+    assert [pattern['pattern_name'] for pattern in results['TRI']['patterns']] == \
+           ['Ascending Triangle']
+
+    with open(metrics_path) as metrics_file:
+        metrics = json.load(metrics_file)
+    assert metrics['timers']['best_fit_line']['calls'] == 4
+    assert metrics['timers']['detect_pattern']['calls'] == 2
+    assert metrics['counters']['candidate_pairs'] > 0
+
+
+def test_store_rejects_timeframes(monkeypatch, tmp_path, capsys):
+    store_path = tmp_path / 'results.db'
+    monkeypatch.setattr(sys, 'argv', ['cli.py', '--scan', '--symbols=TRI',
+                                      f"--replay={tmp_path}", f"--store={store_path}",
+                                      '--timeframes=daily,weekly'])
+
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main()
+
+    assert exit_info.value.code == 2
+    assert '--timeframes' in capsys.readouterr().out
+    assert not store_path.exists()
+
+
+def test_missing_api_key_exits_with_an_error(monkeypatch, tmp_path, capsys):
+    from stock_analyzer import config
+
+    monkeypatch.setattr(config, 'file_name', str(tmp_path / 'configuration.ini'))
+    monkeypatch.setattr(config, '_config', None)
+    monkeypatch.setattr(sys, 'argv', ['cli.py', '--scan', '--symbols=AAPL', '--no-cache',
+                                      '--processes=1'])
+
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main()
+
+    assert exit_info.value.code == 1
+    assert 'API key' in capsys.readouterr().out
+
+
+HEAVY_MODULES = ['numpy', 'pandas', 'scipy', 'matplotlib', 'mpl_finance', 'requests']
+
+
+def _loaded_heavy_modules(code):
+    check = (code + f"\nimport sys\n"
+                    f"print([m for m in {HEAVY_MODULES} if m in sys.modules])")
+    output = subprocess.run([sys.executable, '-W', 'ignore', '-c', check], check=True,
+                            capture_output=True, text=True).stdout
+    return output.strip().splitlines()[-1]
+
+
+@pytest.mark.parametrize('option', ['--version', '--help'])
+def test_trivial_options_skip_heavy_imports(option):
+    code = f"import sys\nsys.argv = ['cli.py', '{option}']\n" \
+           "from stock_analyzer import cli\n" \
+           "try:\n    cli.main()\nexcept SystemExit:\n    pass"
+
+    assert _loaded_heavy_modules(code) == '[]'
+
+
+def test_core_import_skips_drawing_http_and_dataframe_modules():
+    # Headless Candles scans never build a DataFrame, so pandas waits for its stage too
+    assert _loaded_heavy_modules("import stock_analyzer.core\n"
+                                 "import stock_analyzer.scan") == "['numpy']"
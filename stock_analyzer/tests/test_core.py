@@ -2,14 +2,486 @@
 Unit tests for core
 """
 
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
 from stock_analyzer import core
+from stock_analyzer.cache import CandleCache
+from stock_analyzer.tests.conftest import end_date
 
 
-def test_lookup_ticker():
-    aapl_data = core.lookup_ticker('AAPL')
+def test_lookup_ticker(price_history_stub):
+    base_url, _ = price_history_stub
+    aapl_data = core.lookup_prices('AAPL', end_date=end_date(70), base_url=base_url)
     assert len(aapl_data) == 40
 
 
-def test_lookup_ticker_not_found():
-    not_found_data = core.lookup_ticker('AAPLzjfkd')
+def test_lookup_ticker_not_found(price_history_stub):
+    base_url, _ = price_history_stub
+    not_found_data = core.lookup_prices('AAPLzjfkd', end_date=end_date(70),
+                                        base_url=base_url)
     assert not_found_data is None
+
+
+def test_lookup_prices_as_candles(price_history_stub):
+    base_url, _ = price_history_stub
+    frame = core.lookup_prices('AAPL', end_date=end_date(70), base_url=base_url)
+    candles = core.lookup_prices('AAPL', end_date=end_date(70), base_url=base_url,
+                                 as_frame=False)
+
+    assert isinstance(candles, core.Candles)
+    assert len(candles) == 40
+    assert candles['high'].flags['C_CONTIGUOUS']
+    pd.testing.assert_frame_equal(candles.to_frame(), frame)
+    np.testing.assert_array_equal(np.asarray(candles), frame.to_numpy())
+    np.testing.assert_array_equal(candles[-5:]['close'], frame['close'].iloc[-5:])
+
+    restored = pickle.loads(pickle.dumps(candles))
+    np.testing.assert_array_equal(np.asarray(restored), np.asarray(candles))
+
+
+def _analyze_summary(prices):
+    support_points, resistance_points = core.get_supports_and_resistances(prices, 2)
+    support = core.best_fit_line(prices['low'], support_points)
+    resistance = core.best_fit_line(prices['high'], resistance_points, False)
+    chart = core.Chart('TRI', prices, support, resistance, support_points,
+                       resistance_points, core.load_patterns(), verbose=False)
+
+    return ([trade.pattern_name for trade in chart.detected_patterns],
+            support.b, support.m, resistance.b, resistance.m)
+
+
+def test_candles_pipeline_matches_frame(ascending_triangle):
+    columns = ['open', 'high', 'low', 'close', 'volume']
+    raw = np.column_stack([ascending_triangle['datetime'] * 86400000,
+                           ascending_triangle[columns]])
+    candles = core.Candles.from_array(raw)
+
+    np.testing.assert_allclose(candles['datetime'], ascending_triangle['datetime'])
+    assert _analyze_summary(candles) == _analyze_summary(ascending_triangle)
+
+
+def _reference_best_fit_line(prices, derivatives, is_support=True):
+    """Pair-by-pair trendline search that best_fit_line must agree with."""
+    best_count = 0
+    best_trendline = None
+    price_margin = 0.05 * (max(prices) - min(prices))
+
+    for start in range(len(derivatives)):
+        for end in range(start + 1, len(derivatives)):
+            m = (prices[derivatives[end]] - prices[derivatives[start]]) / (
+                    derivatives[end] - derivatives[start])
+            b = prices[derivatives[end]] - m * derivatives[end]
+
+            for k in range(len(prices)):
+                test_y = m * k + b
+                test_y = test_y - price_margin if is_support else test_y + price_margin
+                if prices[k] < test_y and is_support \
+                        or prices[k] > test_y and not is_support:
+                    break
+            else:
+                touch_count = 0
+                for k in range(len(derivatives)):
+                    test_y = m * derivatives[k] + b
+                    if test_y - price_margin <= prices[derivatives[k]] \
+                            <= test_y + price_margin:
+                        touch_count += 1
+
+                if touch_count >= best_count:
+                    best_count = touch_count
+                    best_trendline = core.TrendLine(b, m, best_count,
+                                                    derivatives[start])
+
+    return best_trendline
+
+
+def _random_walk(seed, length=40):
+    rng = np.random.default_rng(seed)
+    return list(100 + np.cumsum(rng.normal(0, 1, length)))
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('is_support', [True, False])
+def test_best_fit_line_matches_reference(seed, is_support):
+    prices = _random_walk(seed)
+    derivatives = sorted(np.random.default_rng(seed).choice(40, 8, replace=False)
+                         .tolist())
+
+    expected = _reference_best_fit_line(prices, derivatives, is_support)
+    actual = core.best_fit_line(prices, derivatives, is_support)
+
+    if expected is None:
+        assert actual is None
+    else:
+        assert (actual.b, actual.m, actual.touches, actual.first_day) == \
+               (expected.b, expected.m, expected.touches, expected.first_day)
+
+
+def test_best_fit_lines_one_trendline_per_row():
+    prices = np.array([_random_walk(seed) for seed in range(5)])
+    derivatives = [[2, 9, 17, 30], [], [5, 25], [1, 3, 8, 13, 21, 34], [0, 39]]
+
+    trendlines = core.best_fit_lines(prices, derivatives)
+
+    assert len(trendlines) == 5
+    assert trendlines[1] is None
+    for row, trendline in enumerate(trendlines):
+        expected = _reference_best_fit_line(list(prices[row]), derivatives[row])
+        if expected is None:
+            assert trendline is None
+        else:
+            assert (trendline.m, trendline.first_day) == (expected.m, expected.first_day)
+
+
+def _reference_hull_fit_line(prices, derivatives, is_support=True):
+    """Brute force over price pairs that hull_fit_line must agree with."""
+    best = None
+    margin = 0.05 * (max(prices) - min(prices))
+    sign = 1 if is_support else -1
+
+    for start in range(len(prices)):
+        for end in range(start + 1, len(prices)):
+            m = (prices[end] - prices[start]) / (end - start)
+            b = prices[end] - m * end
+            gaps = [sign * (prices[k] - (m * k + b)) for k in range(len(prices))]
+            # Hull edges have no price beyond them and no price on them in between
+            if min(gaps) < -1e-9 or any(abs(gaps[k]) <= 1e-9
+                                        for k in range(start + 1, end)):
+                continue
+
+            touches = sum(abs(prices[k] - (m * k + b)) <= margin for k in derivatives)
+            if best is None or touches >= best.touches:
+                best = core.TrendLine(b, m, touches, start)
+
+    return best if best is not None and best.touches >= 2 else None
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('is_support', [True, False])
+def test_hull_fit_line_matches_reference(seed, is_support):
+    prices = _random_walk(seed, 30)
+    derivatives = sorted(np.random.default_rng(seed).choice(30, 6, replace=False)
+                         .tolist())
+
+    expected = _reference_hull_fit_line(prices, derivatives, is_support)
+    actual = core.best_fit_line(prices, derivatives, is_support, fitter='hull')
+
+    if expected is None:
+        assert actual is None
+        return
+    assert (actual.touches, actual.first_day) == (expected.touches, expected.first_day)
+    assert actual.m == pytest.approx(expected.m)
+    assert actual.b == pytest.approx(expected.b)
+
+    line = actual.m * np.arange(30) + actual.b
+    if is_support:
+        assert np.all(np.array(prices) >= line - 1e-9)
+    else:
+        assert np.all(np.array(prices) <= line + 1e-9)
+
+
+def test_hull_fitter_in_scan_and_best_fit_lines(ascending_triangle):
+    from stock_analyzer import scan
+
+    result = scan.analyze('SYN', ascending_triangle, core.load_patterns(), fitter='hull')
+    assert result['support'] is not None and result['resistance'] is not None
+    assert core.hull_fit_line([1.0], []) is None
+
+    prices = np.array([_random_walk(seed) for seed in range(3)])
+    lows = np.argsort(prices, axis=1)[:, :2]
+    trendlines = core.best_fit_lines(prices, [sorted(lows[0]), [], [int(lows[2, 0])]],
+                                     fitter='hull')
+    assert trendlines[0].m == core.hull_fit_line(prices[0], sorted(lows[0])).m
+    assert trendlines[0].touches >= 2
+    # Like the pairs fitter, no line without at least 2 touching extrema
+    assert trendlines[1] is None and trendlines[2] is None
+    assert core.best_fit_line(prices[1], [], fitter='hull') is None
+    assert core.best_fit_line(prices[1], [], fitter='pairs') is None
+
+    with pytest.raises(ValueError):
+        core.best_fit_lines(prices, [[], [], []], fitter='unknown')
+
+
+def _reference_supports_and_resistances(highs, lows, n):
+    """Per-index window scan that get_supports_and_resistances must agree with."""
+    from scipy.signal import savgol_filter
+
+    if n % 2 != 0:
+        n += 1
+
+    highs_d = np.zeros(len(highs))
+    highs_d[1:] = np.diff(savgol_filter(highs, n + 1, 2))
+    lows_d = np.zeros(len(lows))
+    lows_d[1:] = np.diff(savgol_filter(lows, n + 1, 2))
+
+    support, resistance = [], []
+    half = n // 2
+    for i in range(len(highs) - n):
+        if np.sum(highs_d[i:i + half] > 0) == half \
+                and np.sum(highs_d[i + half:i + n] < 0) == half:
+            resistance.append(i + half - 1)
+        if np.sum(lows_d[i:i + half] < 0) == half \
+                and np.sum(lows_d[i + half:i + n] > 0) == half:
+            support.append(i + half - 1)
+
+    return support, resistance
+
+
+@pytest.mark.parametrize('n', [2, 3, 6])
+def test_get_supports_and_resistances_matches_reference(n):
+    lows = np.array(_random_walk(n, 500))
+    highs = lows + 1
+    ltp = pd.DataFrame({'high': highs, 'low': lows})
+
+    assert core.get_supports_and_resistances(ltp, n) == \
+           _reference_supports_and_resistances(highs, lows, n)
+
+
+def test_get_supports_and_resistances_many_matches_single():
+    lows = np.array([_random_walk(seed, 200) for seed in range(4)])
+    highs = lows + 0.5
+
+    results = core.get_supports_and_resistances_many(highs, lows, 2)
+
+    for row, result in enumerate(results):
+        ltp = pd.DataFrame({'high': highs[row], 'low': lows[row]})
+        assert result == core.get_supports_and_resistances(ltp, 2)
+
+
+def test_lookup_prices_many(price_history_stub):
+    base_url, requested = price_history_stub
+    symbols = ['AAPL', 'MSFT', 'EMPTY', 'CHTR']
+
+    results = dict(core.lookup_prices_many(symbols, max_workers=3, base_url=base_url,
+                                           end_date=end_date(70)))
+
+    assert sorted(results) == sorted(symbols)
+    assert sorted(symbol for symbol, _ in requested) == sorted(symbols)
+    assert results['EMPTY'] is None
+    assert list(results['AAPL'].columns) == ['datetime', 'open', 'high', 'low',
+                                             'close', 'volume']
+    assert len(results['AAPL']) == 40
+
+
+def test_rate_limiter_blocks_over_quota():
+    rate_limiter = core.RateLimiter(2, 0.2)
+
+    start = time.monotonic()
+    for _ in range(3):
+        rate_limiter.wait()
+
+    assert time.monotonic() - start >= 0.2
+
+
+def test_lookup_prices_cache_tops_up_tail(price_history_stub, tmp_path):
+    base_url, requested = price_history_stub
+    cache = CandleCache(str(tmp_path))
+
+    first = core.lookup_prices('AAPL', end_date=end_date(70), base_url=base_url,
+                               cache=cache)
+    later = core.lookup_prices('AAPL', end_date=end_date(80), base_url=base_url,
+                               cache=cache)
+    uncached = core.lookup_prices('AAPL', end_date=end_date(80), base_url=base_url)
+
+    assert 'startDate' not in requested[0][1]
+    assert 'startDate' in requested[1][1] and 'period' not in requested[1][1]
+    assert len(requested) == 3
+    assert first['close'].iloc[-1] == 80.5
+    pd.testing.assert_frame_equal(later, uncached, check_dtype=False)
+
+    # Earlier end dates are served from disk without another request
+    earlier = core.lookup_prices('AAPL', end_date=end_date(75), base_url=base_url,
+                                 cache=cache)
+    assert len(requested) == 3
+    assert earlier['close'].iloc[-1] == 85.5
+
+
+def test_candle_cache_evicts_least_recently_used(tmp_path):
+    cache = CandleCache(str(tmp_path), max_bytes=5000)
+    candles = np.zeros((40, 6))
+
+    for symbol in ['A', 'B', 'C']:
+        cache.store(symbol, 'daily', 1, candles, 0)
+        time.sleep(0.01)
+        cache.load('A', 'daily', 1)
+
+    assert cache.load('A', 'daily', 1)[0] is not None
+    assert cache.load('B', 'daily', 1)[0] is None
+
+
+def _reference_features(support, resistance, n_prices):
+    """Scalar feature values that chart_features must agree with."""
+    last = n_prices - 1
+    support_end = support.m * last + support.b
+    resistance_end = resistance.m * last + resistance.b
+    level = (support_end + resistance_end) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (support.b - resistance.b) / (resistance.m - support.m)
+        return {'support_slope': support.m, 'resistance_slope': resistance.m,
+                'support_change': support.m * last / level,
+                'resistance_change': resistance.m * last / level,
+                'support_touches': support.touches,
+                'resistance_touches': resistance.touches,
+                'periods_till_intercept': x - n_prices,
+                'width_ratio': (resistance_end - support_end)
+                / (resistance.b - support.b),
+                'channel_width': (resistance_end - support_end) / level}
+
+
+def _reference_detect(pattern, support, resistance, n_prices):
+    """Scalar pattern checks that PatternMatcher must agree with."""
+    found = True
+    for sup in pattern.sups:
+        if support is None or (sup.slope_min and support.m < sup.slope_min) \
+                or (sup.slope_max and support.m > sup.slope_max):
+            found = False
+    for res in pattern.ress:
+        if resistance is None or (res.slope_min and resistance.m < res.slope_min) \
+                or (res.slope_max and resistance.m > res.slope_max):
+            found = False
+    for intercept in pattern.intercepts:
+        if support is None or resistance is None:
+            found = False
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x = (support.b - resistance.b) / (resistance.m - support.m)
+            if x - n_prices > intercept.periods_till_intercept:
+                found = False
+    if pattern.features:
+        if support is None or resistance is None:
+            return False
+        features = _reference_features(support, resistance, n_prices)
+        # Spacings and prior moves are unknown without extrema and closes, and don't
+        # rule a pattern out
+        for name, (minimum, maximum) in pattern.features.items():
+            value = features.get(name, np.nan)
+            if (minimum is not None and value < minimum) \
+                    or (maximum is not None and value > maximum):
+                found = False
+    return found
+
+
+def test_pattern_matcher_matches_scalar_checks():
+    patterns = core.load_patterns() + [
+        core.Pattern('Channel', [core.TrendLineCriteria(0, 'SUPPORT', -0.5, 0.5)],
+                     [core.TrendLineCriteria(0, 'RESISTANCE', -0.5, 0.5)], []),
+        core.Pattern('Converging', [], [],
+                     [core.InterceptCriteria(0, 0, 0, 3),
+                      core.InterceptCriteria(1, 0, 0, 20)]),
+    ]
+    rng = np.random.default_rng(3)
+    supports = []
+    resistances = []
+    for _ in range(2000):
+        support_m = np.float64(rng.normal(0, 0.2))
+        support = core.TrendLine(np.float64(rng.normal(100, 5)), support_m,
+                                 int(rng.integers(1, 5)), 0)
+        resistance_m = np.float64(rng.choice([0.0, support_m, rng.normal(0, 0.2)]))
+        resistance = core.TrendLine(support.b + np.float64(rng.uniform(1, 15)),
+                                    resistance_m, int(rng.integers(1, 5)), 0)
+        supports.append(None if rng.random() < 0.05 else support)
+        resistances.append(None if rng.random() < 0.05 else resistance)
+    supports[0] = resistances[0]
+
+    found = core.compile_patterns(patterns).match_lines(supports, resistances, 40)
+
+    expected = [[_reference_detect(pattern, support, resistance, 40)
+                 for pattern in patterns]
+                for support, resistance in zip(supports, resistances)]
+    assert found.tolist() == expected
+    assert found.any(axis=0).all()
+
+
+def test_load_patterns_is_package_relative_and_cached(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+
+    patterns = core.load_patterns()
+
+    assert [pattern.pattern_name for pattern in patterns] == [
+        'Ascending Channel', 'Ascending Triangle', 'Bear Flag', 'Bull Flag',
+        'Descending Channel', 'Descending Triangle', 'Double Bottom', 'Double Top',
+        'Falling Wedge', 'Horizontal Channel', 'Rising Wedge', 'Symmetrical Triangle']
+    assert patterns[0] is core.load_patterns()[0]
+    assert core.compile_patterns(patterns) is core.compile_patterns(core.load_patterns())
+
+
+def test_load_patterns_features_schema(tmp_path, capsys):
+    (tmp_path / 'flag.json').write_text(
+        '{"pattern_name": "Flag", "breakout": "down", '
+        '"features": {"channel_width": {"max": 0.04}, "width_ratio": {"min": 0}}}')
+    (tmp_path / 'typo.json').write_text(
+        '{"pattern_name": "Typo", "features": {"chanel_width": {"max": 0.04}}}')
+
+    patterns = core.load_patterns(str(tmp_path))
+
+    assert [(pattern.pattern_name, pattern.breakout, pattern.features)
+            for pattern in patterns] == \
+           [('Flag', 'down', {'channel_width': (None, 0.04), 'width_ratio': (0, None)})]
+    assert 'typo.json incorrectly formatted' in capsys.readouterr().out
+
+
+def test_chart_features_are_computed_once():
+    support = core.TrendLine(100.0, 0.0, 2, 0)
+    resistance = core.TrendLine(110.0, 0.01, 2, 0)
+    chart = core.Chart('TOP', range(40), support, resistance, [5, 20, 35], [8, 30],
+                       core.load_patterns(), verbose=False)
+
+    features = dict(zip(core.FEATURES, chart.features))
+    assert chart.features is chart.features
+    assert features['resistance_spacing'] == 22
+    assert features['support_spacing'] == 15
+    assert features['width_ratio'] == pytest.approx(10.39 / 10)
+    trades = [(trade.pattern_name, trade.breakout) for trade in chart.detected_patterns]
+    assert trades == \
+           [('Ascending Triangle', 'up'), ('Double Bottom', 'up'), ('Double Top', 'down'),
+            ('Horizontal Channel', 'up'), ('Horizontal Channel', 'down')]
+
+    # Double tops need their two peaks apart
+    close = core.Chart('TOP', range(40), support, resistance, [], [30, 33],
+                       core.load_patterns(), verbose=False)
+    assert 'Double Top' not in [trade.pattern_name for trade in close.detected_patterns]
+
+
+def test_flags_need_a_prior_move():
+    support = core.TrendLine(100.0, -0.1, 2, 10)
+    resistance = core.TrendLine(103.0, -0.1, 2, 12)
+    pole = np.concatenate([np.linspace(90, 100, 10), np.full(30, 99.0)])
+
+    flag = core.Chart('FLAG', pole, support, resistance, [], [], core.load_patterns(),
+                      verbose=False)
+    channel = core.Chart('CHANNEL', np.full(40, 99.0), support, resistance, [], [],
+                         core.load_patterns(), verbose=False)
+
+    assert dict(zip(core.FEATURES, flag.features))['prior_move'] == pytest.approx(0.1)
+    assert ('Bull Flag', 'up') in [(trade.pattern_name, trade.breakout)
+                                   for trade in flag.detected_patterns]
+    assert 'Bull Flag' not in [trade.pattern_name for trade in channel.detected_patterns]
+
+
+def test_two_sided_patterns_trade_both_breakouts():
+    breakouts = {pattern.pattern_name: pattern.breakouts
+                 for pattern in core.load_patterns()}
+
+    assert breakouts['Symmetrical Triangle'] == ('up', 'down')
+    assert breakouts['Horizontal Channel'] == ('up', 'down')
+    assert breakouts['Ascending Triangle'] == ('up',)
+    assert breakouts['Bear Flag'] == ('down',)
+
+
+def test_trade_criteria_for_downward_breakouts():
+    support = core.TrendLine(100.0, 0.0, 2, 0)
+    resistance = core.TrendLine(110.0, -0.1, 2, 0)
+
+    up = core.get_trade_criteria('Up', support, resistance)
+    down = core.get_trade_criteria('Down', support, resistance, breakout='down')
+
+    assert (up.buy_price, up.sell_price, up.stop_price) == \
+           pytest.approx((110.1, 117.0, 109.0))
+    assert (down.buy_price, down.sell_price, down.stop_price) == \
+           pytest.approx((99.9, 93.0, 101.0))
+    assert down.profit_margin == pytest.approx(6.9 / 99.9 * 100)
+    assert down.loss_margin == pytest.approx(-1.1 / 99.9 * 100)
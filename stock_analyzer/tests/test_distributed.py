@@ -0,0 +1,169 @@
+"""
+Unit tests for distributed
+"""
+
+import threading
+import time
+
+import pytest
+
+from stock_analyzer import core, distributed, scan, synthetic
+from stock_analyzer.sources import ReplaySource
+
+
+def test_expired_leases_are_reassigned(tmp_path):
+    queue = distributed.WorkQueue(str(tmp_path / 'queue.db'))
+    assert queue.create(['A', 'B', 'C', 'D', 'E'], shard_size=2, parameters={'n': 2}) == 3
+    assert queue.create(['A', 'B', 'C', 'D', 'E'], shard_size=2,
+                        parameters={'n': 2}) == 0
+    assert queue.parameters() == {'n': 2}
+
+    assert queue.claim('lost', lease_seconds=0.05) == (1, ['A', 'B'])
+    assert queue.claim('alive', lease_seconds=60) == (2, ['C', 'D'])
+    assert queue.progress() == {'pending': 1, 'leased': 2, 'done': 0, 'failed': 0}
+
+    time.sleep(0.1)
+    assert queue.renew(2, 'alive', 60)
+    assert queue.claim('alive', lease_seconds=60) == (1, ['A', 'B'])
+    assert not queue.renew(1, 'lost', 60)
+
+    queue.complete(1, [{'symbol': 'A'}, {'symbol': 'B'}])
+    queue.complete(1, [{'symbol': 'A', 'late': True}, {'symbol': 'B'}])
+    assert queue.claim('alive', lease_seconds=60) == (3, ['E'])
+    assert queue.claim('alive', lease_seconds=60) is None
+    assert queue.progress() == {'pending': 0, 'leased': 2, 'done': 1, 'failed': 0}
+    assert list(queue.results()) == [{'symbol': 'A', 'late': True}, {'symbol': 'B'}]
+    queue.close()
+
+
+def test_resuming_another_scan_raises(tmp_path):
+    queue = distributed.WorkQueue(str(tmp_path / 'queue.db'))
+    queue.create(['A', 'B'], shard_size=2, parameters={'end_date': (2021, 1, 1)})
+    assert queue.create(['A', 'B'], shard_size=1,
+                        parameters={'end_date': [2021, 1, 1]}) == 0
+
+    with pytest.raises(distributed.QueueMismatchError):
+        queue.create(['A', 'C'], shard_size=2, parameters={'end_date': [2021, 1, 1]})
+    with pytest.raises(distributed.QueueMismatchError):
+        queue.create(['A', 'B'], shard_size=2)
+    assert queue.progress() == {'pending': 1, 'leased': 0, 'done': 0, 'failed': 0}
+    queue.close()
+
+
+def test_leases_are_renewed_on_a_timer(tmp_path):
+    queue_path = str(tmp_path / 'queue.db')
+    queue = distributed.WorkQueue(queue_path)
+    queue.create(['SLOW'], shard_size=1)
+    shard_id, _ = queue.claim('slow', lease_seconds=0.3)
+
+    # Nothing arrives from the scan for longer than the lease
+    with distributed.LeaseRenewer(queue_path, shard_id, 'slow', 0.3) as renewer:
+        time.sleep(0.8)
+        assert queue.claim('other', lease_seconds=60) is None
+    assert not renewer.lost.is_set()
+
+    time.sleep(0.4)
+    assert queue.claim('other', lease_seconds=60) == (shard_id, ['SLOW'])
+    with distributed.LeaseRenewer(queue_path, shard_id, 'slow', 0.3) as renewer:
+        assert renewer.lost.wait(1)
+    queue.close()
+
+
+def test_shards_fail_after_too_many_attempts(tmp_path):
+    queue_path = str(tmp_path / 'queue.db')
+    queue = distributed.WorkQueue(queue_path)
+    queue.create(['A', 'B', 'C'], shard_size=2)
+    queue.complete(*queue.claim('worker', lease_seconds=60)[:1],
+                   [{'symbol': 'A'}, {'symbol': 'B'}])
+
+    # Every worker that leases the shard crashes
+    for attempt in range(2):
+        assert queue.claim(f"crashed-{attempt}", lease_seconds=0.01,
+                           max_attempts=2) == (2, ['C'])
+        time.sleep(0.05)
+
+    assert queue.claim('next', lease_seconds=60, max_attempts=2) is None
+    assert queue.progress() == {'pending': 0, 'leased': 0, 'done': 1, 'failed': 1}
+    queue.close()
+
+    results = list(distributed.coordinate(queue_path, ['A', 'B', 'C'], shard_size=2,
+                                          poll_interval=0.01))
+    assert [(result['symbol'], result.get('status')) for result in results] == \
+           [('A', None), ('B', None), ('C', 'error')]
+    assert 'after 2 attempts' in results[2]['error']
+
+
+def test_coordinator_fails_shards_without_workers(tmp_path):
+    queue_path = str(tmp_path / 'queue.db')
+    queue = distributed.WorkQueue(queue_path)
+    queue.create(['A'], shard_size=1)
+    assert queue.claim('crashed', lease_seconds=0.01, max_attempts=1) == (1, ['A'])
+    queue.close()
+
+    # The only worker crashed, so nobody is left to claim and fail the shard
+    results = list(distributed.coordinate(queue_path, ['A'], shard_size=1,
+                                          poll_interval=0.01, max_attempts=1))
+    assert [result['status'] for result in results] == ['error']
+
+
+def test_lease_lost_after_the_last_result_completes(tmp_path, monkeypatch):
+    class LostRenewer:
+        def __init__(self, *args):
+            self.lost = threading.Event()
+            self.lost.set()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            return False
+
+    monkeypatch.setattr(distributed, 'LeaseRenewer', LostRenewer)
+    prices = synthetic.synthetic_prices(60, 'noise', seed=0)
+    prices['datetime'] = (prices['datetime'] * 86400000).astype('int64')
+    prices.to_csv(tmp_path / 'SYN.csv', index=False)
+    queue_path = str(tmp_path / 'queue.db')
+    queue = distributed.WorkQueue(queue_path)
+    queue.create(['SYN'], shard_size=1)
+
+    assert distributed.work(queue_path, 'late', poll_interval=0.01, processes=1,
+                            source=ReplaySource(str(tmp_path))) == 1
+    assert queue.progress() == {'pending': 0, 'leased': 0, 'done': 1, 'failed': 0}
+    queue.close()
+
+
+def test_workers_scan_every_shard(tmp_path):
+    symbols = []
+    for index, pattern in enumerate(['triangle', 'noise'] * 3):
+        prices = synthetic.synthetic_prices(60, pattern, seed=index)
+        prices['datetime'] = (prices['datetime'] * 86400000).astype('int64')
+        prices.to_csv(tmp_path / f"SYN{index}.csv", index=False)
+        symbols.append(f"SYN{index}")
+    queue_path = str(tmp_path / 'queue.db')
+    source = ReplaySource(str(tmp_path))
+
+    merged = []
+    coordinator = threading.Thread(target=lambda: merged.extend(distributed.coordinate(
+        queue_path, symbols + ['MISSING'], shard_size=2, poll_interval=0.05,
+        fitter='pairs')))
+    coordinator.start()
+    queue = distributed.WorkQueue(queue_path)
+    while queue.progress()['pending'] == 0:
+        time.sleep(0.01)
+    queue.close()
+
+    completed = []
+    workers = [threading.Thread(target=lambda name=name: completed.append(
+        distributed.work(queue_path, name, poll_interval=0.05, processes=1,
+                         source=source)))
+               for name in ('first', 'second')]
+    for worker in workers:
+        worker.start()
+    for worker in workers + [coordinator]:
+        worker.join()
+
+    assert sum(completed) == 4
+    expected = sorted(scan.scan(symbols + ['MISSING'], core.load_patterns(),
+                                processes=1, source=source),
+                      key=lambda result: result['symbol'])
+    assert sorted(merged, key=lambda result: result['symbol']) == expected
@@ -0,0 +1,71 @@
+"""
+Unit tests for ingest
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from stock_analyzer import core, ingest, scan
+
+
+def _dump(length=50, symbols=('AAA', 'BBB', 'CCC')):
+    """Candles for several symbols, interleaved day by day like a market-wide export."""
+
+    days = np.arange(length)
+    return pd.DataFrame({
+        'symbol': np.tile(symbols, length),
+        'datetime': np.repeat(1_620_000_000_000 + days * 86_400_000, len(symbols)),
+        'open': np.repeat(days, len(symbols)) + 10.0,
+        'high': (np.repeat(days, len(symbols)) + 11.0
+                 + np.tile(range(len(symbols)), length)),
+        'low': np.repeat(days, len(symbols)) + 9.0,
+        'close': np.repeat(days, len(symbols)) + 10.5,
+        'volume': 1000.0,
+    })
+
+
+@pytest.mark.parametrize('file_name', ['dump.csv', 'dump.ndjson', 'dump.jsonl.gz'])
+def test_last_windows_matches_whole_file(tmp_path, file_name):
+    dump = _dump()
+    path = str(tmp_path / file_name)
+    if '.csv' in file_name:
+        dump.to_csv(path, index=False)
+    else:
+        dump.to_json(path, orient='records', lines=True)
+
+    windows = dict(ingest.last_windows(path, window=40, chunk_size=7))
+
+    assert list(windows) == ['AAA', 'BBB', 'CCC']
+    for symbol, candles in windows.items():
+        rows = dump[dump['symbol'] == symbol].drop(columns='symbol').to_numpy(dtype=float)
+        expected = core.candle_frame(rows, 40)
+        assert isinstance(candles, core.Candles)
+        pd.testing.assert_frame_equal(candles.to_frame(), expected)
+
+
+def test_symbol_windows_slide_across_chunks(tmp_path):
+    path = str(tmp_path / 'dump.csv')
+    _dump(length=12, symbols=('AAA', 'BBB')).to_csv(path, index=False)
+
+    windows = list(ingest.symbol_windows(path, window=5, step=3, chunk_size=5))
+
+    for symbol in ('AAA', 'BBB'):
+        closes = [list(candles['close']) for name, candles in windows if name == symbol]
+        assert closes == [[10.5 + day for day in range(start, start + 5)]
+                          for start in (0, 3, 6)]
+
+
+def test_ingested_windows_feed_the_pipeline(tmp_path, ascending_triangle):
+    dump = ascending_triangle.assign(symbol='TRI', datetime=ascending_triangle['datetime']
+                                     * 86_400_000)
+    path = str(tmp_path / 'dump.csv')
+    dump.to_csv(path, index=False)
+
+    results = list(scan.scan_histories(ingest.last_windows(path), core.load_patterns(),
+                                       processes=1))
+
+    assert [pattern['pattern_name'] for pattern in results[0]['patterns']] == \
+           [pattern['pattern_name']
+            for pattern in scan.analyze('TRI', ascending_triangle,
+                                        core.load_patterns())['patterns']]
@@ -0,0 +1,31 @@
+"""
+Unit tests for instrument
+"""
+
+from stock_analyzer.instrument import Instrumentation
+
+
+def test_instrumentation_totals_and_formats():
+    instrumentation = Instrumentation()
+
+    with instrumentation.stage('http'):
+        pass
+    instrumentation.add('api_bytes', 10)
+    assert instrumentation.snapshot() == {'timers': {}, 'counters': {}}
+
+    instrumentation.enabled = True
+    for _ in range(2):
+        with instrumentation.stage('http'):
+            pass
+    instrumentation.add('api_bytes', 10)
+    instrumentation.merge({'timers': {'http': {'calls': 3, 'seconds': 1.5}},
+                           'counters': {'api_bytes': 5}})
+
+    snapshot = instrumentation.snapshot()
+    assert snapshot['timers']['http']['calls'] == 5
+    assert snapshot['timers']['http']['seconds'] >= 1.5
+    assert snapshot['counters'] == {'api_bytes': 15}
+    assert 'stock_analyzer_stage_calls_total{stage="http"} 5' in \
+           instrumentation.to_prometheus()
+    assert 'stock_analyzer_api_bytes_total 15' in instrumentation.to_prometheus()
+    assert instrumentation.summary_table().splitlines()[1].startswith('http')
@@ -0,0 +1,120 @@
+"""
+Unit tests for journal
+"""
+
+import pytest
+
+from stock_analyzer import cli, core, journal, scan, synthetic
+from stock_analyzer.sources import ReplaySource
+
+
+class FlakySource(ReplaySource):
+    """Replays files, failing some symbols a number of times first"""
+
+    def __init__(self, directory, failures):
+        super().__init__(directory)
+        self.failures = dict(failures)
+        self.lookups = []
+
+    def lookup_prices(self, symbol, **kwargs):
+        self.lookups.append(symbol)
+        if self.failures.get(symbol):
+            self.failures[symbol] -= 1
+            raise ConnectionError(f"{symbol} timed out")
+        if symbol == 'BROKEN':
+            raise KeyError('datetime')
+        return super().lookup_prices(symbol, **kwargs)
+
+
+def _write_replay_files(directory, count=4):
+    symbols = []
+    for index in range(count):
+        prices = synthetic.synthetic_prices(60, ['triangle', 'noise'][index % 2],
+                                            seed=index)
+        prices['datetime'] = (prices['datetime'] * 86400000).astype('int64')
+        prices.to_csv(directory / f"SYN{index}.csv", index=False)
+        symbols.append(f"SYN{index}")
+    return symbols
+
+
+def test_journal_survives_a_partial_line(tmp_path):
+    path = str(tmp_path / 'run.journal')
+    run_journal = journal.Journal(path)
+    run_journal.record('AAPL', 'done', {'symbol': 'AAPL'})
+    run_journal.record('MSFT', 'failed', error='timed out')
+    run_journal.close()
+    with open(path, 'a') as journal_file:
+        journal_file.write('{"symbol": "CHT')
+
+    resumed = journal.Journal(path)
+    resumed.record('MSFT', 'failed', error='timed out')
+    resumed.close()
+
+    entries = journal.Journal(path).entries
+    assert sorted(entries) == ['AAPL', 'MSFT']
+    assert entries['AAPL']['result'] == {'symbol': 'AAPL'}
+    assert entries['MSFT']['attempts'] == 2
+    assert journal.Journal(path).is_done('AAPL')
+    assert not journal.Journal(path).is_done('MSFT')
+    assert journal.Journal(path).is_done('MSFT', max_attempts=2)
+
+
+def test_resumable_scan_skips_finished_symbols(tmp_path):
+    symbols = _write_replay_files(tmp_path) + ['BROKEN']
+    journal_path = str(tmp_path / 'scan.journal')
+    patterns = core.load_patterns()
+
+    # One retry covers SYN1's first failure, SYN2 fails both times in the first run
+    source = FlakySource(tmp_path, {'SYN1': 1, 'SYN2': 2})
+    interrupted = journal.resumable_scan(symbols, patterns, journal_path, retries=1,
+                                         backoff=0, source=source, processes=1)
+    first = [next(interrupted) for _ in range(3)]
+    interrupted.close()
+
+    source = FlakySource(tmp_path, {})
+    resumed = list(journal.resumable_scan(symbols, patterns, journal_path, retries=1,
+                                          backoff=0, source=source, processes=1))
+
+    # Finished symbols are reported from the journal, failed ones are scanned again
+    finished = [result for result in first if result['status'] != 'error']
+    assert 'SYN2' not in {result['symbol'] for result in finished}
+    assert sorted(resumed[:len(finished)], key=lambda result: result['symbol']) == \
+           sorted(finished, key=lambda result: result['symbol'])
+    assert sorted(result['symbol'] for result in resumed) == sorted(symbols)
+    assert set(source.lookups).isdisjoint(result['symbol'] for result in finished)
+
+    by_symbol = {result['symbol']: result for result in resumed}
+    expected = {result['symbol']: result
+                for result in scan.scan(symbols[:4], patterns, processes=1,
+                                        source=ReplaySource(tmp_path))}
+    for symbol in symbols[:4]:
+        assert by_symbol[symbol] == expected[symbol]
+    assert by_symbol['BROKEN']['status'] == 'error'
+    assert 'KeyError' in by_symbol['BROKEN']['error']
+
+
+def _fail_on_noise(symbol, price_history, **kwargs):
+    if symbol == 'SYN1':
+        raise ValueError('bad candles')
+    return scan.analyze(symbol, price_history, **kwargs)
+
+
+def test_scan_histories_isolates_failing_symbols(tmp_path):
+    symbols = _write_replay_files(tmp_path, 3)
+
+    price_histories = ReplaySource(tmp_path).lookup_prices_many(symbols)
+
+    results = list(scan.scan_histories(price_histories, core.load_patterns(), processes=2,
+                                       analyzer=_fail_on_noise))
+
+    statuses = {result['symbol']: result['status'] for result in results}
+    assert statuses == {'SYN0': 'ok', 'SYN1': 'error', 'SYN2': 'ok'}
+
+
+def test_generate_chart_returns_when_nothing_is_found(tmp_path, capsys):
+    cli.generate_chart('MISSING', '', core.load_patterns(),
+                       source=ReplaySource(str(tmp_path)))
+
+    assert 'Nothing found!' in capsys.readouterr().out
+    with pytest.raises(ValueError):
+        cli.generate_chart('MISSING', '', [], fitter='unknown')
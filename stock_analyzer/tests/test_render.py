@@ -0,0 +1,48 @@
+"""
+Unit tests for render
+"""
+
+from stock_analyzer import core, render, scan, synthetic
+
+
+def _chart(symbol, pattern):
+    prices = synthetic.synthetic_prices(40, pattern)
+    support_points, resistance_points = core.get_supports_and_resistances(prices, 2)
+    return core.Chart(symbol, prices,
+                      core.best_fit_line(prices['low'], support_points),
+                      core.best_fit_line(prices['high'], resistance_points, False),
+                      support_points, resistance_points, core.load_patterns(),
+                      verbose=False)
+
+
+def test_renderer_reuses_figure(tmp_path):
+    renderer = render.ChartRenderer()
+
+    png = renderer.render(_chart('TRI', 'triangle'), str(tmp_path / 'TRI.png'))
+    svg = renderer.render(_chart('NOISE', 'noise'), str(tmp_path / 'NOISE.svg'))
+
+    with open(png, 'rb') as png_file:
+        assert png_file.read(8) == b'\x89PNG\r\n\x1a\n'
+    with open(svg) as svg_file:
+        assert '<svg' in svg_file.read()
+    assert len(renderer.figure.axes) == 1
+    assert renderer.axes.get_title() == 'NOISE'
+
+
+def test_render_charts_detected_only(tmp_path):
+    charts = [_chart('TRI', 'triangle'), _chart('NOISE', 'noise')]
+
+    paths = render.render_charts(charts, str(tmp_path), detected_only=True, processes=2)
+
+    assert paths == [str(tmp_path / 'TRI.png')]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['TRI.png']
+
+
+def test_analyze_renders_chart_on_request(tmp_path):
+    prices = synthetic.synthetic_prices(40, 'triangle')
+
+    result = scan.analyze('TRI', prices, core.load_patterns(),
+                          chart_directory=str(tmp_path), chart_format='svg')
+
+    assert result['chart'] == str(tmp_path / 'TRI.svg')
+    assert 'chart' not in scan.analyze('TRI', prices, core.load_patterns())
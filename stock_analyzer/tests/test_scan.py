@@ -0,0 +1,62 @@
+"""
+Unit tests for scan
+"""
+
+import csv
+import io
+import json
+
+from stock_analyzer import core, scan
+from stock_analyzer.sources import AmeritradeSource
+from stock_analyzer.tests.conftest import end_date
+
+
+def test_analyze_detects_pattern(ascending_triangle):
+    result = scan.analyze('TRI', ascending_triangle, core.load_patterns())
+
+    assert result['status'] == 'ok'
+    assert result['resistance']['m'] == 0.0
+    assert [pattern['pattern_name'] for pattern in result['patterns']] == \
+           ['Ascending Triangle']
+    json.dumps(result)
+
+
+def test_write_csv_one_row_per_pattern(ascending_triangle):
+    results = [scan.analyze('TRI', ascending_triangle, core.load_patterns()),
+               scan.analyze('NONE', None, [])]
+    output = io.StringIO()
+
+    scan.write_csv(results, output)
+
+    rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+    assert [(row['symbol'], row['status'], row['pattern_name']) for row in rows] == \
+           [('TRI', 'ok', 'Ascending Triangle'), ('NONE', 'no data', '')]
+
+
+def test_scan_keeps_going_past_missing_symbols(price_history_stub):
+    base_url, _ = price_history_stub
+
+    results = list(scan.scan(['AAPL', 'EMPTY', 'MSFT'], core.load_patterns(),
+                             processes=2, source=AmeritradeSource(base_url=base_url),
+                             end_date=end_date(70)))
+
+    assert sorted((result['symbol'], result['status']) for result in results) == \
+           [('AAPL', 'ok'), ('EMPTY', 'no data'), ('MSFT', 'ok')]
+
+
+def test_scan_histories_bounds_pending_histories(ascending_triangle):
+    read = []
+
+    def price_histories():
+        for index in range(12):
+            read.append(index)
+            yield f"SYN{index}", ascending_triangle
+
+    in_flight = []
+    for position, result in enumerate(scan.scan_histories(
+            price_histories(), core.load_patterns(), processes=1, max_pending=2)):
+        in_flight.append(len(read) - position)
+        assert result['status'] == 'ok'
+
+    assert len(in_flight) == 12
+    assert max(in_flight) <= 2
@@ -0,0 +1,119 @@
+"""
+Unit tests for simulate
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from stock_analyzer import backtest, core, simulate, synthetic
+
+
+def _reference_trade(index, buy, sell, stop, direction, prices, end, entry_bars,
+                     max_holding):
+    """One signal at a time, candle by candle."""
+    opens, highs, lows, closes = prices
+    if direction < 0:
+        opens, closes = -opens, -closes
+        highs, lows = -lows, -highs
+        buy, sell, stop = -buy, -sell, -stop
+
+    for fill in range(index + 1, min(index + 1 + entry_bars, end)):
+        if highs[fill] >= buy:
+            break
+    else:
+        return 'unfilled', None, None
+
+    fill_price = max(buy, opens[fill])
+    last = min(fill + max_holding, end - 1)
+    for bar in range(fill, last + 1):
+        gap = opens[bar] if bar > fill else fill_price
+        if lows[bar] <= stop:
+            outcome, exit_price = 'stop', min(stop, gap)
+            break
+        if highs[bar] >= sell:
+            outcome, exit_price = 'target', max(sell, gap)
+            break
+    else:
+        bar, exit_price = last, closes[last]
+        outcome = 'expired' if fill + max_holding <= end - 1 else 'open'
+
+    return outcome, bar - fill, (exit_price - fill_price) / abs(fill_price) * 100
+
+
+def test_simulate_trades_matches_reference():
+    rng = np.random.default_rng(11)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, 3000)))
+    opens = closes * np.exp(rng.normal(0, 0.01, 3000))
+    highs = np.maximum(opens, closes) * (1 + np.abs(rng.normal(0, 0.01, 3000)))
+    lows = np.minimum(opens, closes) * (1 - np.abs(rng.normal(0, 0.01, 3000)))
+    # Two series, split at candle 2000
+    ends_of_series = np.array([2000, 3000])
+
+    index = rng.integers(0, 3000, 5000)
+    ends = ends_of_series[(index >= 2000).astype(int)]
+    direction = rng.choice([1.0, -1.0], 5000)
+    buy = closes[index] * (1 + direction * rng.uniform(0, 0.03, 5000))
+    sell = buy * (1 + direction * rng.uniform(0.01, 0.1, 5000))
+    stop = buy * (1 - direction * rng.uniform(0.01, 0.1, 5000))
+
+    trades = simulate.simulate_trades(index, buy, sell, stop, direction, opens, highs,
+                                      lows, closes, ends, entry_bars=3, max_holding=20,
+                                      chunk_size=700)
+
+    outcomes = [simulate.OUTCOMES[code] for code in trades['outcome']]
+    assert set(outcomes) == set(simulate.OUTCOMES)
+    for position in range(5000):
+        outcome, holding, returns = _reference_trade(
+            index[position], buy[position], sell[position], stop[position],
+            direction[position], (opens, highs, lows, closes), ends[position], 3, 20)
+        assert outcomes[position] == outcome
+        if outcome != 'unfilled':
+            assert trades['holding'][position] == holding
+            assert trades['return'][position] == pytest.approx(returns)
+
+
+def test_simulate_backtest_signals_and_summarize():
+    price_histories = {f"SYN{index}": synthetic.synthetic_prices(160, pattern, seed=index)
+                       for index, pattern in enumerate(['triangle', 'channel', 'noise'])}
+    signals = [detection for symbol, price_history in price_histories.items()
+               for detection in backtest.backtest(symbol, price_history,
+                                                  core.load_patterns())]
+
+    outcomes = simulate.simulate(signals, price_histories, max_holding=10)
+
+    assert len(outcomes) == len(signals)
+    for outcome in outcomes:
+        assert set(simulate.CSV_FIELDS) <= set(outcome)
+        if outcome['outcome'] == 'unfilled':
+            assert outcome['exit_index'] is None and outcome['return'] is None
+        else:
+            assert outcome['index'] < outcome['fill_index'] <= outcome['exit_index'] \
+                   < len(price_histories[outcome['symbol']])
+
+    summary = simulate.summarize(outcomes)
+    assert [total['pattern_name'] for total in summary] == \
+           sorted({signal['pattern_name'] for signal in signals})
+    for total in summary:
+        outcomes_of_pattern = [outcome for outcome in outcomes
+                               if outcome['pattern_name'] == total['pattern_name']]
+        assert total['signals'] == len(outcomes_of_pattern)
+        assert total['filled'] == total['targets'] + total['stops'] + total['expired']
+    assert 'Ascending Triangle' in simulate.summary_table(summary)
+
+
+def test_simulate_short_trade():
+    prices = pd.DataFrame({'open': [100, 99, 97, 95, 94.0],
+                           'high': [101, 100, 98, 96, 95.0],
+                           'low': [99, 97, 95, 93, 92.0],
+                           'close': [100, 98, 96, 94, 93.0]})
+    signal = {'symbol': 'DOWN', 'index': 0, 'pattern_name': 'Descending Triangle',
+              'breakout': 'down', 'buy_price': 98.0, 'sell_price': 94.0,
+              'stop_price': 101.0}
+
+    outcome, = simulate.simulate([signal], {'DOWN': prices})
+
+    assert (outcome['outcome'], outcome['fill_index'], outcome['exit_index']) == \
+           ('target', 1, 3)
+    assert outcome['fill_price'] == 98.0
+    assert outcome['return'] == pytest.approx(4 / 98 * 100)
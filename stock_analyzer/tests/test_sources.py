@@ -0,0 +1,72 @@
+"""
+Unit tests for sources
+"""
+
+import pandas as pd
+import pytest
+
+from stock_analyzer import config, core
+from stock_analyzer.sources import AmeritradeSource, PriceSource, ReplaySource
+from stock_analyzer.tests.conftest import STUB_DAY, STUB_FIRST_CANDLE, end_date
+
+
+def _write_replay_file(directory, symbol, datetimes):
+    pd.DataFrame({'datetime': datetimes,
+                  'open': [10.0 + day for day in range(100)],
+                  'high': [11.0 + day for day in range(100)],
+                  'low': [9.0 + day for day in range(100)],
+                  'close': [10.5 + day for day in range(100)],
+                  'volume': [1000] * 100}).to_csv(directory / f"{symbol}.csv",
+                                                  index=False)
+
+
+def test_sources_must_implement_lookup_prices():
+    class IncompleteSource(PriceSource):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteSource()
+
+
+def test_replay_source_matches_ameritrade_shape(price_history_stub, tmp_path):
+    base_url, _ = price_history_stub
+    _write_replay_file(tmp_path, 'AAPL',
+                       [STUB_FIRST_CANDLE + day * STUB_DAY for day in range(100)])
+
+    replayed = ReplaySource(str(tmp_path)).lookup_prices('AAPL', end_date=end_date(70))
+    fetched = AmeritradeSource(base_url=base_url).lookup_prices('AAPL',
+                                                                end_date=end_date(70))
+
+    pd.testing.assert_frame_equal(replayed, fetched, check_dtype=False)
+
+
+def test_replay_source_parses_date_strings(tmp_path):
+    dates = pd.date_range('2021-01-01 12:00', periods=100).strftime('%Y-%m-%d %H:%M')
+    _write_replay_file(tmp_path, 'MSFT', list(dates))
+
+    prices = ReplaySource(str(tmp_path)).lookup_prices('MSFT', end_date='03-01-2021',
+                                                       num_entries_to_analyze=10)
+
+    assert len(prices) == 10
+    assert prices['close'].iloc[-1] == 10.5 + 58
+    assert prices['datetime'].iloc[-1] == core.epoch2num(
+        pd.Timestamp('2021-02-28 12:00').timestamp())
+
+
+def test_replay_source_missing_symbol(tmp_path):
+    assert ReplaySource(str(tmp_path)).lookup_prices('NOPE') is None
+
+
+def test_missing_api_key_only_fails_when_used(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'file_name', str(tmp_path / 'configuration.ini'))
+    monkeypatch.setattr(config, '_config', None)
+
+    with pytest.raises(config.ConfigError, match='configuration.ini'):
+        config.get_api_key()
+
+    # Not a per-symbol failure, so it isn't handed to on_error
+    failures = []
+    with pytest.raises(config.ConfigError):
+        list(AmeritradeSource(base_url='http://127.0.0.1:9').lookup_prices_many(
+            ['AAPL', 'MSFT'], on_error=lambda symbol, error: failures.append(symbol)))
+    assert failures == []
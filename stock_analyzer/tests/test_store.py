@@ -0,0 +1,98 @@
+"""
+Unit tests for store
+"""
+
+import csv
+
+from stock_analyzer import core, scan, store
+
+DAY = 86_400_000
+
+
+def _detection(symbol, day, pattern_name='Ascending Triangle', profit_margin=10.0,
+               apex=3.0):
+    return {**dict.fromkeys(store.COLUMNS), 'symbol': symbol, 'detected_at': day * DAY,
+            'scanned_at': 0.0, 'pattern_name': pattern_name, 'breakout': 'up',
+            'profit_margin': profit_margin, 'apex': apex}
+
+
+def test_detection_records_flatten_a_scan_result(ascending_triangle):
+    result = scan.analyze('TRI', ascending_triangle, core.load_patterns())
+
+    records = store.detection_records(result, scanned_at=5.0)
+
+    assert [record['pattern_name'] for record in records] == ['Ascending Triangle']
+    assert set(records[0]) == set(store.COLUMNS)
+    assert records[0]['detected_at'] == 39 * DAY
+    assert records[0]['resistance_m'] == 0.0
+    assert records[0]['apex'] == result['apex']
+    assert store.detection_records(scan.analyze('NONE', None, [])) == []
+
+
+def test_reruns_replace_rather_than_duplicate(tmp_path, ascending_triangle):
+    results = [scan.analyze('TRI', ascending_triangle, core.load_patterns()),
+               scan.analyze('NONE', None, [])]
+    path = str(tmp_path / 'results.db')
+
+    for _ in range(2):
+        with store.ResultStore(path, batch_size=1) as result_store:
+            assert list(result_store.record(results)) == results
+
+    with store.ResultStore(path) as result_store:
+        records = result_store.query()
+    assert [(record['symbol'], record['pattern_name']) for record in records] == \
+           [('TRI', 'Ascending Triangle')]
+
+
+def test_query_filters(tmp_path):
+    with store.ResultStore(str(tmp_path / 'results.db'), batch_size=3) as result_store:
+        result_store.add([_detection('OLD', 1), _detection('NEW', 30),
+                          _detection('LOW', 29, profit_margin=5.0),
+                          _detection('FAR', 28, apex=20.0),
+                          _detection('PAST', 27, apex=-2.0),
+                          _detection('WEDGE', 26, pattern_name='Rising Wedge')])
+        result_store.add([_detection('PENDING', 25)])
+        assert len(result_store.pending) == 1
+
+        matches = result_store.query(pattern_name='Ascending Triangle', since=10 * DAY,
+                                     min_profit_margin=8, max_apex=5)
+        assert [record['symbol'] for record in matches] == ['NEW', 'PENDING']
+        assert [record['symbol'] for record in result_store.query(limit=2)] == \
+               ['NEW', 'LOW']
+        assert [record['symbol'] for record
+                in result_store.query(symbols=['OLD', 'WEDGE'], until=26 * DAY)] == \
+               ['OLD']
+
+
+def test_queries_use_an_index(tmp_path):
+    with store.ResultStore(str(tmp_path / 'results.db')) as result_store:
+        result_store.add([_detection(f"S{index}", index % 365,
+                                     ['Ascending Triangle', 'Rising Wedge'][index % 2],
+                                     profit_margin=index % 20, apex=index % 10)
+                          for index in range(20000)])
+        result_store.flush()
+
+        matches = result_store.query(pattern_name='Rising Wedge', since=360 * DAY,
+                                     min_profit_margin=8, max_apex=5)
+        plan = ' '.join(row[-1] for row in result_store.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM detections WHERE pattern_name = ? "
+            "AND detected_at >= ? ORDER BY detected_at DESC", ('Rising Wedge', 0)))
+
+    assert 'detections_by_pattern' in plan
+    assert matches and all(record['pattern_name'] == 'Rising Wedge'
+                           and record['detected_at'] >= 360 * DAY
+                           and record['profit_margin'] > 8
+                           and 0 <= record['apex'] <= 5 for record in matches)
+    assert [record['detected_at'] for record in matches] == \
+           sorted((record['detected_at'] for record in matches), reverse=True)
+
+
+def test_write_results_as_csv(tmp_path):
+    output_path = str(tmp_path / 'detections.csv')
+
+    store.write_results([_detection('NEW', 30)], output_path)
+
+    with open(output_path) as output_file:
+        rows = list(csv.DictReader(output_file))
+    assert [(row['symbol'], row['detected_at']) for row in rows] == \
+           [('NEW', str(30 * DAY))]
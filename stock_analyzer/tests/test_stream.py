@@ -0,0 +1,130 @@
+"""
+Unit tests for stream
+"""
+
+import json
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+from stock_analyzer import core, stream, synthetic
+
+
+def _raw_candles(prices):
+    """Synthetic prices with epoch millisecond datetimes, as a feed sends them."""
+
+    candles = prices.to_numpy(dtype=float, copy=True)
+    candles[:, 0] *= 86_400_000
+    return candles
+
+
+def _batch_summary(prices):
+    support_points, resistance_points = core.get_supports_and_resistances(prices, 2)
+    support = core.best_fit_line(prices['low'], support_points)
+    resistance = core.best_fit_line(prices['high'], resistance_points, False)
+    chart = core.Chart('SYN', prices, support, resistance, support_points,
+                       resistance_points, core.load_patterns(), verbose=False)
+    return _summary(chart)
+
+
+def _summary(chart):
+    return (chart.support_points, chart.resistance_points, repr(chart.support),
+            repr(chart.resistance),
+            [(trade.pattern_name, trade.breakout) for trade in chart.detected_patterns])
+
+
+@pytest.mark.parametrize('pattern', synthetic.PATTERNS)
+def test_symbol_stream_matches_batch_on_every_candle(pattern):
+    prices = synthetic.synthetic_prices(120, pattern, seed=3)
+    symbol_stream = stream.SymbolStream('SYN', core.load_patterns(), window=40)
+
+    for index, candle in enumerate(_raw_candles(prices)):
+        symbol_stream.update(candle)
+        if index >= 39:
+            window = prices.iloc[index - 39:index + 1].reset_index(drop=True)
+            assert _summary(symbol_stream.chart) == _batch_summary(window)
+
+    # Trendlines are only refitted for some candles of each side
+    assert symbol_stream.refits < 2 * (120 - 39)
+
+
+def test_forming_candles_replace_the_newest_candle():
+    candles = _raw_candles(synthetic.synthetic_prices(60, 'noise', seed=1))
+    final = stream.SymbolStream('SYN', core.load_patterns())
+    forming = stream.SymbolStream('SYN', core.load_patterns())
+
+    for candle in candles:
+        final.update(candle)
+
+        partial = candle.copy()
+        partial[2] = partial[3] = partial[1]
+        forming.update(partial)
+        forming.update(candle)
+
+    assert _summary(forming.chart) == _summary(final.chart)
+    # A candle older than the newest is ignored
+    assert forming.update(candles[0]) == []
+
+
+def test_socket_feed_builds_bars_from_ticks():
+    messages = [
+        {'symbol': 'AAA', 'datetime': 60_000, 'price': 10.0, 'volume': 1},
+        {'symbol': 'AAA', 'datetime': 90_000, 'price': 12.0, 'volume': 2},
+        {'symbol': 'AAA', 'datetime': 100_000, 'price': 9.0},
+        {'symbol': 'BBB', 'datetime': 60_000, 'open': 1, 'high': 2, 'low': 0.5,
+         'close': 1.5, 'volume': 100},
+        {'symbol': 'AAA', 'datetime': 120_000, 'price': 11.0, 'volume': 5},
+    ]
+
+    server = socket.create_server(('127.0.0.1', 0))
+
+    def send():
+        connection, _ = server.accept()
+        with connection:
+            connection.sendall(''.join(json.dumps(message) + '\n'
+                                       for message in messages).encode())
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    try:
+        received = list(stream.SocketFeed('127.0.0.1', server.getsockname()[1],
+                                          timeout=5))
+    finally:
+        sender.join()
+        server.close()
+
+    assert received == [
+        ('AAA', [60_000.0, 10.0, 10.0, 10.0, 10.0, 1.0]),
+        ('AAA', [60_000.0, 10.0, 12.0, 10.0, 12.0, 3.0]),
+        ('AAA', [60_000.0, 10.0, 12.0, 9.0, 9.0, 3.0]),
+        ('BBB', [60_000.0, 1.0, 2.0, 0.5, 1.5, 100.0]),
+        ('AAA', [120_000.0, 11.0, 11.0, 11.0, 11.0, 5.0]),
+    ]
+
+
+def test_watch_alerts_when_a_pattern_starts():
+    universe = synthetic.synthetic_universe(6, length=80)
+    feed = stream.ReplayFeed({symbol: _raw_candles(prices)
+                              for symbol, prices in universe.items()})
+
+    alerts = list(stream.watch(feed, core.load_patterns(), symbols=['SYN0', 'SYN1']))
+
+    expected = []
+    for symbol in ('SYN0', 'SYN1'):
+        prices = universe[symbol]
+        previous = []
+        for index in range(39, 80):
+            window = prices.iloc[index - 39:index + 1].reset_index(drop=True)
+            detected = _batch_summary(window)[-1]
+            expected += [(symbol, index, *trade) for trade in detected
+                         if trade not in previous]
+            previous = detected
+
+    first_day = universe['SYN0']['datetime'].iloc[0]
+    assert sorted((alert['symbol'],
+                   int(round(alert['datetime'] / 86_400_000 - first_day)),
+                   alert['pattern_name'], alert['breakout']) for alert in alerts) == \
+           sorted(expected)
+    assert np.all([alert['buy_price'] > 0 for alert in alerts])
@@ -0,0 +1,97 @@
+"""
+Unit tests for sweep
+"""
+
+import csv
+
+import pytest
+
+from stock_analyzer import core, sweep, synthetic
+from stock_analyzer.instrument import instrumentation
+from stock_analyzer.sources import AmeritradeSource
+from stock_analyzer.tests.conftest import end_date
+
+
+def test_parse_values():
+    assert sweep.parse_values('2,4,6', int) == (2, 4, 6)
+    assert sweep.parse_values('0.03:0.07:0.01') == (0.03, 0.04, 0.05, 0.06, 0.07)
+    assert sweep.parse_values('40:100:30', int) == (40, 70, 100)
+
+    with pytest.raises(ValueError):
+        sweep.parse_values('1:2:0')
+
+
+def test_parameter_grid_keeps_defaults():
+    grid = sweep.parameter_grid(n=(2, 4), margin=(0.03, 0.05))
+
+    assert [(parameters['n'], parameters['margin']) for parameters in grid] == \
+           [(2, 0.03), (2, 0.05), (4, 0.03), (4, 0.05)]
+    assert all(parameters['num_entries_to_analyze'] == 40 for parameters in grid)
+
+    with pytest.raises(ValueError):
+        sweep.parameter_grid(window=(40,))
+
+
+def _chart(prices, entries, n, margin, height_ratio, buy_threshold):
+    window = prices.iloc[-entries:].reset_index(drop=True)
+    support_points, resistance_points = core.get_supports_and_resistances(window, n)
+    support = core.best_fit_line(window['low'], support_points, margin=margin)
+    resistance = core.best_fit_line(window['high'], resistance_points, False,
+                                    margin=margin)
+    return core.Chart('SYN', window, support, resistance, support_points,
+                      resistance_points, core.load_patterns(), verbose=False,
+                      height_ratio=height_ratio, buy_threshold=buy_threshold)
+
+
+@pytest.mark.parametrize('pattern', ['triangle', 'noise'])
+def test_sweep_symbol_matches_the_pipeline(monkeypatch, pattern):
+    prices = synthetic.synthetic_prices(80, pattern, seed=2)
+    monkeypatch.setattr(instrumentation, 'enabled', True)
+    instrumentation.reset()
+
+    result = sweep.sweep_symbol('SYN', prices, core.load_patterns(), n=(2, 4),
+                                num_entries_to_analyze=(40, 60), margin=(0.03, 0.05),
+                                height_ratio=(0.5, 0.7), buy_threshold=(0.01, 0.02))
+    snapshot = instrumentation.snapshot()
+    instrumentation.reset()
+
+    # Extrema are found once per (entries, n) and trendlines once per margin on top
+    assert snapshot['counters']['sweep_combinations'] == 32
+    assert snapshot['timers']['extrema']['calls'] == 4
+    assert snapshot['timers']['best_fit_line']['calls'] == 2 * 8
+
+    assert len(result['combinations']) == 32
+    for row in result['combinations']:
+        chart = _chart(prices, row['num_entries_to_analyze'], row['n'], row['margin'],
+                       row['height_ratio'], row['buy_threshold'])
+        # Two-sided patterns are listed once, although the chart trades both breakouts
+        assert row['patterns'] == ';'.join(dict.fromkeys(
+            trade.pattern_name for trade in chart.detected_patterns))
+        if chart.detected_patterns:
+            trade = chart.detected_patterns[0]
+            assert (row['pattern_name'], row['breakout']) == \
+                   (trade.pattern_name, trade.breakout)
+            assert row['buy_price'] == pytest.approx(trade.buy_price)
+            assert row['sell_price'] == pytest.approx(trade.sell_price)
+
+
+def test_sweep_writes_rows_and_summary(price_history_stub, tmp_path, capsys):
+    base_url, requested = price_history_stub
+    output_path = tmp_path / 'sweep.csv'
+
+    results = sweep.sweep(['AAPL', 'MSFT', 'EMPTY'], core.load_patterns(), processes=2,
+                          source=AmeritradeSource(base_url=base_url),
+                          end_date=end_date(70), margin=(0.03, 0.05),
+                          height_ratio=(0.5, 0.7))
+    sweep.write_results(results, str(output_path))
+
+    assert sorted(symbol for symbol, _ in requested) == ['AAPL', 'EMPTY', 'MSFT']
+    with open(output_path) as output_file:
+        rows = list(csv.DictReader(output_file))
+    assert len(rows) == 2 * 4 + 1
+    assert {row['status'] for row in rows if row['symbol'] == 'EMPTY'} == {'no data'}
+
+    table = capsys.readouterr().out.splitlines()
+    assert table[0].split()[:3] == ['entries', 'n', 'margin']
+    assert len(table) == 1 + 4
+    assert all(line.split()[5] == '2' for line in table[1:])
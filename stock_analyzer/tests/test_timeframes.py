@@ -0,0 +1,106 @@
+"""
+Unit tests for timeframes
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from stock_analyzer import core, scan, timeframes
+from stock_analyzer.cache import CandleCache
+from stock_analyzer.sources import AmeritradeSource
+from stock_analyzer.tests.conftest import end_date
+
+
+def _hourly_candles(hours=24 * 45, seed=0):
+    """Hourly candles from 2021-01-04 00:00 New York time, with random prices."""
+
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2021-01-04', tz='America/New_York').value // 1_000_000
+    closes = 100 + np.cumsum(rng.normal(0, 1, hours))
+    return np.column_stack([start + np.arange(hours) * 3_600_000, closes - 0.5,
+                            closes + rng.uniform(0, 1, hours),
+                            closes - rng.uniform(0, 1, hours) - 0.5, closes,
+                            rng.integers(100, 1000, hours).astype(float)])
+
+
+@pytest.mark.parametrize('timeframe, rule', [('daily', 'D'), ('weekly', 'W-SUN'),
+                                             ('monthly', 'MS')])
+def test_resample_candles_matches_pandas(timeframe, rule):
+    candles = _hourly_candles()
+    frame = pd.DataFrame(candles[:, 1:], columns=['open', 'high', 'low', 'close',
+                                                  'volume'],
+                         index=pd.to_datetime(candles[:, 0], unit='ms', utc=True)
+                         .tz_convert('America/New_York'))
+    # Pandas labels weekly bars by their end, so compare values only
+    expected = frame.resample(rule).agg({'open': 'first', 'high': 'max', 'low': 'min',
+                                         'close': 'last', 'volume': 'sum'}).dropna()
+
+    bars = timeframes.resample_candles(candles, timeframe)
+
+    np.testing.assert_allclose(bars[:, 1:], expected.to_numpy())
+
+
+def test_resample_cached_rebuilds_only_the_tail(tmp_path):
+    cache = CandleCache(str(tmp_path))
+    candles = _hourly_candles()
+
+    first = timeframes.resample_cached(candles[:500], 'weekly', 'SYN', cache, 'minute',
+                                       60)
+    grown = timeframes.resample_cached(candles, 'weekly', 'SYN', cache, 'minute', 60)
+
+    np.testing.assert_array_equal(first, timeframes.resample_candles(candles[:500],
+                                                                     'weekly'))
+    np.testing.assert_array_equal(grown, timeframes.resample_candles(candles, 'weekly'))
+    cached, resampled_until = cache.load('SYN', 'weekly-from-minute', 60)
+    np.testing.assert_array_equal(cached, grown)
+    assert resampled_until == candles[-1, 0]
+
+
+def test_resample_cached_reuses_bars_of_a_sliding_window(tmp_path, monkeypatch):
+    cache = CandleCache(str(tmp_path))
+    candles = _hourly_candles()
+    timeframes.resample_cached(candles[:500], 'weekly', 'SYN', cache, 'minute', 60)
+
+    resampled = []
+    resample_candles = timeframes.resample_candles
+
+    def counted_resample(candles, *args):
+        resampled.append(len(candles))
+        return resample_candles(candles, *args)
+
+    monkeypatch.setattr(timeframes, 'resample_candles', counted_resample)
+
+    # The window slides forward by a few candles, starting partway through a week
+    for start in (3, 10, 100):
+        window = candles[start:start + 500]
+        bars = timeframes.resample_cached(window, 'weekly', 'SYN', cache, 'minute', 60)
+        np.testing.assert_array_equal(bars, resample_candles(window, 'weekly'))
+
+    assert resampled and max(resampled) < 250
+
+
+def test_fetch_parameters_use_the_finest_timeframe():
+    assert timeframes.fetch_parameters(['daily', 'weekly', 'monthly']) == {
+        'period': 5, 'period_type': 'year', 'frequency': 1, 'frequency_type': 'daily',
+        'num_entries_to_analyze': 41 * 21}
+    assert timeframes.fetch_parameters(['15minute', 'hourly'])['frequency'] == 15
+
+
+def test_scan_timeframes_fetches_each_symbol_once(price_history_stub):
+    base_url, requested = price_history_stub
+
+    results = list(timeframes.scan_timeframes(
+        ['AAPL', 'MSFT'], core.load_patterns(), ['daily', 'weekly'], processes=2,
+        source=AmeritradeSource(base_url=base_url), end_date=end_date(70)))
+
+    assert sorted(symbol for symbol, _ in requested) == ['AAPL', 'MSFT']
+
+    daily = scan.analyze('AAPL', core.lookup_prices('AAPL', end_date=end_date(70),
+                                                    base_url=base_url),
+                         core.load_patterns())
+    del daily['symbol']
+    for result in results:
+        assert result['status'] == 'ok'
+        assert list(result['timeframes']) == ['daily', 'weekly']
+        assert result['timeframes']['daily'] == daily
@@ -0,0 +1,117 @@
+"""
+Unit tests for universe
+"""
+
+import json
+import os
+import sys
+import time
+import urllib.error
+
+import pandas as pd
+import pytest
+
+from stock_analyzer import cli, synthetic, universe
+
+
+def _fetcher(calls, fail=False):
+    def fetch():
+        calls.append(time.time())
+        if fail:
+            raise urllib.error.URLError('offline')
+        return universe.normalize(pd.DataFrame({
+            'Symbol': ['AAPL', 'XOM', 'MSFT'],
+            'Security': ['Apple', 'Exxon Mobil', 'Microsoft'],
+            'GICS Sector': ['Information Technology', 'Energy',
+                            'Information Technology']}))
+    return fetch
+
+
+def test_read_universe_files(tmp_path):
+    csv_path = tmp_path / 'russell.csv'
+    csv_path.write_text('Ticker,Name\naapl,Apple\n ge ,General Electric\n,\n')
+    watchlist_path = tmp_path / 'watchlist.txt'
+    watchlist_path.write_text('# Mine\nmsft, aapl\nTSLA  # electric\n')
+
+    from_csv = universe.read_universe(str(csv_path))
+    watchlist = universe.read_universe(str(watchlist_path))
+
+    assert list(from_csv.columns) == universe.COLUMNS
+    assert list(from_csv['symbol']) == ['AAPL', 'GE']
+    assert list(from_csv['company_name']) == ['Apple', 'General Electric']
+    assert list(watchlist['symbol']) == ['MSFT', 'AAPL', 'TSLA']
+    assert list(universe.merge_universes(from_csv, watchlist)['symbol']) == \
+           ['AAPL', 'GE', 'MSFT', 'TSLA']
+
+
+def test_get_universe_caches_with_a_ttl(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setitem(universe.FETCHERS, 'sp500', _fetcher(calls))
+    cache = universe.UniverseCache(str(tmp_path), ttl=60)
+
+    first = universe.get_universe('sp500', cache)
+    second = universe.get_universe('sp500', cache)
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(first, second)
+
+    expired = time.time() - 120
+    os.utime(tmp_path / 'sp500.csv', (expired, expired))
+    universe.get_universe('sp500', cache)
+    assert len(calls) == 2
+
+    universe.get_universe('sp500', cache, refresh=True)
+    assert len(calls) == 3
+
+
+def test_get_universe_falls_back_to_the_cache_offline(monkeypatch, tmp_path, capsys):
+    calls = []
+    cache = universe.UniverseCache(str(tmp_path), ttl=0)
+
+    monkeypatch.setitem(universe.FETCHERS, 'sp500', _fetcher(calls, fail=True))
+    with pytest.raises(universe.UniverseError):
+        universe.get_universe('sp500', cache)
+
+    monkeypatch.setitem(universe.FETCHERS, 'sp500', _fetcher(calls))
+    online = universe.get_universe('sp500', cache)
+
+    monkeypatch.setitem(universe.FETCHERS, 'sp500', _fetcher(calls, fail=True))
+    offline = universe.get_universe('sp500', cache)
+
+    pd.testing.assert_frame_equal(online, offline)
+    assert 'using the cached copy' in capsys.readouterr().err
+    assert len(calls) == 3
+
+
+def test_get_universes_merges_and_filters_sectors(monkeypatch, tmp_path):
+    monkeypatch.setitem(universe.FETCHERS, 'sp500', _fetcher([]))
+    watchlist_path = tmp_path / 'watchlist.txt'
+    watchlist_path.write_text('XOM CVX')
+    cache = universe.UniverseCache(str(tmp_path / 'cache'))
+
+    merged = universe.get_universes(['sp500', str(watchlist_path)], cache)
+    energy = universe.get_universes(['sp500', str(watchlist_path)], cache,
+                                    sectors=['energy'])
+
+    assert list(merged['symbol']) == ['AAPL', 'XOM', 'MSFT', 'CVX']
+    assert list(energy['symbol']) == ['XOM']
+
+    with pytest.raises(universe.UniverseError):
+        universe.get_universe(str(tmp_path / 'missing.txt'), cache)
+
+
+def test_scan_a_watchlist_universe(monkeypatch, tmp_path):
+    prices = synthetic.synthetic_prices(60, 'triangle')
+    prices['datetime'] = (prices['datetime'] * 86400000).astype('int64')
+    prices.to_csv(tmp_path / 'TRI.csv', index=False)
+    watchlist_path = tmp_path / 'watchlist.txt'
+    watchlist_path.write_text('tri\nTRI\n')
+    output_path = tmp_path / 'scan.jsonl'
+    monkeypatch.setattr(sys, 'argv', ['cli.py', '--scan', f"--universe={watchlist_path}",
+                                      f"--replay={tmp_path}", f"--output={output_path}",
+                                      '--processes=1', '--no-cache'])
+
+    cli.main()
+
+    with open(output_path) as output_file:
+        results = [json.loads(line) for line in output_file]
+    assert [result['symbol'] for result in results] == ['TRI']
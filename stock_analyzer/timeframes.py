@@ -0,0 +1,314 @@
+import csv
+import math
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from stock_analyzer import core, scan
+from stock_analyzer.cache import CandleCache
+
+
+# Length of one bar of each timeframe, in minutes of regular trading
+TIMEFRAME_MINUTES = {
+    'minute': 1,
+    '5minute': 5,
+    '10minute': 10,
+    '15minute': 15,
+    '30minute': 30,
+    'hourly': 60,
+    'daily': 390,
+    'weekly': 5 * 390,
+    'monthly': 21 * 390,
+}
+
+# Pandas frequency each timeframe's bars are aligned to
+_FREQUENCIES = {'minute': 'min', '5minute': '5min', '10minute': '10min',
+                '15minute': '15min', '30minute': '30min', 'hourly': 'h', 'daily': 'D',
+                'weekly': 'W', 'monthly': 'M'}
+
+DEFAULT_TIMEFRAMES = ('daily', 'weekly')
+
+# Bars are aligned to days, weeks and months of the exchange's local time
+DEFAULT_TIMEZONE = 'America/New_York'
+
+# The minute frequencies and periods Ameritrade serves
+_MINUTE_FREQUENCIES = (1, 5, 10, 15, 30)
+_DAY_PERIODS = (1, 2, 3, 4, 5, 10)
+_YEAR_PERIODS = (1, 2, 3, 5, 10, 15, 20)
+
+
+def _bucket_starts(datetimes: np.array, timeframe: str, timezone: str) -> np.array:
+    """Returns the start of the timeframe bar each epoch millisecond datetime falls in."""
+
+    local = pd.DatetimeIndex(pd.to_datetime(datetimes, unit='ms', utc=True)) \
+        .tz_convert(timezone).tz_localize(None)
+
+    if timeframe in ('weekly', 'monthly'):
+        return local.to_period(_FREQUENCIES[timeframe]).start_time.asi8
+
+    return local.floor(_FREQUENCIES[timeframe]).asi8
+
+
+def resample_candles(candles: np.array, timeframe: str,
+                     timezone: str = DEFAULT_TIMEZONE) -> np.array:
+    """
+    A function that combines candles into coarser OHLCV bars.
+
+    :param candles: An (n, 6) array of candles sorted by datetime, with epoch millisecond
+                    datetimes.
+    :param timeframe: One of TIMEFRAME_MINUTES, coarser than the candles.
+    :param timezone: The time zone that days, weeks and months are counted in.
+    :return: An (m, 6) array of bars. Each bar is dated by its first candle, opens at its
+             first candle's open, closes at its last candle's close and has the highest
+             high, lowest low and total volume of its candles.
+    """
+
+    if timeframe not in TIMEFRAME_MINUTES:
+        raise ValueError(f"Unknown timeframe {timeframe}, expected one of "
+                         f"{list(TIMEFRAME_MINUTES)}")
+
+    if len(candles) == 0:
+        return candles[:0]
+
+    buckets = _bucket_starts(candles[:, 0], timeframe, timezone)
+    starts = np.flatnonzero(np.concatenate([[True], buckets[1:] != buckets[:-1]]))
+    ends = np.append(starts[1:], len(candles)) - 1
+
+    return np.column_stack([candles[starts, 0],
+                            candles[starts, 1],
+                            np.maximum.reduceat(candles[:, 2], starts),
+                            np.minimum.reduceat(candles[:, 3], starts),
+                            candles[ends, 4],
+                            np.add.reduceat(candles[:, 5], starts)])
+
+
+def resample_cached(candles: np.array, timeframe: str, symbol: str = None,
+                    cache: CandleCache = None, frequency_type: str = 'daily',
+                    frequency: int = 1, timezone: str = DEFAULT_TIMEZONE) -> np.array:
+    """
+    A function that resamples candles, reusing bars cached by an earlier call.
+
+    Resampled bars are stored in the CandleCache next to the candles they came from. When
+    the candles overlap the cached ones and have only grown at the end, or slid forward
+    like a rolling lookup window, the cached bars are reused. Bars before the new first
+    candle are dropped, and only the first bar, which the window may now start partway
+    through, and the last cached bar and anything after it are rebuilt.
+
+    :param candles: An (n, 6) array of candles sorted by datetime, with epoch millisecond
+                    datetimes.
+    :param timeframe: One of TIMEFRAME_MINUTES, coarser than the candles.
+    :param symbol: The symbol of the candles. Nothing is cached without one.
+    :param cache: The CandleCache to keep bars in. Nothing is cached without one.
+    :param frequency_type: The frequency type the candles were fetched at.
+    :param frequency: The frequency the candles were fetched at.
+    :param timezone: The time zone that days, weeks and months are counted in.
+    :return: An (m, 6) array of bars, as returned by resample_candles.
+    """
+
+    if cache is None or symbol is None or len(candles) == 0:
+        return resample_candles(candles, timeframe, timezone)
+
+    cache_key = f"{timeframe}-from-{frequency_type}"
+    bars, resampled_until = cache.load(symbol, cache_key, frequency)
+
+    # Cached bars dated from the new first candle on are whole bars of the new window
+    kept = bars[bars[:, 0] >= candles[0, 0]] if bars is not None else None
+    if kept is None or len(kept) == 0 or bars[0, 0] > candles[0, 0] \
+            or resampled_until > candles[-1, 0]:
+        bars = resample_candles(candles, timeframe, timezone)
+    elif len(kept) == len(bars) and resampled_until == candles[-1, 0]:
+        return bars
+    else:
+        head = candles[candles[:, 0] < kept[0, 0]]
+        tail = candles[candles[:, 0] >= kept[-1, 0]]
+        bars = np.concatenate([resample_candles(head, timeframe, timezone), kept[:-1],
+                               resample_candles(tail, timeframe, timezone)])
+
+    cache.store(symbol, cache_key, frequency, bars, int(candles[-1, 0]))
+
+    return bars
+
+
+def fetch_parameters(timeframes: [str], num_entries_to_analyze: int = 40) -> dict:
+    """
+    A function that chooses the single fetch all timeframes can be resampled from.
+
+    Candles are fetched at the finest timeframe asked for, over a long enough period to
+    give num_entries_to_analyze bars of the coarsest. Minute candles are only served for
+    the last 10 days, so coarse timeframes mixed with intraday ones may get fewer bars.
+
+    :param timeframes: Timeframes from TIMEFRAME_MINUTES.
+    :param num_entries_to_analyze: The number of bars analyzed on each timeframe.
+    :return: A dictionary of lookup_prices parameters.
+    """
+
+    minutes = [TIMEFRAME_MINUTES[timeframe] for timeframe in timeframes]
+    intraday = [minute for minute in minutes if minute < TIMEFRAME_MINUTES['daily']]
+
+    if intraday:
+        frequency = max(allowed for allowed in _MINUTE_FREQUENCIES
+                        if math.gcd(*intraday) % allowed == 0)
+        frequency_type = 'minute'
+        days = num_entries_to_analyze * max(minutes) / TIMEFRAME_MINUTES['daily']
+        period_type = 'day'
+        period = next((period for period in _DAY_PERIODS if period >= days),
+                      _DAY_PERIODS[-1])
+        candle_minutes = frequency
+    else:
+        frequency = 1
+        frequency_type = 'daily'
+        years = num_entries_to_analyze * max(minutes) / TIMEFRAME_MINUTES['daily'] / 252
+        period_type = 'year'
+        period = next((period for period in _YEAR_PERIODS if period >= years),
+                      _YEAR_PERIODS[-1])
+        candle_minutes = TIMEFRAME_MINUTES['daily']
+
+    # One extra bar of the coarsest timeframe, as the first one is usually partial
+    candles_needed = (num_entries_to_analyze + 1) * max(minutes) // candle_minutes
+
+    return {'period': period, 'period_type': period_type, 'frequency': frequency,
+            'frequency_type': frequency_type, 'num_entries_to_analyze': candles_needed}
+
+
+def analyze_timeframes(symbol: str, price_history, patterns: [core.Pattern], n: int = 2,
+                       chart_directory: str = None, chart_format: str = 'png',
+                       detected_only: bool = True, fitter: str = 'pairs',
+                       timeframes: [str] = DEFAULT_TIMEFRAMES,
+                       num_entries_to_analyze: int = 40, cache: CandleCache = None,
+                       frequency_type: str = 'daily', frequency: int = 1,
+                       timezone: str = DEFAULT_TIMEZONE) -> dict:
+    """
+    A function that runs the analysis pipeline on several timeframes of one fetch.
+
+    :param symbol: A stock symbol. Example: 'AAPL'
+    :param price_history: Candles or a Pandas Dataframe at the finest timeframe, as
+                          returned by lookup_prices with fetch_parameters, or None.
+    :param patterns: List of Pattern objects to detect.
+    :param n: The number of entries scanned for local minima/maxima.
+    :param chart_directory: Directory to render charts to, in one subdirectory per
+                            timeframe.
+    :param chart_format: 'png', 'svg' or any other format Matplotlib can save.
+    :param detected_only: Only render charts with a detected pattern.
+    :param fitter: The trendline fitter, 'pairs' or 'hull'. See core.best_fit_line.
+    :param timeframes: Timeframes from TIMEFRAME_MINUTES to analyze.
+    :param num_entries_to_analyze: The number of bars analyzed on each timeframe.
+    :param cache: A CandleCache to keep resampled bars in.
+    :param frequency_type: The frequency type price_history was fetched at.
+    :param frequency: The frequency price_history was fetched at.
+    :param timezone: The time zone that days, weeks and months are counted in.
+    :return: A dictionary with the symbol, its status and a 'timeframes' dictionary of
+             timeframe -> scan.analyze dictionary, without the symbol.
+    """
+
+    if price_history is None:
+        return {'symbol': symbol, 'status': 'no data', 'timeframes': {}}
+
+    candles = np.array(price_history, dtype=float)
+    candles[:, 0] = np.round(candles[:, 0] * 86_400_000)
+
+    results = {}
+    for timeframe in timeframes:
+        bars = resample_cached(candles, timeframe, symbol, cache, frequency_type,
+                               frequency, timezone)
+
+        timeframe_directory = None
+        if chart_directory:
+            timeframe_directory = os.path.join(chart_directory, timeframe)
+            os.makedirs(timeframe_directory, exist_ok=True)
+
+        result = scan.analyze(symbol,
+                              core.candle_frame(bars, num_entries_to_analyze, False),
+                              patterns, n, timeframe_directory, chart_format,
+                              detected_only, fitter)
+        del result['symbol']
+        results[timeframe] = result
+
+    return {'symbol': symbol, 'status': 'ok', 'timeframes': results}
+
+
+def scan_timeframes(symbols: [str], patterns: [core.Pattern],
+                    timeframes: [str] = DEFAULT_TIMEFRAMES, processes: int = None,
+                    source=None, cache: CandleCache = None,
+                    num_entries_to_analyze: int = 40, timezone: str = DEFAULT_TIMEZONE,
+                    **kwargs):
+    """
+    A generator that analyzes many symbols on several timeframes, fetching each once.
+
+    :param symbols: A list of stock symbols.
+    :param patterns: List of Pattern objects to detect.
+    :param timeframes: Timeframes from TIMEFRAME_MINUTES to analyze.
+    :param processes: The number of worker processes. Defaults to the number of CPUs.
+    :param source: Where prices come from. Defaults to the Ameritrade API.
+    :param cache: A CandleCache to keep resampled bars in.
+    :param num_entries_to_analyze: The number of bars analyzed on each timeframe.
+    :param timezone: The time zone that days, weeks and months are counted in.
+    :param kwargs: end_date, or any scan_histories parameters such as n or
+                   chart_directory.
+    :return: Yields one analyze_timeframes dictionary per symbol.
+    """
+
+    if source is None:
+        from stock_analyzer.sources import AmeritradeSource
+        source = AmeritradeSource(cache=cache)
+
+    parameters = fetch_parameters(timeframes, num_entries_to_analyze)
+    price_histories = source.lookup_prices_many(symbols, as_frame=False,
+                                                end_date=kwargs.pop('end_date', ""),
+                                                **parameters)
+
+    return scan.scan_histories(price_histories, patterns, processes=processes,
+                               analyzer=analyze_timeframes, timeframes=tuple(timeframes),
+                               num_entries_to_analyze=num_entries_to_analyze,
+                               cache=cache, frequency_type=parameters['frequency_type'],
+                               frequency=parameters['frequency'], timezone=timezone,
+                               **kwargs)
+
+
+def write_csv(results, timeframes: [str], output_file) -> None:
+    """
+    A function that writes multi-timeframe results as CSV, one row per symbol.
+
+    Each timeframe gets a column listing the patterns detected on it, separated by
+    semicolons, so the timeframes of a symbol can be compared side by side.
+
+    :param results: An iterable of analyze_timeframes dictionaries.
+    :param timeframes: The timeframes analyzed, in column order.
+    :param output_file: A writable text file.
+    :return: None.
+    """
+
+    writer = csv.DictWriter(output_file, fieldnames=['symbol', 'status', *timeframes])
+    writer.writeheader()
+
+    for result in results:
+        row = {'symbol': result['symbol'], 'status': result['status']}
+        for timeframe, analysis in result.get('timeframes', {}).items():
+            row[timeframe] = ';'.join(pattern['pattern_name']
+                                      for pattern in analysis['patterns'])
+
+        writer.writerow(row)
+        output_file.flush()
+
+
+def write_results(results, timeframes: [str], output_path: str = None) -> None:
+    """
+    A function that writes multi-timeframe results, choosing the format by extension.
+
+    :param results: An iterable of analyze_timeframes dictionaries.
+    :param timeframes: The timeframes analyzed.
+    :param output_path: A .csv path for CSV, any other path for JSON Lines. Writes JSON
+                        Lines to stdout if None.
+    :return: None.
+    """
+
+    if output_path is None:
+        scan.write_jsonl(results, sys.stdout)
+        return
+
+    with open(output_path, 'w', newline='') as output_file:
+        if os.path.splitext(output_path)[1].lower() == '.csv':
+            write_csv(results, timeframes, output_file)
+        else:
+            scan.write_jsonl(results, output_file)
@@ -0,0 +1,232 @@
+import os
+import sys
+import tempfile
+import time
+
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'stock_analyzer',
+                                 'universes')
+
+# Index constituents change a few times a quarter, so a week old list is close enough
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+COLUMNS = ['symbol', 'company_name', 'sector']
+
+# Column names of universe files and tables that mean one of COLUMNS
+_COLUMN_ALIASES = {'ticker': 'symbol', 'security': 'company_name', 'name': 'company_name',
+                   'company': 'company_name', 'gics sector': 'sector'}
+
+S_AND_P_500_URL = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
+
+
+class UniverseError(Exception):
+    """Raised when a universe can't be fetched and there is no cached copy of it"""
+
+
+def fetch_s_and_p_500() -> 'pd.DataFrame':
+    """
+    A function to download the S&P 500 constituents from Wikipedia.
+
+    Credit: https://medium.com/wealthy-bytes/5-lines-of-python-to-automate-getting-the-s-p-500-95a632e5e567
+    :return: pandas.DataFrame[['symbol', 'company_name', 'sector']]
+    """
+
+    import pandas as pd
+
+    return normalize(pd.read_html(S_AND_P_500_URL)[0])
+
+
+# Universes that are downloaded rather than read from a file, by name
+FETCHERS = {'sp500': fetch_s_and_p_500}
+
+
+class UniverseCache:
+    """On-disk store of downloaded universes, refreshed once they are older than a TTL"""
+
+    def __init__(self, directory: str = DEFAULT_DIRECTORY, ttl: float = DEFAULT_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.csv")
+
+    def load(self, name: str) -> ('pd.DataFrame', float):
+        """A function to read a cached universe.
+
+        :param name: The universe name. Example: 'sp500'
+        :return: A tuple of the universe and its age in seconds. (None, None) if nothing
+                 is cached.
+        """
+
+        path = self._path(name)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            return read_universe(path), age
+        except (OSError, ValueError):
+            return None, None
+
+    def store(self, name: str, universe: 'pd.DataFrame') -> None:
+        """A function to write a universe, replacing any cached copy.
+
+        :param name: The universe name. Example: 'sp500'
+        :param universe: A DataFrame with COLUMNS.
+        :return: None.
+        """
+
+        # Write to a temporary file first so readers never see a partial list
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'w', newline='') as temp_file:
+                universe.to_csv(temp_file, index=False)
+            os.replace(temp_path, self._path(name))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def invalidate(self) -> None:
+        """A function to delete every cached universe."""
+
+        for filename in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+
+
+def normalize(universe: 'pd.DataFrame') -> 'pd.DataFrame':
+    """
+    A function that brings a table of symbols to the COLUMNS layout.
+
+    Column names are matched case-insensitively, and 'Ticker', 'Security', 'Name' and
+    'GICS Sector' are understood. Symbols are stripped and upper-cased, and empty symbols
+    are dropped.
+
+    :param universe: A DataFrame with at least a symbol or ticker column.
+    :return: A DataFrame with COLUMNS. Missing company names and sectors are empty.
+    """
+
+    renamed = {}
+    for column in universe.columns:
+        name = str(column).strip().lower()
+        name = _COLUMN_ALIASES.get(name, name)
+        if name in COLUMNS and name not in renamed.values():
+            renamed[column] = name
+
+    if 'symbol' not in renamed.values():
+        raise ValueError(f"No symbol column in {list(universe.columns)}")
+
+    universe = universe[list(renamed)].rename(columns=renamed)
+    universe = universe.reindex(columns=COLUMNS).fillna('').astype(str)
+    universe['symbol'] = universe['symbol'].str.strip().str.upper()
+
+    return universe[universe['symbol'] != ''].reset_index(drop=True)
+
+
+def read_universe(path: str) -> 'pd.DataFrame':
+    """
+    A function that reads a universe from a local file.
+
+    CSV files need a header with a symbol (or ticker) column, and may have company name
+    and sector columns. Any other file is a watchlist: symbols separated by commas,
+    spaces or new lines, with '#' starting a comment.
+
+    :param path: A .csv file, or a watchlist file.
+    :return: A DataFrame with COLUMNS.
+    """
+
+    import pandas as pd
+
+    if os.path.splitext(path)[1].lower() == '.csv':
+        return normalize(pd.read_csv(path, dtype=str))
+
+    symbols = []
+    with open(path) as watchlist:
+        for line in watchlist:
+            symbols += line.split('#', 1)[0].replace(',', ' ').split()
+
+    return normalize(pd.DataFrame({'symbol': symbols}))
+
+
+def merge_universes(*universes: 'pd.DataFrame') -> 'pd.DataFrame':
+    """
+    A function that combines universes, dropping repeated symbols.
+
+    :param universes: DataFrames with COLUMNS.
+    :return: A DataFrame with COLUMNS and unique symbols, in the order they first appear.
+    """
+
+    import pandas as pd
+
+    if not universes:
+        return pd.DataFrame(columns=COLUMNS)
+
+    merged = pd.concat(universes, ignore_index=True)
+    return merged.drop_duplicates('symbol').reset_index(drop=True)
+
+
+def get_universe(name: str = 'sp500', cache: UniverseCache = None,
+                 refresh: bool = False) -> 'pd.DataFrame':
+    """
+    A function to get the symbols of one universe.
+
+    Downloaded universes are kept in the cache and only fetched again once older than
+    its TTL. If a fetch fails, the cached copy is used however old it is.
+
+    :param name: A name from FETCHERS, or the path of a universe file for read_universe.
+    :param cache: Where downloaded universes are kept. Defaults to a UniverseCache in
+                  the default directory.
+    :param refresh: Fetch the universe even if the cached copy is recent.
+    :return: A DataFrame with COLUMNS.
+    """
+
+    if name not in FETCHERS:
+        if not os.path.exists(name):
+            raise UniverseError(f"Unknown universe {name}, expected a file or one of "
+                                f"{', '.join(FETCHERS)}")
+        return read_universe(name)
+
+    if cache is None:
+        cache = UniverseCache()
+
+    cached, age = cache.load(name)
+    if cached is not None and not refresh and age <= cache.ttl:
+        return cached
+
+    try:
+        universe = FETCHERS[name]()
+    except (OSError, ValueError, ImportError) as error:
+        if cached is None:
+            raise UniverseError(f"Could not fetch the {name} universe ({error}), check "
+                                f"your internet connection and try again.") from error
+
+        print(f"Could not refresh the {name} universe ({error}), using the cached copy "
+              f"from {age / 3600:.0f} hours ago.", file=sys.stderr)
+        return cached
+
+    cache.store(name, universe)
+
+    return universe
+
+
+def get_universes(names: [str], cache: UniverseCache = None, refresh: bool = False,
+                  sectors: [str] = None) -> 'pd.DataFrame':
+    """
+    A function to merge several universes, optionally keeping only some sectors.
+
+    :param names: Names or paths, as for get_universe.
+    :param cache: Where downloaded universes are kept.
+    :param refresh: Fetch downloaded universes even if the cached copies are recent.
+    :param sectors: Only keep symbols whose sector is one of these, ignoring case.
+    :return: A DataFrame with COLUMNS and unique symbols.
+    """
+
+    universe = merge_universes(*(get_universe(name, cache, refresh) for name in names))
+
+    if sectors:
+        wanted = {sector.strip().lower() for sector in sectors}
+        universe = universe[universe['sector'].str.lower().isin(wanted)]
+        universe = universe.reset_index(drop=True)
+
+    return universe